@@ -0,0 +1,220 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import subprocess
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+import requests
+
+from extract_data.benchmarks.synthetic_node import SyntheticChain, generate_addresses, serve
+from extract_data.main_program import mainApp
+from extract_data.main_program.blockchain_interactions.web3_manager import Web3Manager
+
+ABI_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests", "resources",
+                          "abi_files")
+HEAD_BLOCK = 15000000
+AIRDROP_BLOCKS = 20000
+
+# Scenario's name: function which runs it with a Web3Manager and an app-config.json
+SCENARIOS: Dict[str, Callable] = {
+    "transaction_history_contract": lambda web3_manager, app_config: mainApp.get_transaction_history_contract(
+        web3_manager, app_config["addresses_get_info"][0], app_config),
+    "transaction_history_addresses": lambda web3_manager, app_config: mainApp.get_transaction_history_addresses(
+        web3_manager, app_config["addresses_get_info"], app_config),
+    "airdrop": mainApp.get_median_claim_account,
+    "compound_tokens": mainApp.get_events_compound_token,
+    "balances": lambda web3_manager, app_config: web3_manager.get_balances(app_config["addresses_get_info"],
+                                                                           app_config["erc20_list"])
+}
+
+
+def get_app_config(node_uri: str, num_tokens: int, num_addresses: int, num_blocks: int,
+                   config_overrides: dict = None) -> dict:
+    """
+        Description: Creates the app-config.json of a synthetic chain. ABIs are taken from the tests' resources
+        Args:
+            node_uri (str): Endpoint of the synthetic node
+            num_tokens (int): Number of erc20 tokens (the number of compound tokens is the same)
+            num_addresses (int): Number of tracked addresses
+            num_blocks (int): Number of blocks analyzed by every scenario
+            config_overrides (dict): Parameters which replace the generated ones
+
+        Returns: The app-config.json
+    """
+    app_config = {
+        "ethereum_node": node_uri,
+        "addresses_get_info": [address.lower() for address in generate_addresses("address", num_addresses)],
+        "track_history_in_last_blocks": num_blocks,
+        "logs_folder": "logs",
+        "results_path": "results.json",
+        "erc20_list": [{"name": f"TOKEN{index}", "tokenAddress": address,
+                        "abi_path": os.path.join(ABI_FOLDER, "matic.abi.json")}
+                       for index, address in enumerate(generate_addresses("token", num_tokens))],
+        "compound_tokens": [{"name": f"cTOKEN{index}", "tokenAddress": address,
+                             "abi_path": os.path.join(ABI_FOLDER, "cusdc.abi.json")}
+                            for index, address in enumerate(generate_addresses("ctoken", num_tokens))],
+        "airdrop_info": {
+            "airdrop_address_example": generate_addresses("airdrop", 1)[0],
+            "airdrop_address_abi": os.path.join(ABI_FOLDER, "airdrop-example.abi.json"),
+            "airdrop_from_block": HEAD_BLOCK - AIRDROP_BLOCKS - num_blocks + 1,
+            "airdrop_to_block": HEAD_BLOCK - AIRDROP_BLOCKS
+        }
+    }
+    app_config.update(config_overrides or {})
+    return app_config
+
+
+def start_node(app_config: dict, log_density: float, max_logs_per_request: int = None) \
+        -> multiprocessing.Process:
+    """
+        Description: Starts a synthetic node in another process, so it doesn't share the CPU and the memory
+            measurements of the program. The endpoint of the node is written in app_config["ethereum_node"]
+        Args:
+            app_config (dict): app-config.json created by get_app_config
+            log_density (float): Probability of a block having logs
+            max_logs_per_request (int): If it's defined, eth_getLogs fails when it would return more logs
+
+        Returns: The process of the node
+    """
+    ports = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run_node, args=(app_config, log_density, max_logs_per_request, ports),
+                                      daemon=True)
+    process.start()
+    app_config["ethereum_node"] = f"http://127.0.0.1:{ports.get(timeout=30)}"
+    return process
+
+
+def _run_node(app_config: dict, log_density: float, max_logs_per_request: int, ports: multiprocessing.Queue):
+    chain = SyntheticChain(HEAD_BLOCK, [erc20["tokenAddress"] for erc20 in app_config["erc20_list"]],
+                           [ctoken["tokenAddress"] for ctoken in app_config["compound_tokens"]],
+                           app_config["airdrop_info"]["airdrop_address_example"], app_config["addresses_get_info"],
+                           log_density, max_logs_per_request=max_logs_per_request)
+    server = serve(chain)
+    ports.put(server.server_address[1])
+    server.serve_forever()
+
+
+def call_node(node_uri: str, method: str):
+    return requests.post(node_uri, json={"jsonrpc": "2.0", "method": method, "params": [], "id": 0}).json()["result"]
+
+
+def run_scenario(name: str, app_config: dict, trace_memory: bool = True) -> dict:
+    """
+        Description: Runs a scenario with a new Web3Manager (without any cache shared with other scenarios)
+        Args:
+            name (str): Scenario's name (see SCENARIOS)
+            app_config (dict): app-config.json of a running synthetic node
+            trace_memory (bool): If the peak memory is measured (tracemalloc slows the scenario down)
+
+        Returns: Wall time, requests by method, http requests, peak memory and logs per second of the scenario
+    """
+    logging.info(f"Benchmark {name} starts.")
+    web3_manager = Web3Manager(app_config)
+    call_node(app_config["ethereum_node"], "synthetic_resetStats")
+
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    SCENARIOS[name](web3_manager, app_config)
+    wall_time = time.perf_counter() - start
+    web3_manager.cpu_pool.shutdown()
+    peak_memory = None
+    if trace_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    stats = call_node(app_config["ethereum_node"], "synthetic_getStats")
+    logs = stats.pop("logs", 0)
+    return {
+        "wall_time_s": round(wall_time, 4),
+        "rpc_calls": dict(sorted(stats.items())),
+        "total_rpc_calls": sum(calls for method, calls in stats.items() if method != "http_requests"),
+        "peak_memory_mb": round(peak_memory / 1024 / 1024, 3) if peak_memory is not None else None,
+        "logs": logs,
+        "logs_per_second": round(logs / wall_time, 1) if wall_time > 0 else None
+    }
+
+
+def run_benchmarks(scenarios: List[str], log_density: float = 0.05, num_tokens: int = 2, num_addresses: int = 3,
+                   num_blocks: int = 20000, config_overrides: dict = None, max_logs_per_request: int = None,
+                   trace_memory: bool = True) -> dict:
+    """
+        Description: Runs several scenarios against the same synthetic node
+        Args:
+            scenarios (List[str]): Scenarios' names (see SCENARIOS)
+            log_density (float): Probability of a block having logs
+            num_tokens (int): Number of erc20 tokens and of compound tokens
+            num_addresses (int): Number of tracked addresses
+            num_blocks (int): Number of blocks analyzed by every scenario
+            config_overrides (dict): Parameters of app-config.json which replace the generated ones
+            max_logs_per_request (int): If it's defined, eth_getLogs fails when it would return more logs
+            trace_memory (bool): If the peak memory is measured
+
+        Returns: The parameters of the run and the results of every scenario
+    """
+    app_config = get_app_config("", num_tokens, num_addresses, num_blocks, config_overrides)
+    node = start_node(app_config, log_density, max_logs_per_request)
+    try:
+        results = {name: run_scenario(name, app_config, trace_memory) for name in scenarios}
+    finally:
+        node.terminate()
+
+    return {
+        "commit": get_commit(),
+        "parameters": {"log_density": log_density, "num_tokens": num_tokens, "num_addresses": num_addresses,
+                       "num_blocks": num_blocks, "max_logs_per_request": max_logs_per_request,
+                       "config_overrides": config_overrides or {}},
+        "scenarios": results
+    }
+
+
+def get_commit() -> str:
+    """
+        Description: Gets the git commit of the code being measured
+        Args: None
+
+        Returns: The commit's hash, or None outside a git repository
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    """
+        Description: The entry point of the benchmarks
+        Args: -o <path_results> [--scenarios ...] [--log-density] [--tokens] [--addresses] [--blocks]
+            [--config-overrides <json>] [--max-logs-per-request] [--no-memory]
+    """
+
+    parser = argparse.ArgumentParser(prog='benchmarks')
+    parser.add_argument('-o', default='benchmark_results.json', help='path of the results')
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--log-density', type=float, default=0.05, help='probability of a block having logs')
+    parser.add_argument('--tokens', type=int, default=2, help='number of erc20 tokens and compound tokens')
+    parser.add_argument('--addresses', type=int, default=3, help='number of tracked addresses')
+    parser.add_argument('--blocks', type=int, default=20000, help='number of blocks analyzed by every scenario')
+    parser.add_argument('--config-overrides', type=json.loads, default={}, help='app-config.json parameters (json)')
+    parser.add_argument('--max-logs-per-request', type=int, default=None, help='limit of logs of eth_getLogs')
+    parser.add_argument('--no-memory', action='store_true', help="don't measure the peak memory")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.scenarios, args.log_density, args.tokens, args.addresses, args.blocks,
+                             args.config_overrides, args.max_logs_per_request, not args.no_memory)
+    with open(args.o, "w") as outfile:
+        json.dump(results, outfile, indent=4)
+
+    for name, result in results["scenarios"].items():
+        print(f"{name}: {result['wall_time_s']}s, {result['total_rpc_calls']} requests, "
+              f"{result['peak_memory_mb']} MB, {result['logs_per_second']} logs/s")
+    print(f"Results written in {args.o}")
+
+
+if __name__ == "__main__":
+    main()
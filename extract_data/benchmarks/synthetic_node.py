@@ -0,0 +1,289 @@
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+from eth_utils import keccak, to_checksum_address
+from hexbytes import HexBytes
+
+from extract_data.main_program.blockchain_interactions.block_blooms import get_bloom
+
+TRANSFER_TOPIC = "0x" + keccak(text="Transfer(address,address,uint256)").hex()
+MINT_TOPIC = "0x" + keccak(text="Mint(address,uint256,uint256)").hex()
+AIRDROPPED_TOPIC = "0x" + keccak(text="AirDropped(address,uint256)").hex()
+SYMBOL_SELECTOR = "0x95d89b41"
+BALANCE_OF_SELECTOR = "0x70a08231"
+GENESIS_TIMESTAMP = 1600000000
+SECONDS_PER_BLOCK = 12
+
+
+class SyntheticChain:
+    """
+        Description: Deterministic chain generated on demand, which answers the JSON-RPC methods used by the program.
+            Every block has logs with a probability of log_density: transfers of every erc20 token between the
+            tracked addresses and other addresses, mints of every compound token and airdrop claims.
+            The same parameters always generate the same chain.
+    """
+
+    def __init__(self, head_block: int, tokens: List[str], compound_tokens: List[str], airdrop: str,
+                 addresses: List[str], log_density: float = 0.05, num_other_addresses: int = 50,
+                 max_logs_per_request: int = None):
+        """
+            Args:
+                head_block (int): Latest block of the chain
+                tokens (List[str]): Addresses of the erc20 tokens
+                compound_tokens (List[str]): Addresses of the compound tokens
+                airdrop (str): Address of the airdrop contract
+                addresses (List[str]): Tracked addresses, which send and receive transfers
+                log_density (float): Probability of a block having logs
+                num_other_addresses (int): Number of untracked addresses which send and receive transfers
+                max_logs_per_request (int): If it's defined, eth_getLogs fails when it would return more logs
+        """
+        self.head_block = head_block
+        self.tokens = [token.lower() for token in tokens]
+        self.compound_tokens = [token.lower() for token in compound_tokens]
+        self.airdrop = airdrop.lower()
+        self.addresses = [address.lower() for address in addresses + generate_addresses("other", num_other_addresses)]
+        self.contracts = set(self.tokens + self.compound_tokens + [self.airdrop])
+        self.log_density = log_density
+        self.max_logs_per_request = max_logs_per_request
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def get_logs_in_block(self, block_number: int) -> List[dict]:
+        """
+            Description: Generates the logs of a block
+            Args:
+                block_number (int): Block number
+
+            Returns: Raw logs of the block, as returned by eth_getLogs
+        """
+        if get_hash("block", block_number)[0] / 255 >= self.log_density:
+            return []
+
+        logs = []
+        for token in self.tokens:
+            seed = get_hash(block_number, token)
+            if seed[0] % 2:
+                sender = self.addresses[seed[1] % len(self.addresses)]
+                receiver = self.addresses[seed[2] % len(self.addresses)]
+                logs.append((token, [TRANSFER_TOPIC, to_word(sender), to_word(receiver)],
+                             to_word(int.from_bytes(seed[3:8], "big")), ("tx", block_number, seed[4] % 3)))
+        for compound_token in self.compound_tokens:
+            seed = get_hash(block_number, compound_token)
+            if seed[0] % 3 == 0:
+                minter = self.addresses[seed[1] % len(self.addresses)]
+                logs.append((compound_token, [MINT_TOPIC],
+                             "0x" + to_word(minter)[2:] + to_word(seed[2] * 1000)[2:] + to_word(seed[3])[2:],
+                             ("tx", block_number, compound_token)))
+        seed = get_hash(block_number, self.airdrop)
+        if seed[0] % 4 == 0:
+            claimer = self.addresses[seed[1] % len(self.addresses)]
+            logs.append((self.airdrop, [AIRDROPPED_TOPIC, to_word(claimer)], to_word(10 ** 18 * (seed[2] + 1)),
+                         ("tx", block_number, "airdrop")))
+
+        return [{"address": address, "topics": topics, "data": data, "blockNumber": hex(block_number),
+                 "transactionHash": "0x" + get_hash(*transaction).hex(), "transactionIndex": "0x0",
+                 "blockHash": self.get_block_hash(block_number), "logIndex": hex(log_index), "removed": False}
+                for log_index, (address, topics, data, transaction) in enumerate(logs)]
+
+    def get_logs(self, log_filter: dict) -> List[dict]:
+        """
+            Description: Answers eth_getLogs
+            Args:
+                log_filter (dict): Filter of the request (fromBlock, toBlock, address, topics)
+
+            Returns: The logs which match the filter
+        """
+        addresses = log_filter.get("address")
+        addresses = {address.lower() for address in ([addresses] if isinstance(addresses, str) else addresses)} \
+            if addresses else None
+        topics = [None if options is None else {option.lower() for option in
+                                                 (options if isinstance(options, list) else [options])}
+                  for options in log_filter.get("topics") or []]
+
+        res = []
+        for block_number in range(self.get_block_number(log_filter.get("fromBlock", "latest")),
+                                  self.get_block_number(log_filter.get("toBlock", "latest")) + 1):
+            for log in self.get_logs_in_block(block_number):
+                if addresses is not None and log["address"] not in addresses:
+                    continue
+                if all(options is None or (position < len(log["topics"]) and log["topics"][position] in options)
+                       for position, options in enumerate(topics)):
+                    res.append(log)
+            if self.max_logs_per_request is not None and len(res) > self.max_logs_per_request:
+                raise ValueError(f"query returned more than {self.max_logs_per_request} results")
+
+        return res
+
+    def get_block_number(self, block) -> int:
+        if block in ("latest", "pending", "safe", "finalized"):
+            return self.head_block
+        if block == "earliest":
+            return 0
+        return int(block, 16) if isinstance(block, str) else block
+
+    def get_block_hash(self, block_number: int) -> str:
+        return "0x" + get_hash("block_hash", block_number).hex()
+
+    def get_block(self, block) -> dict:
+        """
+            Description: Answers eth_getBlockByNumber (without transactions)
+            Args:
+                block: Block number in hex or block tag
+
+            Returns: The block header, whose logsBloom contains the addresses and topics of its logs
+        """
+        block_number = self.get_block_number(block)
+        empty_hash = "0x" + "00" * 32
+        bloom = get_bloom(HexBytes(value) for log in self.get_logs_in_block(block_number)
+                          for value in [log["address"]] + log["topics"])
+        return {"number": hex(block_number), "hash": self.get_block_hash(block_number),
+                "parentHash": self.get_block_hash(block_number - 1),
+                "timestamp": hex(GENESIS_TIMESTAMP + SECONDS_PER_BLOCK * block_number),
+                "logsBloom": "0x" + bloom.hex(), "gasLimit": "0x1c9c380", "gasUsed": "0x0", "miner": "0x" + "00" * 20,
+                "difficulty": "0x0", "totalDifficulty": "0x0", "extraData": "0x", "size": "0x220",
+                "nonce": "0x0000000000000000", "sha3Uncles": empty_hash, "stateRoot": empty_hash,
+                "transactionsRoot": empty_hash, "receiptsRoot": empty_hash, "mixHash": empty_hash,
+                "transactions": [], "uncles": []}
+
+    def handle(self, request: dict) -> dict:
+        """
+            Description: Answers a JSON-RPC request
+            Args:
+                request (dict): JSON-RPC request
+
+            Returns: The JSON-RPC response
+        """
+        method, params = request["method"], request.get("params") or []
+        with self.lock:
+            self.stats[method] = self.stats.get(method, 0) + 1
+
+        try:
+            result = self._get_result(method, params)
+        except (ValueError, KeyError) as error:
+            return {"jsonrpc": "2.0", "id": request.get("id"), "error": {"code": -32000, "message": str(error)}}
+
+        if method == "eth_getLogs":
+            with self.lock:
+                self.stats["logs"] = self.stats.get("logs", 0) + len(result)
+
+        return {"jsonrpc": "2.0", "id": request.get("id"), "result": result}
+
+    def get_stats(self) -> dict:
+        """
+            Description: Gets the requests answered by method, the logs returned ("logs") and the http requests
+                ("http_requests") since the last reset
+            Args: None
+
+            Returns: The stats
+        """
+        with self.lock:
+            return dict(self.stats)
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {}
+
+    def _get_result(self, method: str, params: list):
+        if method == "web3_clientVersion":
+            return "synthetic/1.0"
+        if method == "eth_chainId":
+            return "0x1"
+        if method == "net_version":
+            return "1"
+        if method == "eth_blockNumber":
+            return hex(self.head_block)
+        if method == "eth_getLogs":
+            return self.get_logs(params[0])
+        if method == "eth_getBlockByNumber":
+            return self.get_block(params[0])
+        if method == "eth_getBalance":
+            return hex(int.from_bytes(get_hash("balance", params[0].lower())[:8], "big"))
+        if method == "eth_getCode":
+            return "0x6080" if params[0].lower() in self.contracts else "0x"
+        if method == "eth_call":
+            if params[0]["to"].lower() not in self.contracts:
+                # Calls to an address without code succeed without any data
+                return "0x"
+            data = params[0].get("data") or params[0].get("input")
+            if data.startswith(SYMBOL_SELECTOR):
+                symbol = b"SYN"
+                return "0x" + to_word(32)[2:] + to_word(len(symbol))[2:] + symbol.hex().ljust(64, "0")
+            if data.startswith(BALANCE_OF_SELECTOR):
+                return to_word(int.from_bytes(get_hash("erc20", params[0]["to"].lower(), data[-40:])[:8], "big"))
+            return to_word(0)
+
+        raise ValueError(f"The method {method} does not exist")
+
+
+def serve(chain: SyntheticChain, port: int = 0) -> ThreadingHTTPServer:
+    """
+        Description: Creates a JSON-RPC server for a synthetic chain (batches are supported). The methods
+            synthetic_getStats and synthetic_resetStats give access to the stats of the chain
+        Args:
+            chain (SyntheticChain): Chain answered by the server
+            port (int): Port of the server (a free one if it's 0)
+
+        Returns: The server, which must be started with serve_forever
+    """
+
+    class SyntheticNodeHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if isinstance(body, list) or not body["method"].startswith("synthetic_"):
+                with chain.lock:
+                    chain.stats["http_requests"] = chain.stats.get("http_requests", 0) + 1
+            response = [self._handle(request) for request in body] if isinstance(body, list) else self._handle(body)
+            data = json.dumps(response).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+        @staticmethod
+        def _handle(request: dict) -> dict:
+            if request["method"] == "synthetic_getStats":
+                return {"jsonrpc": "2.0", "id": request.get("id"), "result": chain.get_stats()}
+            if request["method"] == "synthetic_resetStats":
+                chain.reset_stats()
+                return {"jsonrpc": "2.0", "id": request.get("id"), "result": True}
+            return chain.handle(request)
+
+    return ThreadingHTTPServer(("127.0.0.1", port), SyntheticNodeHandler)
+
+
+def generate_addresses(prefix: str, count: int) -> List[str]:
+    """
+        Description: Generates deterministic addresses
+        Args:
+            prefix (str): Prefix used for generating them, different prefixes generate different addresses
+            count (int): Number of addresses
+
+        Returns: The addresses in checksum format
+    """
+    return [to_checksum_address("0x" + get_hash(prefix, index).hex()[:40]) for index in range(count)]
+
+
+def get_hash(*parts) -> bytes:
+    return hashlib.sha256("|".join(str(part) for part in parts).encode()).digest()
+
+
+def to_word(value) -> str:
+    """
+        Description: Encodes an integer or an address as an ABI word
+        Args:
+            value: Integer or address in hex
+
+        Returns: The word in hex with 0x prefix
+    """
+    if isinstance(value, str):
+        return "0x" + value[2:].lower().rjust(64, "0")
+    return "0x" + hex(value)[2:].rjust(64, "0")
@@ -0,0 +1,74 @@
+import bisect
+import logging
+from array import array
+from itertools import accumulate
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# (block_number, signed amount) of a transfer: positive if it was received, negative if it was sent
+BalanceChange = Tuple[int, int]
+
+
+class BalanceHistory:
+    """
+        Description: Balance of an address in a token through a blocks' interval, replayed from the amounts of its
+            Transfer logs instead of a balanceOf call per block. The signed amounts are summed by block and
+            accumulated from the balance before the interval, which is the current balance minus every amount of
+            the interval, so the balance at the end of any block of the interval is known without any request.
+            Amounts are kept as integers (wei), so the balances are exact.
+    """
+
+    __slots__ = ("from_block", "to_block", "opening_balance", "block_numbers", "balances")
+
+    def __init__(self, current_balance: int, from_block: int, to_block: int, changes: Iterable[BalanceChange]):
+        """
+            Args:
+                current_balance (int): Balance at the end of to_block, which anchors the history
+                from_block (int): Initial block of the interval where the transfers were fetched (included)
+                to_block (int): Final block of the interval where the transfers were fetched (included)
+                changes (Iterable[BalanceChange]): Every transfer of the address in the interval, in any order
+        """
+        amounts_by_block: Dict[int, int] = {}
+        for block_number, amount in changes:
+            amounts_by_block[block_number] = amounts_by_block.get(block_number, 0) + amount
+
+        self.from_block = from_block
+        self.to_block = to_block
+        self.block_numbers = array('Q', sorted(amounts_by_block))
+        amounts = [amounts_by_block[block_number] for block_number in self.block_numbers]
+        self.opening_balance = current_balance - sum(amounts)
+        self.balances = list(accumulate(amounts, initial=self.opening_balance))[1:]
+        if self.opening_balance < 0:
+            logging.warning(f"The balance before block {from_block} would be {self.opening_balance}: some changes "
+                            f"of the balance aren't Transfer logs (rebases, fees...), so the history isn't exact.")
+
+    def get_balance(self, block_number: int) -> Optional[int]:
+        """
+            Description: Gets the balance at the end of a block
+            Args:
+                block_number (int): Block number
+
+            Returns: The balance, None if the block is out of the interval (from_block - 1, to_block)
+        """
+        if not self.from_block - 1 <= block_number <= self.to_block:
+            return None
+
+        index = bisect.bisect_right(self.block_numbers, block_number)
+        return self.balances[index - 1] if index > 0 else self.opening_balance
+
+    def get_snapshots(self, block_numbers: Iterable[int]) -> Dict[int, Optional[int]]:
+        """
+            Description: Gets the balance at the end of several blocks
+            Args:
+                block_numbers (Iterable[int]): Block numbers
+
+            Returns: The balance by block number (see get_balance)
+        """
+        return {block_number: self.get_balance(block_number) for block_number in block_numbers}
+
+    def get_series(self) -> List[Tuple[int, int]]:
+        """
+            Description: Gets the balance after every block with transfers
+
+            Returns: (block_number, balance) sorted by block number, starting with the balance before from_block
+        """
+        return [(self.from_block - 1, self.opening_balance), *zip(self.block_numbers, self.balances)]
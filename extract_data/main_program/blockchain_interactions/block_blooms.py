@@ -0,0 +1,180 @@
+import logging
+import sqlite3
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from eth_utils import keccak
+from hexbytes import HexBytes
+
+BLOOM_SIZE = 256
+# Blocks whose blooms are loaded and tested at once
+DEFAULT_BLOOM_CHUNK_SIZE = 10000
+# Blocks without any candidate which are queried anyway for merging two ranges in a single request
+DEFAULT_MAX_BLOOM_GAP = 1000
+# Maximum number of blooms fetched for a chunk. Every bloom is a block header request, so fetching the blooms of a
+# long interval sends more requests than the eth_getLogs which they save
+DEFAULT_MAX_BLOOM_FETCHED_BLOCKS = 100
+
+# Byte's index and mask of every bit set by a value in a bloom
+BloomBits = List[Tuple[int, int]]
+
+
+class BloomIndex:
+    """
+        Description: Index of the logsBloom of every block. The blooms of an interval are fetched from the node in
+            bulk (only the ones which aren't stored yet) and the addresses and topics of a log filter are tested
+            locally, so the logs are only queried in the blocks which may contain a match. A bloom has false
+            positives but never false negatives. Only the blooms of finalized blocks are written on disk.
+            Fetching a bloom costs a request, so the blooms are only fetched for chunks with a few missing blooms:
+            the rest of chunks are queried entirely, unless their blooms were already stored.
+    """
+
+    def __init__(self, fetch_blooms: Callable[[List[int]], Dict[int, bytes]], get_finalized_block: Callable[[], int],
+                 db_path: str = None, max_gap: int = DEFAULT_MAX_BLOOM_GAP,
+                 chunk_size: int = DEFAULT_BLOOM_CHUNK_SIZE,
+                 max_fetched_blocks: Optional[int] = DEFAULT_MAX_BLOOM_FETCHED_BLOCKS):
+        """
+            Args:
+                fetch_blooms (Callable): Function which gets the logsBloom of several blocks from the node
+                get_finalized_block (Callable): Function which gets the last block whose bloom can be persisted
+                db_path (str): SQLite file where the blooms are persisted. If it's None, they are only kept in memory
+                max_gap (int): Maximum number of blocks without candidates between two ranges which are merged
+                chunk_size (int): Number of blocks whose blooms are loaded at once
+                max_fetched_blocks (int): Maximum number of missing blooms fetched for a chunk, the chunk is
+                    queried entirely when more are missing (unlimited if it's None)
+        """
+        self.fetch_blooms = fetch_blooms
+        self.get_finalized_block = get_finalized_block
+        self.max_gap = max_gap
+        self.chunk_size = chunk_size
+        self.max_fetched_blocks = max_fetched_blocks
+        self.lock = threading.Lock()
+        logging.info(f"Block blooms persisted in {db_path or 'memory'}")
+        self.connection = sqlite3.connect(db_path or ":memory:", check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS block_blooms "
+                                    "(block_number INTEGER PRIMARY KEY, bloom BLOB NOT NULL)")
+
+    def get_candidate_ranges(self, from_block: int, to_block: int, addresses: Iterable[str],
+                             topics: List[Optional[List[str]]]) -> List[Tuple[int, int]]:
+        """
+            Description: Gets the blocks of an interval which may contain logs matching a filter
+            Args:
+                from_block (int): Initial block for being analyzed
+                to_block (int): Final block for being analyzed
+                addresses (Iterable[str]): Contracts' addresses of the filter (any of them), every contract if empty
+                topics (List[Optional[List[str]]]): Topics' filter (one of the options in every position, None for
+                    any topic)
+
+            Returns: List of (from_block, to_block) ranges, sorted and without overlapping. Ranges whose gap is
+                smaller than max_gap are merged. Every block of a chunk without enough stored blooms is a candidate
+        """
+        address_bits = [get_bloom_bits(HexBytes(address)) for address in addresses]
+        topic_bits = [[get_bloom_bits(HexBytes(topic)) for topic in (options if isinstance(options, list) else
+                                                                      [options])]
+                      for options in topics if options is not None]
+
+        res = []
+        num_candidates = 0
+        num_unindexed = 0
+        for chunk_from in range(from_block, to_block + 1, self.chunk_size):
+            chunk_to = min(chunk_from + self.chunk_size - 1, to_block)
+            blooms = self.load(chunk_from, chunk_to, self.max_fetched_blocks)
+            if blooms is None:
+                num_unindexed += chunk_to - chunk_from + 1
+            for block_number in range(chunk_from, chunk_to + 1):
+                if blooms is not None and not may_contain(blooms[block_number], address_bits, topic_bits):
+                    continue
+                num_candidates += 1
+                if res and block_number - res[-1][1] - 1 <= self.max_gap:
+                    res[-1] = (res[-1][0], block_number)
+                else:
+                    res.append((block_number, block_number))
+
+        logging.info(f"Blooms ({from_block}, {to_block}): {num_candidates} blocks may contain logs "
+                     f"({num_unindexed} without stored blooms), {len(res)} ranges will be queried.")
+        return res
+
+    def load(self, from_block: int, to_block: int, max_fetched_blocks: int = None) -> Optional[Dict[int, bytes]]:
+        """
+            Description: Gets the blooms of an interval, fetching only the missing ones from the node
+            Args:
+                from_block (int): Initial block
+                to_block (int): Final block
+                max_fetched_blocks (int): Maximum number of missing blooms which are fetched (unlimited if it's
+                    None)
+
+            Returns: Bloom by block number, None if more than max_fetched_blocks blooms are missing (nothing is
+                fetched then)
+        """
+        with self.lock:
+            res = dict(self.connection.execute("SELECT block_number, bloom FROM block_blooms "
+                                               "WHERE block_number BETWEEN ? AND ?", (from_block, to_block)))
+
+        missing = [block_number for block_number in range(from_block, to_block + 1) if block_number not in res]
+        if max_fetched_blocks is not None and len(missing) > max_fetched_blocks:
+            return None
+        if missing:
+            logging.info(f"Fetching the blooms of {len(missing)} blocks.")
+            fetched = self.fetch_blooms(missing)
+            res.update(fetched)
+            finalized_block = self.get_finalized_block()
+            with self.lock, self.connection:
+                self.connection.executemany("INSERT OR REPLACE INTO block_blooms VALUES (?, ?)",
+                                            [(block_number, bytes(bloom)) for block_number, bloom in fetched.items()
+                                             if block_number <= finalized_block])
+
+        return res
+
+
+def get_bloom_bits(value: bytes) -> BloomBits:
+    """
+        Description: Gets the bits set by a value (address or topic) in a logsBloom: the low 11 bits of the first
+            three pairs of bytes of its keccak
+        Args:
+            value (bytes): Address or topic
+
+        Returns: Byte's index and mask of every bit in the bloom (big endian)
+    """
+    value_hash = keccak(value)
+    res = []
+    for index in range(0, 6, 2):
+        bit = int.from_bytes(value_hash[index:index + 2], "big") & (BLOOM_SIZE * 8 - 1)
+        res.append((BLOOM_SIZE - 1 - bit // 8, 1 << (bit % 8)))
+
+    return res
+
+
+def may_contain(bloom: bytes, address_bits: List[BloomBits], topic_bits: List[List[BloomBits]]) -> bool:
+    """
+        Description: Checks if a block may contain logs matching a filter
+        Args:
+            bloom (bytes): logsBloom of the block
+            address_bits (List[BloomBits]): Bits of every address of the filter (any of them)
+            topic_bits (List[List[BloomBits]]): Bits of every option of every topic's position (any option in
+                every position)
+
+        Returns: False if the block surely doesn't contain any matching log
+    """
+    if not any(bloom):
+        return False
+    if address_bits and not any(all(bloom[index] & mask for index, mask in bits) for bits in address_bits):
+        return False
+
+    return all(any(all(bloom[index] & mask for index, mask in bits) for bits in options) for options in topic_bits)
+
+
+def get_bloom(values: Iterable[bytes]) -> bytes:
+    """
+        Description: Builds the logsBloom of several values (the addresses and topics of the logs of a block)
+        Args:
+            values (Iterable[bytes]): Addresses and topics
+
+        Returns: The bloom
+    """
+    bloom = bytearray(BLOOM_SIZE)
+    for value in values:
+        for index, mask in get_bloom_bits(value):
+            bloom[index] |= mask
+
+    return bytes(bloom)
@@ -0,0 +1,177 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict
+
+import requests
+
+from extract_data.main_program.blockchain_interactions.rpc_cache import DEFAULT_RPC_CACHE_MODE, REPRODUCIBLE_MODES
+
+DEFAULT_INITIAL_WINDOW_SIZE = 10000
+DEFAULT_MAX_WINDOW_SIZE = 100000
+DEFAULT_MAX_RETRIES = 5
+SPARSE_RESULTS_THRESHOLD = 1000
+BACKOFF_SECONDS = 0.5
+
+# Messages returned by the most common providers when a window has too many results or too many blocks. They must
+# not match other errors (rate limits, invalid params, missing blocks...), which would be split down to single blocks
+OVERFLOW_ERROR_MESSAGES = ("query returned more than", "too many results", "response size exceeded",
+                           "range is too large", "range too large", "maximum block range", "query timeout")
+
+
+def is_overflow_error(error: Exception) -> bool:
+    """
+        Description: Checks if an error means that the blocks' window was too big for the provider
+        Args:
+            error (Exception): Error raised by the provider
+
+        Returns: If the window should be split or not. Transient errors (see is_transient_error) never are
+    """
+    if is_transient_error(error):
+        return False
+    if isinstance(error, requests.exceptions.Timeout):
+        return True
+
+    message = str(error).lower()
+    return any(overflow_message in message for overflow_message in OVERFLOW_ERROR_MESSAGES)
+
+
+def is_transient_error(error: Exception) -> bool:
+    """
+        Description: Checks if an error is temporary, so the same request can be retried
+        Args:
+            error (Exception): Error raised by the provider
+
+        Returns: If the request should be retried or not
+    """
+    if isinstance(error, requests.exceptions.ConnectionError):
+        return True
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        return error.response.status_code == 429 or error.response.status_code >= 500
+
+    message = str(error).lower()
+    return "rate limit" in message or "too many requests" in message
+
+
+class BlockRangePlanner:
+    """
+        Description: Walks a blocks' interval adapting the window size to the density of every (contract, event).
+            Windows which overflow are split in two halves, sparse windows are doubled and transient errors
+            are retried with exponential backoff. A planner which isn't adaptive doesn't learn any window size:
+            every interval starts with the initial size and is only split when a window overflows, so its windows
+            don't depend on the other intervals.
+    """
+
+    def __init__(self, initial_window_size: int = DEFAULT_INITIAL_WINDOW_SIZE,
+                 max_window_size: int = DEFAULT_MAX_WINDOW_SIZE, max_retries: int = DEFAULT_MAX_RETRIES,
+                 adaptive: bool = True):
+        self.adaptive = adaptive
+        self.initial_window_size = initial_window_size
+        self.max_window_size = max(max_window_size, initial_window_size)
+        self.max_retries = max_retries
+        self.window_sizes: Dict[str, int] = {}
+        self.rpc_calls: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, app_config: dict) -> 'BlockRangePlanner':
+        """
+            Description: Creates a planner using the parameters defined in app-config.json. Runs which are recorded
+                or replayed (rpc_cache_mode) use a planner which isn't adaptive, so they send the same requests
+            Args:
+                app_config (dict): app-config.json
+
+            Returns: The planner
+        """
+        return cls(app_config.get("block_window_size", DEFAULT_INITIAL_WINDOW_SIZE),
+                   app_config.get("max_block_window_size", DEFAULT_MAX_WINDOW_SIZE),
+                   app_config.get("max_retries", DEFAULT_MAX_RETRIES),
+                   app_config.get("rpc_cache_mode", DEFAULT_RPC_CACHE_MODE) not in REPRODUCIBLE_MODES)
+
+    def get_events(self, key: str, from_block: int, to_block: int, fetch_window: Callable[[int, int], list],
+                   res=None) -> list:
+        """
+            Description: Gets all the events of a blocks' interval using as few requests as possible
+            Args:
+                key (str): Identifier of the (contract, event) whose window size is learned
+                from_block (int): Initial block for being analyzed
+                to_block (int): Final block for being analyzed
+                fetch_window (Callable): Function which gets the events of a single window
+                res: Container where the events of every window are appended with +=. If it's None, a list is used
+
+            Returns: All the events of the interval, sorted by block number
+        """
+        res = [] if res is None else res
+        window_size = self.initial_window_size
+        window_from = from_block
+        while window_from <= to_block:
+            if self.adaptive:
+                window_size = self.get_window_size(key)
+            window_to = min(window_from + window_size - 1, to_block)
+            try:
+                events = self._fetch_with_retry(key, window_from, window_to, fetch_window)
+            except Exception as error:
+                if not is_overflow_error(error) or window_to == window_from:
+                    raise
+                logging.info(f"Window ({window_from}, {window_to}) of {key} overflowed, splitting it: {error}")
+                window_size = max(1, (window_to - window_from + 1) // 2)
+                if self.adaptive:
+                    self._set_window_size(key, window_size)
+                continue
+
+            res += events
+            if self.adaptive and len(events) < SPARSE_RESULTS_THRESHOLD and window_to - window_from + 1 == window_size:
+                self._set_window_size(key, min(window_size * 2, self.max_window_size))
+            window_from = window_to + 1
+
+        return res
+
+    def get_window_size(self, key: str) -> int:
+        """
+            Description: Gets the current window size learned for a (contract, event)
+            Args:
+                key (str): Identifier of the (contract, event)
+
+            Returns: The window size
+        """
+        with self.lock:
+            return self.window_sizes.get(key, self.initial_window_size)
+
+    def get_total_rpc_calls(self) -> int:
+        """
+            Description: Gets the number of requests sent by the planner
+            Args: None
+
+            Returns: The number of requests sent
+        """
+        with self.lock:
+            return sum(self.rpc_calls.values())
+
+    def log_stats(self, name: str):
+        """
+            Description: Writes in the logs the requests sent and the window size learned for every (contract, event)
+            Args:
+                name (str): Name of the scan
+        """
+        with self.lock:
+            for key, rpc_calls in self.rpc_calls.items():
+                logging.info(f"Scan {name}: {rpc_calls} requests for {key} "
+                             f"(window size {self.window_sizes.get(key, self.initial_window_size)}).")
+
+    def _set_window_size(self, key: str, window_size: int):
+        with self.lock:
+            self.window_sizes[key] = window_size
+
+    def _fetch_with_retry(self, key: str, from_block: int, to_block: int, fetch_window: Callable[[int, int], list]) \
+            -> list:
+        for num_retry in range(self.max_retries + 1):
+            with self.lock:
+                self.rpc_calls[key] = self.rpc_calls.get(key, 0) + 1
+            try:
+                return fetch_window(from_block, to_block)
+            except Exception as error:
+                if not is_transient_error(error) or num_retry == self.max_retries:
+                    raise
+                backoff = BACKOFF_SECONDS * 2 ** num_retry
+                logging.warning(f"Request ({from_block}, {to_block}) of {key} failed, retrying in {backoff}s: {error}")
+                time.sleep(backoff)
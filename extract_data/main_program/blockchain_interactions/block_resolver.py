@@ -0,0 +1,141 @@
+import bisect
+import logging
+import math
+import threading
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Tuple, Union
+
+from extract_data.main_program.blockchain_interactions.block_timestamps import BlockTimestampCache
+
+# Seconds between blocks assumed before any interval of the chain is known (Ethereum's slot time)
+DEFAULT_SECONDS_PER_BLOCK = 12
+SECONDS_PER_DAY = 86400
+
+# (block_number, timestamp)
+Anchor = Tuple[int, int]
+
+
+class BlockTimeResolver:
+    """
+        Description: Resolves timestamps into block numbers with an interpolation search, which falls back to a
+            binary search when an interpolation doesn't halve the interval. Every header fetched by a search is kept
+            in a sparse index of (block, timestamp) anchors, which bounds the next searches. The anchors are fetched
+            through the BlockTimestampCache, so finalized ones are persisted and bound the searches of the next runs
+            too.
+    """
+
+    def __init__(self, block_timestamps: BlockTimestampCache, get_latest_block: Callable[[], int],
+                 seconds_per_block: float = DEFAULT_SECONDS_PER_BLOCK):
+        """
+            Args:
+                block_timestamps (BlockTimestampCache): Cache used for fetching the timestamps of the anchors
+                get_latest_block (Callable): Function which gets the latest block of the chain
+                seconds_per_block (float): Seconds between blocks assumed before any interval is known
+        """
+        self.block_timestamps = block_timestamps
+        self.get_latest_block = get_latest_block
+        self.seconds_per_block = seconds_per_block
+        self.block_numbers: List[int] = []
+        self.timestamps: List[int] = []
+        self.lock = threading.Lock()
+
+    def get_block_by_timestamp(self, timestamp: int) -> int:
+        """
+            Description: Gets the first block whose timestamp is at or after a timestamp
+            Args:
+                timestamp (int): Timestamp (seconds)
+
+            Returns: The block number, latest block + 1 if the timestamp is in the future
+        """
+        lower, upper = self._get_bracket(timestamp)
+        num_probes = 0
+        if upper is None:
+            latest_block = self.get_latest_block()
+            upper = self._probe(latest_block)
+            num_probes += 1
+            if upper[1] < timestamp:
+                return latest_block + 1
+
+        step = math.ceil((upper[1] - timestamp) / self.seconds_per_block) + 1
+        while lower is None:
+            probe = self._probe(max(upper[0] - step, 0))
+            num_probes += 1
+            if probe[1] < timestamp:
+                lower = probe
+            elif probe[0] == 0:
+                return 0
+            else:
+                upper = probe
+                step *= 2
+
+        bisect_next = False
+        while upper[0] - lower[0] > 1:
+            width = upper[0] - lower[0]
+            if bisect_next:
+                guess = lower[0] + width // 2
+            else:
+                guess = lower[0] + int((timestamp - lower[1]) * width / (upper[1] - lower[1]))
+            probe = self._probe(min(max(guess, lower[0] + 1), upper[0] - 1))
+            num_probes += 1
+            if probe[1] < timestamp:
+                lower = probe
+            else:
+                upper = probe
+            bisect_next = upper[0] - lower[0] > width // 2
+
+        logging.info(f"Timestamp {timestamp} resolved to block {upper[0]} with {num_probes} block timestamps.")
+        return upper[0]
+
+    def get_block_range(self, from_timestamp: int, to_timestamp: int = None) -> Tuple[int, int]:
+        """
+            Description: Gets the blocks mined in a time window
+            Args:
+                from_timestamp (int): Initial timestamp (included)
+                to_timestamp (int): Final timestamp (included). If it's None, the window ends in the latest block
+
+            Returns: (from_block, to_block), to_block is never beyond the latest block
+        """
+        latest_block = self.get_latest_block()
+        to_block = latest_block if to_timestamp is None else \
+            min(self.get_block_by_timestamp(to_timestamp + 1) - 1, latest_block)
+        return self.get_block_by_timestamp(from_timestamp), to_block
+
+    def _get_bracket(self, timestamp: int) -> Tuple[Optional[Anchor], Optional[Anchor]]:
+        stored_lower, stored_upper = self.block_timestamps.get_stored_bracket(timestamp)
+        with self.lock:
+            index = bisect.bisect_left(self.timestamps, timestamp)
+            lower = (self.block_numbers[index - 1], self.timestamps[index - 1]) if index > 0 else None
+            upper = (self.block_numbers[index], self.timestamps[index]) if index < len(self.timestamps) else None
+
+        if stored_lower is not None and (lower is None or stored_lower[0] > lower[0]):
+            lower = stored_lower
+        if stored_upper is not None and (upper is None or stored_upper[0] < upper[0]):
+            upper = stored_upper
+        return lower, upper
+
+    def _probe(self, block_number: int) -> Anchor:
+        timestamp = self.block_timestamps.get_timestamp(block_number)
+        with self.lock:
+            index = bisect.bisect_left(self.block_numbers, block_number)
+            if index == len(self.block_numbers) or self.block_numbers[index] != block_number:
+                self.block_numbers.insert(index, block_number)
+                self.timestamps.insert(index, timestamp)
+
+        return block_number, timestamp
+
+
+def parse_time(value: Union[int, float, str]) -> int:
+    """
+        Description: Parses a time of app-config.json
+        Args:
+            value (Union[int, float, str]): Timestamp in seconds or ISO 8601 date (UTC if it doesn't have an offset)
+
+        Returns: The timestamp in seconds
+    """
+    if isinstance(value, (int, float)):
+        return int(value)
+
+    date = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return int(date.timestamp())
@@ -0,0 +1,221 @@
+import itertools
+import logging
+import math
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import CancelledError, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Iterator, List, Tuple, TypeVar
+
+DEFAULT_BLOCK_WINDOW_SIZE = 10000
+DEFAULT_MAX_CONCURRENT_REQUESTS = 4
+DEFAULT_CPU_WORKERS = 0
+WORK_UNITS_PER_WORKER = 4
+
+WorkUnit = TypeVar('WorkUnit')
+Result = TypeVar('Result')
+
+
+def get_block_windows(from_block: int, to_block: int, window_size: int = DEFAULT_BLOCK_WINDOW_SIZE) \
+        -> List[Tuple[int, int]]:
+    """
+        Description: Splits a blocks' interval in consecutive windows, sorted by block number
+        Args:
+            from_block (int): Initial block of the interval (included)
+            to_block (int): Final block of the interval (included)
+            window_size (int): Maximum number of blocks of every window
+
+        Returns: List of (from_block, to_block) windows which cover the interval without overlapping
+    """
+
+    windows = []
+    for window_from in range(max(from_block, 0), to_block + 1, window_size):
+        windows.append((window_from, min(window_from + window_size - 1, to_block)))
+
+    return windows
+
+
+def get_work_unit_windows(from_block: int, to_block: int, min_window_size: int = DEFAULT_BLOCK_WINDOW_SIZE,
+                          max_workers: int = DEFAULT_MAX_CONCURRENT_REQUESTS) -> List[Tuple[int, int]]:
+    """
+        Description: Splits a blocks' interval in windows big enough to keep every worker busy, so every window
+            can be walked by a BlockRangePlanner using adaptive sizes
+        Args:
+            from_block (int): Initial block of the interval (included)
+            to_block (int): Final block of the interval (included)
+            min_window_size (int): Minimum number of blocks of every window
+            max_workers (int): Number of workers which will process the windows
+
+        Returns: List of (from_block, to_block) windows which cover the interval without overlapping
+    """
+
+    num_blocks = to_block - max(from_block, 0) + 1
+    window_size = max(min_window_size, math.ceil(num_blocks / (max(max_workers, 1) * WORK_UNITS_PER_WORKER)))
+    return get_block_windows(from_block, to_block, window_size)
+
+
+def run_work_units(work_units: List[WorkUnit], worker: Callable[[WorkUnit], Result],
+                   max_workers: int = DEFAULT_MAX_CONCURRENT_REQUESTS, name: str = "scan",
+                   cancel_event: threading.Event = None) -> List[Result]:
+    """
+        Description: Executes every work unit in a bounded thread pool. If a work unit fails, the pending ones
+            aren't executed
+        Args:
+            work_units (List): Work units (window, contract, event...) for being executed
+            worker (Callable): Function which processes a work unit
+            max_workers (int): Maximum number of work units executed at the same time
+            name (str): Name of the scan, used in the logs
+            cancel_event (threading.Event): When it's set, the pending work units raise a CancelledError
+
+        Returns: The result of every work unit, in the same order as work_units
+    """
+
+    logging.info(f"Scan {name} starts: {len(work_units)} work units will be executed "
+                 f"(max_workers={max_workers}).")
+
+    def run_work_unit(work_unit: WorkUnit) -> Result:
+        if cancel_event is not None and cancel_event.is_set():
+            raise CancelledError(f"Scan {name} cancelled")
+        return worker(work_unit)
+
+    if max_workers <= 1:
+        results_iterator = map(run_work_unit, work_units)
+        return _log_progress(results_iterator, name, len(work_units))
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name) as executor:
+        try:
+            return _log_progress(executor.map(run_work_unit, work_units), name, len(work_units))
+        except BaseException:
+            executor.shutdown(cancel_futures=True)
+            raise
+
+
+def iter_work_units(work_units: List[WorkUnit], worker: Callable[[WorkUnit], Result],
+                    max_workers: int = DEFAULT_MAX_CONCURRENT_REQUESTS, name: str = "scan",
+                    cancel_event: threading.Event = None, max_prefetch: int = None) -> Iterator[Result]:
+    """
+        Description: Executes the work units in a bounded thread pool and yields their results as soon as they are
+            ready, in order. Only max_prefetch work units are executed ahead of the caller, so the next results are
+            fetched while the caller processes the current one, and nothing else is fetched until it's consumed
+            (backpressure). The pending work units are cancelled if the caller stops iterating
+        Args:
+            work_units (List): Work units (window, contract, event...) for being executed
+            worker (Callable): Function which processes a work unit
+            max_workers (int): Maximum number of work units executed at the same time
+            name (str): Name of the scan, used in the logs
+            cancel_event (threading.Event): When it's set, the pending work units raise a CancelledError
+            max_prefetch (int): Maximum number of results not consumed yet (max_workers by default)
+
+        Returns: Iterator of the result of every work unit, in the same order as work_units
+    """
+
+    max_workers = max(max_workers, 1)
+    max_prefetch = max(max_prefetch or max_workers, 1)
+    logging.info(f"Scan {name} starts: {len(work_units)} work units will be yielded "
+                 f"(max_workers={max_workers}, max_prefetch={max_prefetch}).")
+
+    def run_work_unit(work_unit: WorkUnit) -> Result:
+        if cancel_event is not None and cancel_event.is_set():
+            raise CancelledError(f"Scan {name} cancelled")
+        return worker(work_unit)
+
+    pending = deque()
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, max_prefetch), thread_name_prefix=name)
+    try:
+        units_iterator = iter(work_units)
+        for work_unit in itertools.islice(units_iterator, max_prefetch):
+            pending.append(executor.submit(run_work_unit, work_unit))
+        num_unit = 0
+        while pending:
+            result = pending.popleft().result()
+            for work_unit in itertools.islice(units_iterator, 1):
+                pending.append(executor.submit(run_work_unit, work_unit))
+            if num_unit % 10 == 0 or num_unit + 1 == len(work_units):
+                logging.info(f"Scan {name}: {num_unit + 1}/{len(work_units)} work units finished")
+            num_unit += 1
+            yield result
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def _log_progress(results_iterator, name: str, num_units: int) -> list:
+    results = []
+    for num_unit, result in enumerate(results_iterator):
+        results.append(result)
+        if num_unit % 10 == 0 or num_unit + 1 == num_units:
+            logging.info(f"Scan {name}: {num_unit + 1}/{num_units} work units finished")
+
+    return results
+
+
+class RateLimiter:
+    """
+        Description: Limits the number of requests per second shared by every thread
+    """
+
+    def __init__(self, max_requests_per_second: float):
+        self.min_interval = 1.0 / max_requests_per_second
+        self.next_request_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """
+            Description: Blocks the current thread until a new request is allowed
+        """
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_request_time - now
+            self.next_request_time = max(now, self.next_request_time) + self.min_interval
+
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+class CpuPool:
+    """
+        Description: Executes the CPU work of the windows (decoding, classification, aggregation) in a pool of
+            processes, so it isn't limited to a single core by the GIL. The threads which fetch the windows wait for
+            the result of their shard, so the network I/O keeps overlapping. Without workers, the work is executed
+            in the calling thread. Arguments and results are pickled, so they must be compact (typed arrays, bytes)
+            and the functions must be defined at module level.
+    """
+
+    def __init__(self, cpu_workers: int = DEFAULT_CPU_WORKERS):
+        """
+            Args:
+                cpu_workers (int): Number of processes (0 for executing the work in the calling thread)
+        """
+        self.cpu_workers = cpu_workers
+        self.executor = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, app_config: dict) -> 'CpuPool':
+        return cls(app_config.get("cpu_workers", DEFAULT_CPU_WORKERS))
+
+    def run(self, function: Callable[..., Result], *args) -> Result:
+        """
+            Description: Executes a function in a process of the pool (started the first time)
+            Args:
+                function (Callable): Function defined at module level
+                args: Arguments of the function
+
+            Returns: The result of the function
+        """
+        if self.cpu_workers <= 0:
+            return function(*args)
+
+        with self.lock:
+            if self.executor is None:
+                logging.info(f"Starting {self.cpu_workers} processes for the CPU work.")
+                # spawn, since forking a process with running threads can copy locks which are held
+                self.executor = ProcessPoolExecutor(self.cpu_workers, multiprocessing.get_context("spawn"))
+
+        return self.executor.submit(function, *args).result()
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
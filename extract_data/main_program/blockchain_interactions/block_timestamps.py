@@ -0,0 +1,144 @@
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_LRU_SIZE = 100000
+SQLITE_MAX_VARIABLES = 900
+
+
+class BlockTimestampCache:
+    """
+        Description: Stores the timestamp of every block in three levels: an in-process LRU, an on-disk SQLite
+            file and the node, which is only queried in bulk for the blocks missing in the other levels.
+            Only finalized blocks are written on disk, because their timestamps never change.
+    """
+
+    def __init__(self, fetch_timestamps: Callable[[List[int]], Dict[int, int]],
+                 get_finalized_block: Callable[[], int], db_path: str = None, lru_size: int = DEFAULT_LRU_SIZE):
+        """
+            Args:
+                fetch_timestamps (Callable): Function which gets the timestamps of several blocks from the node
+                get_finalized_block (Callable): Function which gets the last block whose timestamp can be persisted
+                db_path (str): SQLite file where the timestamps are persisted. If it's None, nothing is persisted
+                lru_size (int): Maximum number of timestamps kept in memory
+        """
+        self.fetch_timestamps = fetch_timestamps
+        self.get_finalized_block = get_finalized_block
+        self.lru_size = lru_size
+        self.lru: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.connection = None
+
+        if db_path:
+            logging.info(f"Block timestamps persisted in {db_path}")
+            self.connection = sqlite3.connect(db_path, check_same_thread=False)
+            with self.lock, self.connection:
+                self.connection.execute("CREATE TABLE IF NOT EXISTS block_timestamps "
+                                        "(block_number INTEGER PRIMARY KEY, timestamp INTEGER NOT NULL)")
+                self.connection.execute("CREATE INDEX IF NOT EXISTS block_timestamps_timestamp "
+                                        "ON block_timestamps (timestamp)")
+
+    def get_timestamp(self, block_number: int) -> int:
+        """
+            Description: Gets the timestamp of a block
+            Args:
+                block_number (int): Block number
+
+            Returns: The timestamp of the block
+        """
+        return self.load([block_number])[block_number]
+
+    def load(self, block_numbers: Iterable[int]) -> Dict[int, int]:
+        """
+            Description: Gets the timestamps of several blocks, fetching only the missing ones from the node
+            Args:
+                block_numbers (Iterable[int]): Block numbers (duplicates are allowed)
+
+            Returns: Timestamp by block number
+        """
+        res = {}
+        missing = []
+        with self.lock:
+            for block_number in sorted(set(block_numbers)):
+                if block_number in self.lru:
+                    self.lru.move_to_end(block_number)
+                    res[block_number] = self.lru[block_number]
+                else:
+                    missing.append(block_number)
+
+        if missing and self.connection is not None:
+            stored = self._read_db(missing)
+            res.update(stored)
+            self._add_lru(stored)
+            missing = [block_number for block_number in missing if block_number not in stored]
+
+        if missing:
+            logging.info(f"Fetching the timestamps of {len(missing)} blocks.")
+            fetched = self.fetch_timestamps(missing)
+            res.update(fetched)
+            self._add_lru(fetched)
+            if self.connection is not None:
+                finalized_block = self.get_finalized_block()
+                self._write_db({block_number: timestamp for block_number, timestamp in fetched.items()
+                                if block_number <= finalized_block})
+
+        return res
+
+    def forget(self, from_block: int):
+        """
+            Description: Drops the timestamps kept in memory since a block, after a reorg replaced them. Persisted
+                timestamps are finalized, so they are kept
+            Args:
+                from_block (int): First block replaced
+        """
+        with self.lock:
+            for block_number in [block_number for block_number in self.lru if block_number >= from_block]:
+                del self.lru[block_number]
+
+    def get_stored_bracket(self, timestamp: int) -> Tuple[Optional[Tuple[int, int]], Optional[Tuple[int, int]]]:
+        """
+            Description: Gets the persisted blocks closest to a timestamp, used as the initial interval of a search
+            Args:
+                timestamp (int): Timestamp for being searched
+
+            Returns: (block_number, timestamp) of the last persisted block before the timestamp and of the first one
+                at or after it. They are None if there isn't any such block or nothing is persisted
+        """
+        if self.connection is None:
+            return None, None
+
+        with self.lock:
+            lower = self.connection.execute("SELECT block_number, timestamp FROM block_timestamps WHERE timestamp < ? "
+                                            "ORDER BY timestamp DESC LIMIT 1", (timestamp,)).fetchone()
+            upper = self.connection.execute("SELECT block_number, timestamp FROM block_timestamps WHERE timestamp >= ? "
+                                            "ORDER BY timestamp LIMIT 1", (timestamp,)).fetchone()
+
+        return lower, upper
+
+    def _add_lru(self, timestamps: Dict[int, int]):
+        with self.lock:
+            for block_number, timestamp in timestamps.items():
+                self.lru[block_number] = timestamp
+                self.lru.move_to_end(block_number)
+            while len(self.lru) > self.lru_size:
+                self.lru.popitem(last=False)
+
+    def _read_db(self, block_numbers: List[int]) -> Dict[int, int]:
+        res = {}
+        with self.lock:
+            for index in range(0, len(block_numbers), SQLITE_MAX_VARIABLES):
+                chunk = block_numbers[index:index + SQLITE_MAX_VARIABLES]
+                rows = self.connection.execute(
+                    f"SELECT block_number, timestamp FROM block_timestamps "
+                    f"WHERE block_number IN ({','.join('?' * len(chunk))})", chunk)
+                res.update(dict(rows))
+
+        return res
+
+    def _write_db(self, timestamps: Dict[int, int]):
+        if not timestamps:
+            return
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO block_timestamps VALUES (?, ?)", timestamps.items())
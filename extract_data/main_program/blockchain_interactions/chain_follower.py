@@ -0,0 +1,168 @@
+import logging
+from collections import namedtuple
+from typing import Callable, Dict, Generic, List, Optional, Tuple, TypeVar
+
+DEFAULT_FOLLOW_POLL_SECONDS = 12
+DEFAULT_MAX_FOLLOW_BLOCKS = 1000
+
+# (hash, parentHash) of a block, (None, None) if the node doesn't have it
+BlockHashes = Tuple[Optional[str], Optional[str]]
+# rollback_block: First block replaced by a reorg, which must be rolled back (None if there wasn't any reorg)
+# from_block, to_block: New blocks which can be processed (None if there isn't any)
+# latest_block: Latest block of the chain when the update was polled
+ChainUpdate = namedtuple("ChainUpdate", ["rollback_block", "from_block", "to_block", "latest_block"])
+
+Partial = TypeVar('Partial')
+
+
+class ChainFollower:
+    """
+        Description: Follows the head of the chain from a block. Every poll fetches the hashes of the new blocks
+            and of the last followed one in a single batch, and only blocks linked to the followed ones by their
+            parentHash are accepted. The hashes of the last confirmation_blocks blocks are kept, so when the last
+            followed block is replaced, the first replaced block (the fork) is found comparing them with the node's.
+    """
+
+    def __init__(self, fetch_block_hashes: Callable[[List[int]], Dict[int, BlockHashes]],
+                 get_latest_block: Callable[[], int], last_block: int, confirmation_blocks: int,
+                 max_blocks: int = DEFAULT_MAX_FOLLOW_BLOCKS):
+        """
+            Args:
+                fetch_block_hashes (Callable): Function which gets the hashes of several blocks from the node
+                get_latest_block (Callable): Function which gets the latest block of the chain
+                last_block (int): Last block already processed, which must be finalized
+                confirmation_blocks (int): Blocks below the latest block which are considered final, the deepest
+                    reorg which can be rolled back
+                max_blocks (int): Maximum number of new blocks returned by a poll, so catching up is done in steps
+        """
+        self.fetch_block_hashes = fetch_block_hashes
+        self.get_latest_block = get_latest_block
+        self.last_block = last_block
+        self.confirmation_blocks = confirmation_blocks
+        self.max_blocks = max_blocks
+        self.hashes: Dict[int, str] = {}
+
+    def poll(self) -> ChainUpdate:
+        """
+            Description: Checks the head of the chain
+
+            Returns: The new blocks since the last poll, or the first block which must be rolled back if the last
+                followed block was replaced. After a rollback, the next poll returns the blocks of the new branch
+        """
+        latest_block = self.get_latest_block()
+        to_block = min(latest_block, self.last_block + self.max_blocks)
+        headers = self.fetch_block_hashes(list(range(self.last_block, max(to_block, self.last_block) + 1)))
+
+        last_hash = headers[self.last_block][0]
+        if self.last_block in self.hashes and last_hash != self.hashes[self.last_block]:
+            fork_block = self._find_fork_block()
+            self.rewind(fork_block - 1)
+            return ChainUpdate(fork_block, None, None, latest_block)
+
+        self.hashes[self.last_block] = last_hash
+        from_block = self.last_block + 1
+        for block_number in range(from_block, to_block + 1):
+            block_hash, parent_hash = headers[block_number]
+            if block_hash is None or parent_hash != self.hashes[block_number - 1]:
+                # The head changed while the hashes were fetched, the rest of blocks are checked in the next poll
+                break
+            self.hashes[block_number] = block_hash
+            self.last_block = block_number
+
+        for block_number in [block_number for block_number in self.hashes
+                             if block_number < self.last_block - self.confirmation_blocks]:
+            del self.hashes[block_number]
+
+        if self.last_block < from_block:
+            return ChainUpdate(None, None, None, latest_block)
+        return ChainUpdate(None, from_block, self.last_block, latest_block)
+
+    def rewind(self, block_number: int):
+        """
+            Description: Forgets the blocks after a block, so they are returned again by the next poll
+            Args:
+                block_number (int): Last block which is kept
+        """
+        for stored_block in [stored_block for stored_block in self.hashes if stored_block > block_number]:
+            del self.hashes[stored_block]
+        self.last_block = block_number
+
+    def _find_fork_block(self) -> int:
+        block_numbers = sorted(self.hashes, reverse=True)
+        headers = self.fetch_block_hashes(block_numbers)
+        for block_number in block_numbers:
+            if headers[block_number][0] == self.hashes[block_number]:
+                logging.warning(f"Reorg detected: the blocks after {block_number} were replaced "
+                                f"(up to {self.last_block}).")
+                return block_number + 1
+
+        raise ValueError(f"Reorg deeper than confirmation_blocks ({self.confirmation_blocks}): the blocks since "
+                         f"{block_numbers[-1]} were replaced, so the results must be calculated again.")
+
+
+class ReorgSafeAggregate(Generic[Partial]):
+    """
+        Description: Aggregate of the partial results (summaries, lists...) of consecutive block ranges which can
+            be rolled back after a reorg. The partials of finalized ranges are merged in a checkpoint and dropped,
+            the rest are kept until they are finalized, so a rollback rebuilds the aggregate from the checkpoint and
+            the partials before the fork instead of scanning the finalized blocks again. Every aggregate which is
+            rolled back together must receive the same ranges.
+    """
+
+    def __init__(self, create: Callable[[], Partial], merge: Callable[[Partial, Partial], None],
+                 checkpoint: Partial = None):
+        """
+            Args:
+                create (Callable): Function which creates an empty aggregate
+                merge (Callable): Function which adds a partial to an aggregate, without modifying the partial
+                checkpoint (Partial): Aggregate of the finalized blocks already processed (empty if it's None)
+        """
+        self.create = create
+        self.merge = merge
+        self.checkpoint = create() if checkpoint is None else checkpoint
+        self.pending: List[Tuple[int, int, Partial]] = []
+        self.value = self._rebuild()
+
+    def add(self, from_block: int, to_block: int, partial: Partial):
+        """
+            Description: Adds the partial result of a block range, which must follow the previous one
+            Args:
+                from_block (int): Initial block of the range (included)
+                to_block (int): Final block of the range (included)
+                partial (Partial): Partial result of the range
+        """
+        self.pending.append((from_block, to_block, partial))
+        self.merge(self.value, partial)
+
+    def finalize(self, finalized_block: int):
+        """
+            Description: Merges in the checkpoint the partials of the ranges which can't be rolled back anymore
+            Args:
+                finalized_block (int): Last finalized block
+        """
+        while self.pending and self.pending[0][1] <= finalized_block:
+            self.merge(self.checkpoint, self.pending.pop(0)[2])
+
+    def rollback(self, fork_block: int) -> int:
+        """
+            Description: Drops the partials of the ranges with any block since a block
+            Args:
+                fork_block (int): First block replaced by a reorg
+
+            Returns: First block which must be processed again (the first block of the first range dropped)
+        """
+        dropped = [index for index, (_, to_block, _) in enumerate(self.pending) if to_block >= fork_block]
+        if not dropped:
+            return fork_block
+
+        first_block = min(self.pending[dropped[0]][0], fork_block)
+        del self.pending[dropped[0]:]
+        self.value = self._rebuild()
+        return first_block
+
+    def _rebuild(self) -> Partial:
+        res = self.create()
+        self.merge(res, self.checkpoint)
+        for _, _, partial in self.pending:
+            self.merge(res, partial)
+        return res
@@ -0,0 +1,150 @@
+import json
+import logging
+import threading
+import weakref
+from collections import namedtuple
+from typing import Dict, Optional, Tuple
+
+from eth_utils import event_abi_to_log_topic
+from hexbytes import HexBytes
+from web3 import Web3
+from web3.contract import Contract
+
+# Name used in app-config.json for the contract of airdrop_info
+AIRDROP_NAME = "airdrop"
+
+# Event of a contract: its abi, its first topic and the ContractEvent which decodes its logs
+EventInfo = namedtuple("EventInfo", ["abi", "topic", "decoder"])
+EventDefinitions = Dict[str, Tuple[dict, HexBytes]]
+
+_event_indexes = weakref.WeakKeyDictionary()
+_event_indexes_lock = threading.Lock()
+
+
+class ContractRegistry:
+    """
+        Description: Contracts of the tokens defined in app-config.json. ABI files are only read when a contract
+            needs them (once per file, even if several tokens share it), contracts are created once per checksum
+            address and the events of every ABI are indexed by name once, so looking them up is a dict hit.
+    """
+
+    def __init__(self, w3: Web3, abi_paths: Dict[str, str]):
+        """
+            Args:
+                w3 (Web3): Web3 object connected to the node
+                abi_paths (Dict[str, str]): Path of the ABI file by token's name
+        """
+        self.w3 = w3
+        self.abi_paths = abi_paths
+        self.abis: Dict[str, list] = {}
+        self.event_definitions: Dict[str, EventDefinitions] = {}
+        self.contracts: Dict[str, Contract] = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, w3: Web3, app_config: dict) -> 'ContractRegistry':
+        """
+            Description: Creates a registry with the tokens defined in app-config.json
+            Args:
+                w3 (Web3): Web3 object connected to the node
+                app_config (dict): app-config.json (erc20_list, compound_tokens and airdrop_info)
+
+            Returns: The registry. The airdrop's contract is registered as "airdrop"
+        """
+        abi_paths = {token["name"]: token["abi_path"] for token in app_config["erc20_list"]}
+        abi_paths.update({ctoken["name"]: ctoken["abi_path"] for ctoken in app_config["compound_tokens"]})
+        abi_paths[AIRDROP_NAME] = app_config["airdrop_info"]["airdrop_address_abi"]
+        return cls(w3, abi_paths)
+
+    def get_abi(self, name: str) -> list:
+        """
+            Description: Gets the ABI of a token, reading its file the first time
+            Args:
+                name (str): Token's name
+
+            Returns: The ABI
+        """
+        with self.lock:
+            return self._load_abi(self._get_abi_path(name))
+
+    def get_contract(self, address: str, name: str) -> Contract:
+        """
+            Description: Gets the contract object of an address. It's only created once per checksum address
+            Args:
+                address (str): Smart Contract's address
+                name (str): Token's name, whose ABI is used for creating the contract
+
+            Returns: The contract object
+        """
+        checksum_address = Web3.toChecksumAddress(address)
+        with self.lock:
+            if checksum_address not in self.contracts:
+                logging.info(f"Contract object ({name}) created for being analyzed.")
+                path = self._get_abi_path(name)
+                contract = self.w3.eth.contract(checksum_address, abi=self._load_abi(path))
+                if path not in self.event_definitions:
+                    self.event_definitions[path] = get_event_definitions(contract.abi)
+                get_event_index(contract, self.event_definitions[path])
+                self.contracts[checksum_address] = contract
+
+            return self.contracts[checksum_address]
+
+    def _get_abi_path(self, name: str) -> str:
+        if name not in self.abi_paths:
+            raise ValueError(f"There isn't any abi_path defined for {name}")
+        return self.abi_paths[name]
+
+    def _load_abi(self, path: str) -> list:
+        if path not in self.abis:
+            logging.info(f"Reading the abi file {path}.")
+            with open(path, 'r') as json_file:
+                self.abis[path] = json.load(json_file)
+        return self.abis[path]
+
+
+def get_event_definitions(abi: list) -> EventDefinitions:
+    """
+        Description: Indexes the events of an ABI by name
+        Args:
+            abi (list): ABI of a contract
+
+        Returns: Abi and first topic by event's name (the first definition if the name is overloaded)
+    """
+    res = {}
+    for item in abi:
+        if item.get("type") == "event" and item["name"] not in res:
+            res[item["name"]] = (item, HexBytes(event_abi_to_log_topic(item)))
+    return res
+
+
+def get_event_index(contract: Contract, event_definitions: EventDefinitions = None) -> Dict[str, EventInfo]:
+    """
+        Description: Gets the events of a contract by name. The index is built once per contract object
+        Args:
+            contract (Contract): Smart Contract's object
+            event_definitions (EventDefinitions): Events of the contract's ABI, if they are already indexed
+
+        Returns: EventInfo by event's name
+    """
+    with _event_indexes_lock:
+        index = _event_indexes.get(contract)
+        if index is None:
+            index = {name: EventInfo(event_abi, topic, contract.events[name]())
+                     for name, (event_abi, topic) in (event_definitions or get_event_definitions(contract.abi)).items()}
+            _event_indexes[contract] = index
+
+    return index
+
+
+def get_amount_input(event_abi: dict) -> Optional[str]:
+    """
+        Description: Gets the input with the amount of an event: its only non-indexed uint256 input, whatever its
+            name is (value, amount, wad...)
+        Args:
+            event_abi (dict): ABI of the event
+
+        Returns: The input's name, None if the event doesn't have exactly one non-indexed uint256 input
+    """
+    amounts = [event_input["name"] for event_input in event_abi["inputs"]
+               if not event_input.get("indexed", False) and event_input["type"] == "uint256"]
+    return amounts[0] if len(amounts) == 1 else None
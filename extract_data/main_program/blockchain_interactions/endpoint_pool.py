@@ -0,0 +1,253 @@
+import json
+import logging
+import threading
+import time
+from contextlib import nullcontext
+from typing import Any, Callable, List, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from web3.providers.base import JSONBaseProvider
+from web3.types import RPCEndpoint, RPCResponse
+
+from extract_data.main_program.blockchain_interactions.block_scheduler import RateLimiter
+from extract_data.main_program.blockchain_interactions.instrumentation import RpcMetrics
+
+DEFAULT_CONNECTION_POOL_SIZE = 20
+DEFAULT_REQUEST_TIMEOUT = 10
+# Latency added to every node, so the requests in flight are considered before the first response
+MIN_LATENCY = 0.001
+MAX_CONSECUTIVE_FAILURES = 3
+EJECTION_SECONDS = 30
+MAX_EJECTION_SECONDS = 600
+# Weight of the last request in the moving average of the latency
+LATENCY_SMOOTHING = 0.2
+
+
+class Endpoint:
+    """
+        Description: Node of the pool, with its own keep-alive connection pool, rate limit and health stats
+    """
+
+    __slots__ = ("uri", "session", "rate_limiter", "latency", "in_flight", "num_requests", "consecutive_failures",
+                 "num_ejections", "ejected_until")
+
+    def __init__(self, uri: str, max_requests_per_second: float = None,
+                 connection_pool_size: int = DEFAULT_CONNECTION_POOL_SIZE):
+        """
+            Args:
+                uri (str): Endpoint of the node
+                max_requests_per_second (float): Maximum number of requests per second sent to the node (unlimited
+                    if it's None)
+                connection_pool_size (int): Maximum number of keep-alive connections with the node
+        """
+        self.uri = uri
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=connection_pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+        self.rate_limiter = RateLimiter(max_requests_per_second) if max_requests_per_second else None
+        self.latency = 0.0
+        self.in_flight = 0
+        self.num_requests = 0
+        self.consecutive_failures = 0
+        self.num_ejections = 0
+        self.ejected_until = 0.0
+
+    def get_score(self) -> float:
+        """
+            Description: Gets the expected cost of sending a new request to the node (lower is better)
+            Args: None
+
+            Returns: The average latency weighted by the requests which are being sent
+        """
+        return (self.latency + MIN_LATENCY) * (self.in_flight + 1)
+
+
+class LoadBalancedProvider(JSONBaseProvider):
+    """
+        Description: Web3 provider which spreads the requests among several nodes. Every request goes to the healthy
+            node with the lowest score (latency by requests in flight). A node is ejected for a while after
+            several consecutive failures, and its requests are sent to the other nodes. When every node is ejected,
+            the one which was ejected first is used, so the run never stops because of the pool.
+    """
+
+    def __init__(self, endpoints: List[Union[str, dict]], max_requests_per_second: float = None,
+                 connection_pool_size: int = DEFAULT_CONNECTION_POOL_SIZE,
+                 request_timeout: float = DEFAULT_REQUEST_TIMEOUT, metrics: RpcMetrics = None,
+                 max_requests_in_flight: int = None):
+        """
+            Args:
+                endpoints (List[Union[str, dict]]): Uri of every node, or a dict with its uri and its own
+                    max_requests_per_second
+                max_requests_per_second (float): Default maximum number of requests per second sent to every node
+                connection_pool_size (int): Maximum number of keep-alive connections with every node
+                request_timeout (float): Seconds waited for the response of a node
+                metrics (RpcMetrics): Metrics where every request is recorded (nothing is recorded if it's None)
+                max_requests_in_flight (int): Maximum number of requests sent at the same time to the pool by every
+                    thread of the program (unlimited if it's None)
+        """
+        super().__init__()
+        if not endpoints:
+            raise ValueError("At least one endpoint is needed")
+
+        self.request_timeout = request_timeout
+        self.metrics = metrics
+        self.in_flight_limit = threading.BoundedSemaphore(max_requests_in_flight) if max_requests_in_flight \
+            else nullcontext()
+        self.lock = threading.Lock()
+        self.endpoints = []
+        for endpoint in endpoints:
+            endpoint = endpoint if isinstance(endpoint, dict) else {"uri": endpoint}
+            self.endpoints.append(Endpoint(endpoint["uri"],
+                                           endpoint.get("max_requests_per_second", max_requests_per_second),
+                                           connection_pool_size))
+
+    @classmethod
+    def from_config(cls, app_config: dict, metrics: RpcMetrics = None) -> 'LoadBalancedProvider':
+        """
+            Description: Creates a provider using the parameters defined in app-config.json
+            Args:
+                app_config (dict): app-config.json (ethereum_nodes, or ethereum_node for a single node)
+                metrics (RpcMetrics): Metrics where every request is recorded
+
+            Returns: The provider
+        """
+        return cls(app_config.get("ethereum_nodes") or [app_config["ethereum_node"]],
+                   app_config.get("max_requests_per_second"),
+                   app_config.get("connection_pool_size", DEFAULT_CONNECTION_POOL_SIZE),
+                   app_config.get("request_timeout", DEFAULT_REQUEST_TIMEOUT), metrics,
+                   app_config.get("max_requests_in_flight"))
+
+    def make_request(self, method: RPCEndpoint, params: Any) -> RPCResponse:
+        """
+            Description: Sends a JSON-RPC request to the best node of the pool
+            Args:
+                method (RPCEndpoint): JSON-RPC method
+                params (Any): Parameters of the method
+
+            Returns: The JSON-RPC response
+        """
+        return self._post(self.encode_rpc_request(method, params), method, parse=self.decode_rpc_response)
+
+    def make_batch_request(self, rpc_requests: List[Tuple[str, list]]) -> List[RPCResponse]:
+        """
+            Description: Sends several JSON-RPC requests in a single batch to the best node of the pool
+            Args:
+                rpc_requests (List[Tuple[str, list]]): (method, params) of every request
+
+            Returns: The JSON-RPC response of every request, in the same order as rpc_requests. When a node rejects
+                the batch or leaves some requests out, the batch is sent to another node
+        """
+        methods = {method for method, _ in rpc_requests}
+        return self._post(json.dumps([
+            {"jsonrpc": "2.0", "method": method, "params": params, "id": num_request}
+            for num_request, (method, params) in enumerate(rpc_requests)
+        ]).encode(), methods.pop() if len(methods) == 1 else "batch", len(rpc_requests),
+            lambda raw_response: parse_batch_response(raw_response, len(rpc_requests)))
+
+    def get_stats(self) -> List[dict]:
+        """
+            Description: Gets the health stats of every node
+            Args: None
+
+            Returns: uri, requests, average latency and if it's ejected for every node
+        """
+        with self.lock:
+            return [{"uri": endpoint.uri, "requests": endpoint.num_requests, "latency": round(endpoint.latency, 4),
+                     "ejected": endpoint.ejected_until > time.monotonic()} for endpoint in self.endpoints]
+
+    def _post(self, data: bytes, method: str, num_requests: int = 1,
+              parse: Callable[[bytes], Any] = lambda raw_response: raw_response) -> Any:
+        with self.in_flight_limit:
+            return self._post_to_pool(data, method, num_requests, parse)
+
+    def _post_to_pool(self, data: bytes, method: str, num_requests: int, parse: Callable[[bytes], Any]) -> Any:
+        tried = set()
+        while True:
+            endpoint = self._acquire_endpoint(tried)
+            tried.add(endpoint.uri)
+            if endpoint.rate_limiter is not None:
+                endpoint.rate_limiter.wait()
+
+            start = time.monotonic()
+            try:
+                response = endpoint.session.post(endpoint.uri, data=data, timeout=self.request_timeout)
+                response.raise_for_status()
+                # A node can answer with a status 200 and a body which isn't the response (rate limits, errors...)
+                result = parse(response.content)
+            except (requests.exceptions.RequestException, ValueError) as error:
+                self._release_endpoint(endpoint, time.monotonic() - start, False)
+                if self.metrics is not None:
+                    self.metrics.record_request(method, num_requests, time.monotonic() - start, len(data), 0, False)
+                retry_elsewhere = not isinstance(error, requests.exceptions.Timeout) and len(tried) < len(
+                    self.endpoints)
+                logging.warning(f"Request {method} to {endpoint.uri} failed"
+                                f"{', trying another node' if retry_elsewhere else ''}: {error}")
+                if not retry_elsewhere:
+                    raise
+                continue
+
+            latency = time.monotonic() - start
+            self._release_endpoint(endpoint, latency, True)
+            if self.metrics is not None:
+                self.metrics.record_request(method, num_requests, latency, len(data), len(response.content), True)
+            return result
+
+    def _acquire_endpoint(self, tried: set) -> Endpoint:
+        with self.lock:
+            now = time.monotonic()
+            candidates = [endpoint for endpoint in self.endpoints
+                          if endpoint.uri not in tried and endpoint.ejected_until <= now]
+            if candidates:
+                endpoint = min(candidates, key=lambda candidate: (candidate.get_score(), candidate.num_requests))
+            else:
+                endpoint = min([endpoint for endpoint in self.endpoints if endpoint.uri not in tried] or self.endpoints,
+                               key=lambda candidate: candidate.ejected_until)
+            endpoint.in_flight += 1
+            endpoint.num_requests += 1
+            return endpoint
+
+    def _release_endpoint(self, endpoint: Endpoint, latency: float, success: bool):
+        # A failed request costs as much as a timeout, so failing nodes get a worse score
+        latency = latency if success else max(latency, self.request_timeout)
+        with self.lock:
+            endpoint.in_flight -= 1
+            endpoint.latency = latency if not endpoint.latency else \
+                (1 - LATENCY_SMOOTHING) * endpoint.latency + LATENCY_SMOOTHING * latency
+            if success:
+                endpoint.consecutive_failures = 0
+                endpoint.num_ejections = 0
+                return
+
+            endpoint.consecutive_failures += 1
+            if endpoint.consecutive_failures >= MAX_CONSECUTIVE_FAILURES and len(self.endpoints) > 1:
+                ejection = min(EJECTION_SECONDS * 2 ** endpoint.num_ejections, MAX_EJECTION_SECONDS)
+                endpoint.num_ejections += 1
+                endpoint.consecutive_failures = 0
+                endpoint.ejected_until = time.monotonic() + ejection
+                logging.warning(f"Node {endpoint.uri} ejected for {ejection}s after {MAX_CONSECUTIVE_FAILURES} "
+                                f"consecutive failures.")
+
+
+def parse_batch_response(raw_response: bytes, num_requests: int) -> List[RPCResponse]:
+    """
+        Description: Reads the response of a JSON-RPC batch
+        Args:
+            raw_response (bytes): Body of the response
+            num_requests (int): Number of requests of the batch, whose ids are 0...num_requests - 1
+
+        Returns: The response of every request, sorted by id. A ValueError is raised if the node rejected the whole
+            batch (a single error object) or some requests weren't answered
+    """
+    responses = json.loads(raw_response)
+    if not isinstance(responses, list):
+        error = responses.get("error", responses) if isinstance(responses, dict) else responses
+        raise ValueError(f"The node rejected the batch: {error}")
+
+    responses = {response.get("id"): response for response in responses if isinstance(response, dict)}
+    missing = [num_request for num_request in range(num_requests) if num_request not in responses]
+    if missing:
+        raise ValueError(f"The node didn't answer {len(missing)} of {num_requests} requests of the batch")
+    return [responses[num_request] for num_request in range(num_requests)]
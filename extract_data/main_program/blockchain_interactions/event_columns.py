@@ -0,0 +1,145 @@
+from array import array
+from collections import namedtuple
+from typing import Callable, Dict, Iterable, Tuple
+
+from web3.types import EventData
+
+# Name of the column with the index of the route (token, event type) of every event
+ROUTE_COLUMN = "route"
+ROUTE_TYPECODE = 'H'
+
+# typecode: typecode of the array where the values are stored
+# source: "blockNumber", "logIndex", "transactionIndex" or the name of a numeric event argument
+# convert: function applied to every value before being stored (None to store the value as it is)
+Field = namedtuple("Field", ["typecode", "source", "convert"], defaults=[None])
+
+TOP_LEVEL_SOURCES = ("blockNumber", "logIndex", "transactionIndex")
+
+
+class EventColumns:
+    """
+        Description: Compact container of events which keeps only the needed fields, every one in a typed array,
+            and the route (token, event type) of every event. Windows are appended as they arrive and slices are
+            memoryviews of the arrays, so they don't copy any value. The arrays can't grow while a slice of them is
+            alive, so slices must be released before appending more windows.
+    """
+
+    __slots__ = ("typecodes", "columns")
+
+    def __init__(self, typecodes: Dict[str, str], columns: Dict[str, Iterable] = None):
+        """
+            Args:
+                typecodes (Dict[str, str]): Typecode of the array of every column by column's name
+                columns (Dict[str, Iterable]): Initial values of every column. If it's None, the columns are empty
+        """
+        self.typecodes = typecodes
+        self.columns = {}
+        for name, typecode in typecodes.items():
+            values = columns[name] if columns else []
+            self.columns[name] = values if isinstance(values, memoryview) else array(typecode, values)
+
+    @classmethod
+    def empty(cls, fields: Dict[str, Field]) -> 'EventColumns':
+        """
+            Description: Creates an empty container for some fields
+            Args:
+                fields (Dict[str, Field]): Fields by column's name
+
+            Returns: The container, with a column for every field and the route's column
+        """
+        return cls({ROUTE_COLUMN: ROUTE_TYPECODE, **{name: field.typecode for name, field in fields.items()}})
+
+    @classmethod
+    def from_events(cls, events: Iterable[EventData], fields: Dict[str, Field],
+                    get_route_index: Callable[[EventData], int]) -> 'EventColumns':
+        """
+            Description: Creates a container with the fields of decoded events
+            Args:
+                events (Iterable[EventData]): Decoded events
+                fields (Dict[str, Field]): Fields by column's name
+                get_route_index (Callable): Function which gets the index of the route of an event
+
+            Returns: The container, with the events in the same order
+        """
+        res = cls.empty(fields)
+        for event in events:
+            res.columns[ROUTE_COLUMN].append(get_route_index(event))
+            for name, field in fields.items():
+                value = event[field.source] if field.source in TOP_LEVEL_SOURCES else event["args"][field.source]
+                res.columns[name].append(field.convert(value) if field.convert else value)
+
+        return res
+
+    @classmethod
+    def from_decoded(cls, columns_by_route: Dict[Tuple, Dict[str, Iterable]], route_indexes: Dict[Tuple, int],
+                     fields: Dict[str, Field]) -> 'EventColumns':
+        """
+            Description: Creates a container with the fields of the columns returned by RawLogDecoder
+            Args:
+                columns_by_route (Dict): Decoded columns by route
+                route_indexes (Dict): Index of every route
+                fields (Dict[str, Field]): Fields by column's name
+
+            Returns: The container, with the events grouped by route
+        """
+        res = cls.empty(fields)
+        for route, columns in columns_by_route.items():
+            res.columns[ROUTE_COLUMN].extend([route_indexes[route]] * len(columns["blockNumber"]))
+            for name, field in fields.items():
+                values = columns[field.source]
+                res.columns[name].extend(map(field.convert, values) if field.convert else values)
+
+        return res
+
+    def __len__(self) -> int:
+        return len(self.columns[ROUTE_COLUMN])
+
+    def __getitem__(self, name: str):
+        """
+            Description: Gets a column
+            Args:
+                name (str): Column's name
+
+            Returns: The typed array (or memoryview for slices) of the column
+        """
+        return self.columns[name]
+
+    def __iadd__(self, other: 'EventColumns') -> 'EventColumns':
+        """
+            Description: Appends the events of another container (a window) at the end
+            Args:
+                other (EventColumns): Container with the same columns
+
+            Returns: This container
+        """
+        for name, column in self.columns.items():
+            column.extend(other.columns[name])
+
+        return self
+
+    def slice(self, start: int, stop: int) -> 'EventColumns':
+        """
+            Description: Gets a part of the events without copying them
+            Args:
+                start (int): Index of the first event (included)
+                stop (int): Index of the last event (excluded)
+
+            Returns: A read-only container whose columns are memoryviews of this container
+        """
+        return EventColumns(self.typecodes, {name: memoryview(column)[start:stop].toreadonly()
+                                             for name, column in self.columns.items()})
+
+    def split_by_route(self, num_routes: int, name: str) -> list:
+        """
+            Description: Splits a column by route
+            Args:
+                num_routes (int): Number of routes
+                name (str): Column's name
+
+            Returns: A typed array with the values of the column for every route index
+        """
+        res = [array(self.typecodes[name]) for _ in range(num_routes)]
+        for route_index, value in zip(self.columns[ROUTE_COLUMN], self.columns[name]):
+            res[route_index].append(value)
+
+        return res
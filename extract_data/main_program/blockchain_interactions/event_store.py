@@ -0,0 +1,209 @@
+import json
+import logging
+import sqlite3
+import threading
+from typing import Callable, Iterable, Iterator, List, Tuple
+
+from hexbytes import HexBytes
+from web3.datastructures import AttributeDict
+from web3.types import EventData
+
+# (scope, contract's address, event's name). The scope identifies the argument filters used in the search
+StoreKey = Tuple[str, str, str]
+# Blocks of the stored events read at once by iter_sync
+DEFAULT_READ_WINDOW_SIZE = 10000
+
+
+class EventStore:
+    """
+        Description: Local SQLite store of decoded events. Every (scope, contract, event) has a checkpoint with the
+            interval of finalized blocks which is already stored, so only the blocks outside it are fetched.
+            Blocks after the last finalized block are never stored, they are fetched again in every run.
+    """
+
+    def __init__(self, db_path: str):
+        """
+            Args:
+                db_path (str): SQLite file where the events are persisted
+        """
+        logging.info(f"Events persisted in {db_path}")
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS events "
+                                    "(scope TEXT, contract TEXT, event TEXT, block_number INTEGER, "
+                                    "log_index INTEGER, data TEXT NOT NULL, "
+                                    "PRIMARY KEY (scope, contract, event, block_number, log_index))")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS checkpoints "
+                                    "(scope TEXT, contract TEXT, event TEXT, from_block INTEGER, to_block INTEGER, "
+                                    "PRIMARY KEY (scope, contract, event))")
+
+    def sync(self, keys: List[StoreKey], from_block: int, to_block: int, finalized_block: int,
+             fetch_range: Callable[[int, int], List[EventData]], get_scope: Callable[[EventData], str]) \
+            -> List[EventData]:
+        """
+            Description: Gets the events of a blocks' interval, fetching only the blocks which aren't stored
+            Args:
+                keys (List[StoreKey]): (scope, contract, event) of every event which fetch_range returns
+                from_block (int): Initial block for being analyzed
+                to_block (int): Final block for being analyzed
+                finalized_block (int): Last block which can be stored
+                fetch_range (Callable): Function which gets the events of an interval from the node
+                get_scope (Callable): Function which gets the scope of a fetched event
+
+            Returns: Events of the interval, sorted by block number and log index
+        """
+        return [event for events_window in self.iter_sync(
+            keys, from_block, to_block, finalized_block,
+            lambda range_from, range_to: [fetch_range(range_from, range_to)], get_scope,
+            max(to_block - from_block + 1, 1)) for event in events_window]
+
+    def iter_sync(self, keys: List[StoreKey], from_block: int, to_block: int, finalized_block: int,
+                  iter_range: Callable[[int, int], Iterable[List[EventData]]],
+                  get_scope: Callable[[EventData], str], window_size: int = DEFAULT_READ_WINDOW_SIZE) \
+            -> Iterator[List[EventData]]:
+        """
+            Description: Gets the events of a blocks' interval window by window, fetching only the blocks which
+                aren't stored. Fetched windows are stored as soon as they arrive and the interval is read back from
+                the store window by window, so only a window is kept in memory (and the events after the last
+                finalized block, which aren't stored)
+            Args:
+                keys (List[StoreKey]): (scope, contract, event) of every event which iter_range returns
+                from_block (int): Initial block for being analyzed
+                to_block (int): Final block for being analyzed
+                finalized_block (int): Last block which can be stored
+                iter_range (Callable): Function which gets the events of an interval from the node, window by window
+                get_scope (Callable): Function which gets the scope of a fetched event
+                window_size (int): Number of blocks read at once from the store
+
+            Returns: Iterator of the events of every window, sorted by block number and log index
+        """
+        tail_events = []
+        for range_from, range_to in self.get_missing_ranges(keys, from_block, to_block):
+            logging.info(f"Fetching events ({range_from}, {range_to}) not stored for {len(keys)} keys.")
+            for events in iter_range(range_from, range_to):
+                self.save_events([event for event in events if event["blockNumber"] <= finalized_block], get_scope)
+                tail_events += [event for event in events if event["blockNumber"] > finalized_block]
+            if range_from <= finalized_block:
+                self.update_checkpoints(keys, range_from, min(range_to, finalized_block))
+
+        for window_from in range(from_block, min(to_block, finalized_block) + 1, window_size):
+            yield self.get_events(keys, window_from, min(window_from + window_size - 1, to_block, finalized_block))
+        yield tail_events
+
+    def get_missing_ranges(self, keys: List[StoreKey], from_block: int, to_block: int) -> List[Tuple[int, int]]:
+        """
+            Description: Gets the parts of a blocks' interval which aren't stored for every key
+            Args:
+                keys (List[StoreKey]): (scope, contract, event) which are needed
+                from_block (int): Initial block of the interval
+                to_block (int): Final block of the interval
+
+            Returns: List of (from_block, to_block) intervals which must be fetched
+        """
+        covered_from, covered_to = from_block, to_block
+        with self.lock:
+            for key in keys:
+                checkpoint = self.connection.execute(
+                    "SELECT from_block, to_block FROM checkpoints WHERE scope = ? AND contract = ? AND event = ?",
+                    key).fetchone()
+                if checkpoint is None:
+                    return [(from_block, to_block)]
+                covered_from, covered_to = max(covered_from, checkpoint[0]), min(covered_to, checkpoint[1])
+
+        if covered_from > covered_to:
+            return [(from_block, to_block)]
+
+        res = []
+        if from_block < covered_from:
+            res.append((from_block, covered_from - 1))
+        if covered_to < to_block:
+            res.append((covered_to + 1, to_block))
+
+        return res
+
+    def update_checkpoints(self, keys: List[StoreKey], from_block: int, to_block: int):
+        """
+            Description: Marks a blocks' interval as stored for every key. It's merged with the stored interval
+                when both are contiguous, otherwise the new one replaces it.
+            Args:
+                keys (List[StoreKey]): (scope, contract, event) which were stored
+                from_block (int): Initial block of the interval
+                to_block (int): Final block of the interval
+        """
+        with self.lock, self.connection:
+            for key in keys:
+                checkpoint = self.connection.execute(
+                    "SELECT from_block, to_block FROM checkpoints WHERE scope = ? AND contract = ? AND event = ?",
+                    key).fetchone()
+                new_from, new_to = from_block, to_block
+                if checkpoint is not None and checkpoint[0] <= to_block + 1 and from_block <= checkpoint[1] + 1:
+                    new_from, new_to = min(checkpoint[0], from_block), max(checkpoint[1], to_block)
+                self.connection.execute("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?)",
+                                        (*key, new_from, new_to))
+
+    def save_events(self, events: List[EventData], get_scope: Callable[[EventData], str]):
+        """
+            Description: Stores decoded events
+            Args:
+                events (List[EventData]): Decoded events
+                get_scope (Callable): Function which gets the scope of an event
+        """
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?)", [
+                (get_scope(event), event["address"].lower(), event["event"], event["blockNumber"], event["logIndex"],
+                 serialize_event(event)) for event in events])
+
+    def get_events(self, keys: List[StoreKey], from_block: int, to_block: int) -> List[EventData]:
+        """
+            Description: Gets the stored events of a blocks' interval
+            Args:
+                keys (List[StoreKey]): (scope, contract, event) which are needed
+                from_block (int): Initial block of the interval
+                to_block (int): Final block of the interval
+
+            Returns: Events of the interval, sorted by block number and log index
+        """
+        rows = []
+        with self.lock:
+            for key in keys:
+                rows += self.connection.execute(
+                    "SELECT block_number, log_index, data FROM events WHERE scope = ? AND contract = ? AND event = ? "
+                    "AND block_number BETWEEN ? AND ?", (*key, from_block, to_block)).fetchall()
+
+        return [deserialize_event(data) for _, _, data in sorted(rows, key=lambda row: (row[0], row[1]))]
+
+
+def serialize_event(event: EventData) -> str:
+    """
+        Description: Converts a decoded event in a json string
+        Args:
+            event (EventData): Decoded event
+
+        Returns: The json string
+    """
+    return json.dumps({
+        "args": {name: value.hex() if isinstance(value, bytes) else value for name, value in event["args"].items()},
+        "event": event["event"],
+        "logIndex": event["logIndex"],
+        "transactionIndex": event["transactionIndex"],
+        "transactionHash": event["transactionHash"].hex(),
+        "address": event["address"],
+        "blockHash": event["blockHash"].hex(),
+        "blockNumber": event["blockNumber"]
+    })
+
+
+def deserialize_event(data: str) -> EventData:
+    """
+        Description: Converts a json string created by serialize_event in a decoded event
+        Args:
+            data (str): The json string
+
+        Returns: The decoded event, with the same structure as the events returned by web3
+    """
+    event = json.loads(data)
+    event["args"] = AttributeDict(event["args"])
+    event["transactionHash"] = HexBytes(event["transactionHash"])
+    event["blockHash"] = HexBytes(event["blockHash"])
+    return AttributeDict(event)
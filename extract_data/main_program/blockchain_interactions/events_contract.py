@@ -1,11 +1,16 @@
 import logging
 from typing import List
 
+from web3._utils.events import construct_event_topic_set
 from web3.contract import Contract
 from web3.types import LogReceipt
 
 from enum import Enum, unique, auto
 
+from extract_data.main_program.blockchain_interactions.block_blooms import BloomIndex
+from extract_data.main_program.blockchain_interactions.block_range_planner import BlockRangePlanner
+from extract_data.main_program.blockchain_interactions.contract_registry import get_event_index
+
 
 @unique
 class Event(Enum):
@@ -17,7 +22,8 @@ class Event(Enum):
 
 
 def get_event_from_contract(type_event: Event, contract: Contract, from_block: int, to_block: int, name_token: str,
-                            argument_filters: dict = None) -> List[LogReceipt]:
+                            argument_filters: dict = None, planner: BlockRangePlanner = None,
+                            bloom_index: BloomIndex = None) -> List[LogReceipt]:
     """
         Description: Gets events in the specified contract and in the specified blocks' interval
         Args:
@@ -27,36 +33,43 @@ def get_event_from_contract(type_event: Event, contract: Contract, from_block: i
             to_block (int): Final block for being analyzed
             argument_filters (dict): Filters for being applied in the search
             name_token (str): Token's name which is being analyzed
+            planner (BlockRangePlanner): If it's defined, the interval is split in adaptive windows
+            bloom_index (BloomIndex): If it's defined, the logs are only queried in the blocks whose logsBloom may
+                contain the event
 
         Returns: Events in the specified contract and in the specified blocks' interval
     """
 
     logging.info(f"Checking if {type_event.name} is defined in the abi file's contract ({name_token}).")
-    if type_event.name not in [event["name"] for event in contract.events.__dict__['_events']]:
+    if type_event.name not in get_event_index(contract):
         logging.info(f"The event {type_event.name} is not in contract ({name_token})")
         return []
-    logging.info(f"{type_event.name} event filter in execution (fromBlock={from_block}, toBlock={to_block},"
-                 f"argument_filters={argument_filters}).")
-
-    if type_event == Event.Transfer:
-        return contract.events.Transfer.createFilter(
-            fromBlock=from_block,
-            toBlock=to_block,
-            argument_filters=argument_filters).get_all_entries()
-    elif type_event == Event.Swap:
-        return contract.events.Swap.createFilter(
-            fromBlock=from_block,
-            toBlock=to_block,
-            argument_filters=argument_filters).get_all_entries()
-    elif type_event == Event.Mint:
-        return contract.events.Mint.createFilter(
-            fromBlock=from_block,
-            toBlock=to_block).get_all_entries()
-    elif type_event == Event.Burnt:
-        return contract.events.Burnt.createFilter(
-            fromBlock=from_block,
-            toBlock=to_block).get_all_entries()
-    elif type_event == Event.AirDropped:
-        return contract.events.AirDropped.createFilter(
-            fromBlock=from_block,
-            toBlock=to_block).get_all_entries()
+
+    if planner is not None:
+        return planner.get_events(
+            f"{name_token}.{type_event.name}", from_block, to_block,
+            lambda window_from, window_to: _get_event_in_window(
+                type_event, contract, window_from, window_to, argument_filters, bloom_index))
+
+    return _get_event_in_window(type_event, contract, from_block, to_block, argument_filters, bloom_index)
+
+
+def _get_event_in_window(type_event: Event, contract: Contract, from_block: int, to_block: int,
+                         argument_filters: dict = None, bloom_index: BloomIndex = None) -> List[LogReceipt]:
+    ranges = [(from_block, to_block)]
+    if bloom_index is not None:
+        event_info = get_event_index(contract)[type_event.name]
+        ranges = bloom_index.get_candidate_ranges(
+            from_block, to_block, [contract.address],
+            construct_event_topic_set(event_info.abi, contract.web3.codec, argument_filters))
+
+    res = []
+    for range_from, range_to in ranges:
+        logging.info(f"{type_event.name} event filter in execution (fromBlock={range_from}, toBlock={range_to},"
+                     f"argument_filters={argument_filters}).")
+        res += contract.events[type_event.name].get_logs(
+            argument_filters=argument_filters,
+            fromBlock=range_from,
+            toBlock=range_to)
+
+    return res
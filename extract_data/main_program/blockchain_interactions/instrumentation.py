@@ -0,0 +1,233 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict
+
+METRICS_FORMATS = ("json", "prometheus")
+DEFAULT_METRICS_FORMAT = "json"
+DEFAULT_PROFILE_INTERVAL_MS = 10
+# Upper bounds (seconds) of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_PREFIX = "extract_data"
+
+
+class MethodStats:
+    """
+        Description: Stats of the HTTP requests sent to the nodes for a JSON-RPC method
+    """
+
+    __slots__ = ("requests", "http_requests", "errors", "latency_sum", "latency_buckets", "bytes_sent",
+                 "bytes_received")
+
+    def __init__(self):
+        self.requests = 0
+        self.http_requests = 0
+        self.errors = 0
+        self.latency_sum = 0.0
+        # Requests by bucket of LATENCY_BUCKETS, the last one is +Inf
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+
+class RpcMetrics:
+    """
+        Description: Metrics of a run: requests, errors, latency histogram and bytes transferred by JSON-RPC method,
+            and the time spent in every phase of the program. They can be exported as JSON or in the Prometheus
+            text format.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.methods: Dict[str, MethodStats] = {}
+        self.phases: Dict[str, float] = {}
+
+    def record_request(self, method: str, num_requests: int, latency: float, bytes_sent: int, bytes_received: int,
+                       success: bool):
+        """
+            Description: Records an HTTP request sent to a node
+            Args:
+                method (str): JSON-RPC method (or "batch" for a batch of different methods)
+                num_requests (int): Number of JSON-RPC requests sent in the HTTP request (more than 1 in batches)
+                latency (float): Seconds until the response (or the failure)
+                bytes_sent (int): Size of the request's body
+                bytes_received (int): Size of the response's body
+                success (bool): If the node answered
+        """
+        bucket = next((num_bucket for num_bucket, upper_bound in enumerate(LATENCY_BUCKETS)
+                       if latency <= upper_bound), len(LATENCY_BUCKETS))
+        with self.lock:
+            stats = self.methods.setdefault(method, MethodStats())
+            stats.requests += num_requests
+            stats.http_requests += 1
+            stats.errors += not success
+            stats.latency_sum += latency
+            stats.latency_buckets[bucket] += 1
+            stats.bytes_sent += bytes_sent
+            stats.bytes_received += bytes_received
+
+    @contextmanager
+    def phase(self, name: str, log: bool = True):
+        """
+            Description: Measures the time spent in a phase of the program (it's added if the phase is repeated)
+            Args:
+                name (str): Phase's name
+                log (bool): If the time is written in the logs, disabled for phases which are repeated many times
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+            if log:
+                logging.info(f"Phase {name} finished in {round(elapsed, 3)}s.")
+
+    def to_json(self) -> dict:
+        """
+            Description: Gets a summary of the metrics
+            Args: None
+
+            Returns: Stats by method (latency histogram by bucket's upper bound) and seconds by phase
+        """
+        with self.lock:
+            return {
+                "methods": {method: {
+                    "requests": stats.requests,
+                    "http_requests": stats.http_requests,
+                    "errors": stats.errors,
+                    "latency_avg": round(stats.latency_sum / stats.http_requests, 6),
+                    "latency_histogram": dict(zip([str(upper_bound) for upper_bound in LATENCY_BUCKETS] + ["+Inf"],
+                                                  stats.latency_buckets)),
+                    "bytes_sent": stats.bytes_sent,
+                    "bytes_received": stats.bytes_received
+                } for method, stats in sorted(self.methods.items())},
+                "phases": {name: round(seconds, 6) for name, seconds in self.phases.items()}
+            }
+
+    def to_prometheus(self) -> str:
+        """
+            Description: Gets the metrics in the Prometheus text format
+            Args: None
+
+            Returns: The metrics, with cumulative buckets in the latency histograms
+        """
+        lines = []
+        with self.lock:
+            methods = sorted(self.methods.items())
+            for name, attribute, help_text in (
+                    ("rpc_requests_total", "requests", "JSON-RPC requests sent to the nodes"),
+                    ("rpc_http_requests_total", "http_requests", "HTTP requests sent to the nodes"),
+                    ("rpc_errors_total", "errors", "HTTP requests which failed"),
+                    ("rpc_sent_bytes_total", "bytes_sent", "Bytes sent to the nodes"),
+                    ("rpc_received_bytes_total", "bytes_received", "Bytes received from the nodes")):
+                lines += [f"# HELP {METRICS_PREFIX}_{name} {help_text}.", f"# TYPE {METRICS_PREFIX}_{name} counter"]
+                lines += [f'{METRICS_PREFIX}_{name}{{method="{method}"}} {getattr(stats, attribute)}'
+                          for method, stats in methods]
+
+            name = f"{METRICS_PREFIX}_rpc_latency_seconds"
+            lines += [f"# HELP {name} Latency of the HTTP requests sent to the nodes.", f"# TYPE {name} histogram"]
+            for method, stats in methods:
+                cumulative = 0
+                for upper_bound, count in zip(LATENCY_BUCKETS + ("+Inf",), stats.latency_buckets):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{method="{method}",le="{upper_bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{method="{method}"}} {stats.latency_sum}')
+                lines.append(f'{name}_count{{method="{method}"}} {stats.http_requests}')
+
+            name = f"{METRICS_PREFIX}_phase_seconds"
+            lines += [f"# HELP {name} Time spent in every phase of the program.", f"# TYPE {name} gauge"]
+            lines += [f'{name}{{phase="{phase}"}} {seconds}' for phase, seconds in self.phases.items()]
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str, metrics_format: str = DEFAULT_METRICS_FORMAT):
+        """
+            Description: Writes the metrics in a file
+            Args:
+                path (str): Path of the file
+                metrics_format (str): json or prometheus (see METRICS_FORMATS)
+        """
+        if metrics_format not in METRICS_FORMATS:
+            raise ValueError(f"Unknown metrics_format {metrics_format}, it must be one of {METRICS_FORMATS}")
+
+        with open(path, "w") as outfile:
+            if metrics_format == "json":
+                json.dump(self.to_json(), outfile, indent=4)
+            else:
+                outfile.write(self.to_prometheus())
+        logging.info(f"Metrics written in {path}.")
+
+    def log_stats(self):
+        """
+            Description: Writes in the logs the requests, errors and average latency of every method
+        """
+        for method, stats in self.to_json()["methods"].items():
+            logging.info(f"Method {method}: {stats['requests']} requests in {stats['http_requests']} http requests, "
+                         f"{stats['errors']} errors, average latency {stats['latency_avg']}s, "
+                         f"{stats['bytes_received']} bytes received.")
+
+
+class SamplingProfiler:
+    """
+        Description: Statistical profiler which samples the stack of every thread periodically. The samples are
+            written as collapsed stacks ("file:function;file:function count"), the input of flame graph tools.
+    """
+
+    def __init__(self, interval_ms: float = DEFAULT_PROFILE_INTERVAL_MS):
+        """
+            Args:
+                interval_ms (float): Milliseconds between samples
+        """
+        self.interval = interval_ms / 1000
+        self.samples = Counter()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        logging.info(f"Sampling profiler started (every {self.interval * 1000}ms).")
+        self.thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def write(self, path: str):
+        """
+            Description: Writes the collapsed stacks, the most sampled first
+            Args:
+                path (str): Path of the file
+        """
+        with open(path, "w") as outfile:
+            for stack, count in self.samples.most_common():
+                outfile.write(f"{stack} {count}\n")
+        logging.info(f"Profile with {sum(self.samples.values())} samples written in {path}.")
+
+    def _run(self):
+        own_thread = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_thread:
+                    self.samples[get_stack(frame)] += 1
+
+
+def get_stack(frame) -> str:
+    """
+        Description: Gets the collapsed stack of a frame
+        Args:
+            frame: Innermost frame of the stack
+
+        Returns: file:function of every frame from the outermost, separated by ;
+    """
+    stack = []
+    while frame is not None:
+        stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
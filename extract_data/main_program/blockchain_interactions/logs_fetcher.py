@@ -0,0 +1,394 @@
+import hashlib
+import itertools
+import json
+import logging
+from typing import Callable, Dict, FrozenSet, List, Tuple
+
+from hexbytes import HexBytes
+from web3 import Web3
+from web3._utils.events import construct_event_topic_set
+from web3.contract import Contract
+from web3.types import EventData
+
+from extract_data.main_program.blockchain_interactions.block_blooms import BloomIndex
+from extract_data.main_program.blockchain_interactions.block_range_planner import BlockRangePlanner
+from extract_data.main_program.blockchain_interactions.contract_registry import get_amount_input, get_event_index
+from extract_data.main_program.blockchain_interactions.events_contract import Event
+from extract_data.main_program.blockchain_interactions.raw_log_decoder import Columns, RawLogDecoder
+
+# Decoders built by decode_shard in this process by spec's key
+_shard_decoders: Dict[str, RawLogDecoder] = {}
+
+
+class LogsFetcher:
+    """
+        Description: Gets the events of several contracts with a single stateless eth_getLogs per window.
+            Every log is routed back to its token and event using its address and its first topic.
+    """
+
+    def __init__(self, w3: Web3, contracts: Dict[str, Contract], type_events: List[Event],
+                 argument_filters: dict = None, name: str = "logs",
+                 make_request: Callable[[str, list], object] = None, bloom_index: BloomIndex = None):
+        """
+            Args:
+                w3 (Web3): Web3 object connected to the node
+                contracts (Dict[str, Contract]): Contracts for being analyzed by token's name
+                type_events (List[Event]): Events which will be searched in every contract
+                argument_filters (dict): Filters for being applied in the search (indexed arguments)
+                name (str): Name of the fetcher, used in the logs and by the planner
+                make_request (Callable): Function which sends a JSON-RPC request and returns its raw result, used by
+                    get_event_columns. By default, the request is sent directly to the provider of w3
+                bloom_index (BloomIndex): If it's defined, the logs are only queried in the blocks whose logsBloom
+                    may contain the contracts and the topics of the fetcher
+        """
+        self.w3 = w3
+        self.name = name
+        self.argument_filters = argument_filters or {}
+        # Normalized once, so matching a decoded event is a set lookup per filtered argument
+        self.argument_options = get_argument_options(self.argument_filters)
+        self.make_request = make_request or self._make_provider_request
+        self.bloom_index = bloom_index
+        self.routes: Dict[Tuple[str, HexBytes], Tuple[str, Event]] = {}
+        self.contract_events = {}
+        event_abis = {}
+        amount_arguments = {}
+        topics_by_event = []
+
+        for name_token, contract in contracts.items():
+            for type_event in type_events:
+                event_info = get_event_index(contract).get(type_event.name)
+                if event_info is None:
+                    logging.info(f"The event {type_event.name} is not in contract ({name_token})")
+                    continue
+
+                event_abi = event_info.abi
+                arguments = {key: value for key, value in self.argument_filters.items()
+                             if key in [event_input["name"] for event_input in event_abi["inputs"]]}
+                if len(arguments) < len(self.argument_filters):
+                    logging.info(f"The event {type_event.name} of {name_token} doesn't have the arguments "
+                                 f"{list(self.argument_filters)}")
+                    continue
+
+                route = (contract.address.lower(), event_info.topic)
+                self.routes[route] = (name_token, type_event)
+                self.contract_events[route] = event_info.decoder
+                event_abis[(route[0], route[1].hex())] = event_abi
+                amount_arguments[(name_token, type_event)] = get_amount_input(event_abi)
+                topics_by_event.append(construct_event_topic_set(event_abi, w3.codec, arguments))
+
+        self.names_by_address = {address: name_token for (address, _), (name_token, _) in self.routes.items()}
+        self.addresses = sorted({Web3.toChecksumAddress(address) for address, _ in self.routes})
+        self.topics = merge_topics(topics_by_event)
+        self.decoder = RawLogDecoder(
+            event_abis, {(address, topic.hex()): event for (address, topic), event in self.contract_events.items()},
+            self.argument_filters, self._match_argument_filters)
+        spec_definition = [sorted([list(route), event_abi] for route, event_abi in event_abis.items()),
+                           self.argument_filters]
+        self.shard_spec = {
+            "key": hashlib.sha256(json.dumps(spec_definition, sort_keys=True, default=str).encode()).hexdigest(),
+            "event_abis": event_abis,
+            "routes": {(address, topic.hex()): route for (address, topic), route in self.routes.items()},
+            "argument_filters": self.argument_filters,
+            "argument_options": self.argument_options,
+            "amount_arguments": amount_arguments
+        }
+
+    def get_events(self, from_block: int, to_block: int) -> List[EventData]:
+        """
+            Description: Gets the events of every contract in the specified blocks' interval
+            Args:
+                from_block (int): Initial block for being analyzed
+                to_block (int): Final block for being analyzed
+
+            Returns: Decoded events of every contract, sorted by block number and log index
+        """
+        if not self.routes:
+            return []
+
+        res = []
+        for range_from, range_to in self._get_ranges(from_block, to_block):
+            logging.info(f"{self.name} logs in execution (fromBlock={range_from}, toBlock={range_to}, "
+                         f"contracts={len(self.addresses)}, argument_filters={self.argument_filters}).")
+            res += self._decode_logs(self.w3.eth.get_logs({
+                "fromBlock": range_from,
+                "toBlock": range_to,
+                "address": self.addresses,
+                "topics": self.topics
+            }))
+
+        return res
+
+    def get_event_columns(self, from_block: int, to_block: int) -> Dict[Tuple[str, Event], Columns]:
+        """
+            Description: Gets the events of every contract in the specified blocks' interval, decoding the raw logs
+                in columns (see RawLogDecoder) instead of building a decoded event per log
+            Args:
+                from_block (int): Initial block for being analyzed
+                to_block (int): Final block for being analyzed
+
+            Returns: Columns by (token's name, event type), only for the routes with any event
+        """
+        if not self.routes:
+            return {}
+
+        return {self.routes[(address, HexBytes(topic))]: columns
+                for (address, topic), columns in self.decoder.decode(self.get_raw_logs(from_block, to_block)).items()}
+
+    def get_raw_logs(self, from_block: int, to_block: int) -> List[dict]:
+        """
+            Description: Gets the logs of every contract in the specified blocks' interval without decoding them
+            Args:
+                from_block (int): Initial block for being analyzed
+                to_block (int): Final block for being analyzed
+
+            Returns: Logs as returned by eth_getLogs, which can be decoded in another process with decode_shard
+        """
+        if not self.routes:
+            return []
+
+        res = []
+        for range_from, range_to in self._get_ranges(from_block, to_block):
+            logging.info(f"{self.name} raw logs in execution (fromBlock={range_from}, toBlock={range_to}, "
+                         f"contracts={len(self.addresses)}, argument_filters={self.argument_filters}).")
+            res += self.make_request("eth_getLogs", [{
+                "fromBlock": hex(range_from),
+                "toBlock": hex(range_to),
+                "address": self.addresses,
+                "topics": self.topics
+            }])
+
+        return res
+
+    def get_shard_spec(self) -> dict:
+        """
+            Description: Gets what another process needs for decoding the raw logs of the fetcher (see decode_shard)
+            Args: None
+
+            Returns: Key, abi of the event by route, route's name by route, argument filters and amount's argument
+                by route's name (picklable)
+        """
+        return self.shard_spec
+
+    def get_amount_argument(self, route: Tuple[str, Event]) -> str:
+        """
+            Description: Gets the argument with the amount of the events of a route (see get_amount_argument)
+            Args:
+                route (Tuple[str, Event]): (Token's name, event type)
+
+            Returns: The argument's name
+        """
+        return get_amount_argument(self.shard_spec, route)
+
+    def get_events_with_planner(self, from_block: int, to_block: int, planner: BlockRangePlanner) \
+            -> List[EventData]:
+        """
+            Description: Gets the events of every contract splitting the interval in adaptive windows
+            Args:
+                from_block (int): Initial block for being analyzed
+                to_block (int): Final block for being analyzed
+                planner (BlockRangePlanner): Planner for splitting the interval in adaptive windows
+
+            Returns: Decoded events of every contract, sorted by block number and log index
+        """
+        return planner.get_events(self.name, from_block, to_block, self.get_events)
+
+    def get_store_keys(self) -> List[Tuple[str, str, str]]:
+        """
+            Description: Gets the keys used by the EventStore for the events of the fetcher
+            Args: None
+
+            Returns: List of (scope, contract's address, event's name). The scope depends on the argument filters,
+                there's a scope for every combination of the values of the filters.
+        """
+        names = sorted(self.argument_filters)
+        options = [self.argument_filters[name] if isinstance(self.argument_filters[name], (list, tuple, set))
+                   else [self.argument_filters[name]] for name in names]
+        scopes = [get_scope(dict(zip(names, values))) for values in itertools.product(*options)]
+        return [(scope, address, type_event.name) for scope in scopes
+                for (address, _), (_, type_event) in self.routes.items()]
+
+    def get_event_scope(self, event: EventData) -> str:
+        """
+            Description: Gets the scope of the EventStore where a decoded event is stored
+            Args:
+                event (EventData): Event returned by get_events
+
+            Returns: The scope, built with the values of the filtered arguments of the event
+        """
+        return get_scope({name: event["args"][name] for name in self.argument_filters})
+
+    def get_route(self, event: EventData) -> Tuple[str, Event]:
+        """
+            Description: Gets the token and the event type of a decoded event
+            Args:
+                event (EventData): Event returned by get_events
+
+            Returns: (Token's name, event type)
+        """
+        return self.names_by_address[event["address"].lower()], Event[event["event"]]
+
+    def get_routes(self) -> List[Tuple[str, Event]]:
+        """
+            Description: Gets every route of the fetcher, used for indexing them in EventColumns
+            Args: None
+
+            Returns: List of (token's name, event type)
+        """
+        return list(self.routes.values())
+
+    def group_events(self, events: List[EventData]) -> Dict[Tuple[str, Event], List[EventData]]:
+        """
+            Description: Groups decoded events by token and event type, keeping their order
+            Args:
+                events (List[EventData]): Events returned by get_events
+
+            Returns: Events by (token's name, event type). Every route of the fetcher has an entry.
+        """
+        res = {route: [] for route in self.routes.values()}
+        for event in events:
+            res[self.get_route(event)].append(event)
+
+        return res
+
+    def _decode_logs(self, logs: List[dict]) -> List[EventData]:
+        res = []
+        for log in logs:
+            route = (log["address"].lower(), HexBytes(log["topics"][0]))
+            if route not in self.routes:
+                continue
+            event = self.contract_events[route].processLog(log)
+            if self._match_argument_filters(event):
+                res.append(event)
+
+        return res
+
+    def _get_ranges(self, from_block: int, to_block: int) -> List[Tuple[int, int]]:
+        if self.bloom_index is None:
+            return [(from_block, to_block)]
+        return self.bloom_index.get_candidate_ranges(from_block, to_block, self.addresses, self.topics)
+
+    def _make_provider_request(self, method: str, params: list):
+        response = self.w3.provider.make_request(method, params)
+        if "error" in response:
+            raise ValueError(response["error"])
+        return response["result"]
+
+    def _match_argument_filters(self, event: EventData) -> bool:
+        return match_argument_filters(event, self.argument_options)
+
+
+def decode_shard(spec: dict, raw_logs: List[dict]) -> Dict[Tuple[str, Event], Columns]:
+    """
+        Description: Decodes raw logs in columns in any process, without the web3 object of the fetcher. The decoder
+            of every spec is built once per process
+        Args:
+            spec (dict): Spec returned by LogsFetcher.get_shard_spec
+            raw_logs (List[dict]): Logs returned by LogsFetcher.get_raw_logs
+
+        Returns: Columns by (token's name, event type), only for the routes with any event
+    """
+    decoder = _shard_decoders.get(spec["key"])
+    if decoder is None:
+        w3 = Web3()
+        contract_events = {route: w3.eth.contract(Web3.toChecksumAddress(route[0]), abi=[event_abi]).events[
+            event_abi["name"]]() for route, event_abi in spec["event_abis"].items()}
+        decoder = RawLogDecoder(spec["event_abis"], contract_events, spec["argument_filters"],
+                                lambda event: match_argument_filters(event, spec["argument_options"]))
+        _shard_decoders[spec["key"]] = decoder
+
+    return {spec["routes"][route]: columns for route, columns in decoder.decode(raw_logs).items()}
+
+
+def get_amount_argument(spec: dict, route: Tuple[str, Event]) -> str:
+    """
+        Description: Gets the argument with the amount of the events of a route, which is named differently by some
+            tokens (value, amount, wad...)
+        Args:
+            spec (dict): Spec returned by LogsFetcher.get_shard_spec
+            route (Tuple[str, Event]): (Token's name, event type)
+
+        Returns: The argument's name, a ValueError is raised if the event doesn't have a single non-indexed uint256
+    """
+    amount_argument = spec["amount_arguments"].get(route)
+    if amount_argument is None:
+        raise ValueError(f"The event {route[1].name} of {route[0]} doesn't have a single non-indexed uint256 "
+                         f"argument with the amount")
+    return amount_argument
+
+
+def match_argument_filters(event: EventData, argument_options: Dict[str, FrozenSet]) -> bool:
+    """
+        Description: Checks if a decoded event matches the argument filters
+        Args:
+            event (EventData): Decoded event
+            argument_options (Dict[str, FrozenSet]): Normalized values by argument's name (see get_argument_options)
+
+        Returns: If every filtered argument has one of its values
+    """
+    for key, options in argument_options.items():
+        if normalize_argument(event["args"][key]) not in options:
+            return False
+
+    return True
+
+
+def get_argument_options(argument_filters: dict) -> Dict[str, FrozenSet]:
+    """
+        Description: Normalizes the values of the argument filters for matching decoded events
+        Args:
+            argument_filters (dict): A value or a list of values by argument's name
+
+        Returns: The set of normalized values by argument's name
+    """
+    return {key: frozenset(normalize_argument(option)
+                           for option in (value if isinstance(value, (list, tuple, set)) else [value]))
+            for key, value in argument_filters.items()}
+
+
+def merge_topics(topics_by_event: List[List]) -> List:
+    """
+        Description: Merges the topics' filters of several events in a single filter (OR in every position)
+        Args:
+            topics_by_event (List[List]): Topics' filter of every event
+
+        Returns: A topics' filter which matches every event
+    """
+    if not topics_by_event:
+        return []
+
+    merged = []
+    for position in range(max(len(topics) for topics in topics_by_event)):
+        options = set()
+        for topics in topics_by_event:
+            if position >= len(topics) or topics[position] is None:
+                options = None
+                break
+            options.update(topics[position] if isinstance(topics[position], list) else [topics[position]])
+        merged.append(sorted(options) if options is not None else None)
+
+    while merged and merged[-1] is None:
+        merged.pop()
+
+    return merged
+
+
+def get_scope(argument_filters: dict) -> str:
+    """
+        Description: Gets the scope of the EventStore for a set of argument filters with single values
+        Args:
+            argument_filters (dict): Value of every filtered argument
+
+        Returns: The scope ("" when there isn't any filter)
+    """
+    return ",".join(f"{name}={normalize_argument(value)}" for name, value in sorted(argument_filters.items()))
+
+
+def normalize_argument(value):
+    """
+        Description: Normalizes an event argument for being compared (addresses are case insensitive)
+        Args:
+            value: Argument's value
+
+        Returns: The normalized value
+    """
+    return value.lower() if isinstance(value, str) else value
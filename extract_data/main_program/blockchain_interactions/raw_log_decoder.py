@@ -0,0 +1,231 @@
+import re
+from array import array
+from typing import Callable, Dict, List, Tuple
+
+from eth_abi import encode_single
+from web3._utils.method_formatters import log_entry_formatter
+
+# Hex characters of an ABI word (32 bytes)
+WORD_SIZE = 64
+# Widest integer which is stored in a typed array instead of a list of Python ints
+MAX_TYPED_INT_BITS = 64
+ADDRESS_SIZE = 20
+HASH_SIZE = 32
+
+# Decoded columns of a route: block number, log index, transaction hash and every event argument
+Columns = Dict[str, object]
+
+
+class RawLogDecoder:
+    """
+        Description: Decodes raw eth_getLogs results (hex strings, as returned by the node) in columns, without
+            building an AttributeDict per log. Events whose arguments are all static types (address, bool, intN,
+            uintN, bytesN) are decoded by slicing the topics and the data, the rest of the events fall back to
+            web3's decoding.
+            Columns are typed arrays for numbers, bytes with the values concatenated for addresses, hashes and
+            bytesN (see get_hex_value) and lists for wider integers or the values decoded by web3.
+    """
+
+    def __init__(self, event_abis: Dict[Tuple[str, str], dict], contract_events: Dict[Tuple[str, str], object],
+                 argument_filters: dict = None, match_event: Callable[[dict], bool] = None):
+        """
+            Args:
+                event_abis (Dict): Abi of the event by route (contract's address lowercase, topic0 in hex)
+                contract_events (Dict): Web3 ContractEvent by route, used for the events which can't be sliced
+                argument_filters (dict): Filters which every decoded event must match (a value or a list of values)
+                match_event (Callable): Function which applies the argument filters to an event decoded by web3
+        """
+        self.event_abis = event_abis
+        self.contract_events = contract_events
+        self.match_event = match_event or (lambda event: True)
+        self.argument_filters = {name: value if isinstance(value, (list, tuple, set)) else [value]
+                                 for name, value in (argument_filters or {}).items()}
+        self.layouts = {route: get_static_layout(event_abi) for route, event_abi in event_abis.items()}
+
+    def decode(self, raw_logs: List[dict]) -> Dict[Tuple[str, str], Columns]:
+        """
+            Description: Decodes raw logs grouping them by route
+            Args:
+                raw_logs (List[dict]): Logs returned by eth_getLogs without any formatting
+
+            Returns: Columns by route (contract's address lowercase, topic0 in hex). Logs of unknown routes, removed
+                logs and logs which don't match the argument filters are discarded. The order of the logs is kept.
+        """
+        logs_by_route = {}
+        for log in raw_logs:
+            if log.get("removed") or not log["topics"]:
+                continue
+            route = (log["address"].lower(), log["topics"][0].lower())
+            if route in self.layouts:
+                logs_by_route.setdefault(route, []).append(log)
+
+        res = {}
+        for route, logs in logs_by_route.items():
+            if self.layouts[route] is not None:
+                logs = self._filter_static(logs, self.layouts[route])
+                res[route] = get_common_columns(logs)
+                res[route].update(decode_static_arguments(logs, self.layouts[route]))
+            else:
+                res[route] = self._decode_with_web3(route, logs)
+
+        return res
+
+    def _filter_static(self, logs: List[dict], layout: List[Tuple[str, str, bool, int]]) -> List[dict]:
+        for name, abi_type, indexed, position in layout:
+            if name not in self.argument_filters:
+                continue
+            words = {encode_single(abi_type, value).hex() for value in self.argument_filters[name]}
+            logs = [log for log in logs if get_word(log, indexed, position).lower() in words]
+
+        return logs
+
+    def _decode_with_web3(self, route: Tuple[str, str], logs: List[dict]) -> Columns:
+        events = [self.contract_events[route].processLog(log_entry_formatter(log)) for log in logs]
+        events = [event for event in events if self.match_event(event)]
+
+        res = {
+            "blockNumber": array('Q', [event["blockNumber"] for event in events]),
+            "logIndex": array('L', [event["logIndex"] for event in events]),
+            "transactionHash": b"".join([bytes(event["transactionHash"]) for event in events])
+        }
+        for event_input in self.event_abis[route]["inputs"]:
+            res[event_input["name"]] = [event["args"][event_input["name"]] for event in events]
+
+        return res
+
+
+def get_static_layout(event_abi: dict) -> List[Tuple[str, str, bool, int]]:
+    """
+        Description: Gets the position of every argument of an event in the topics or in the data
+        Args:
+            event_abi (dict): Abi of the event
+
+        Returns: (name, type, indexed, position) of every argument, position being the topic's index for the
+            indexed arguments and the word's index in the data for the rest. None if any argument isn't static.
+    """
+    layout = []
+    num_topic, num_word = 1, 0
+    for event_input in event_abi["inputs"]:
+        if not is_static_type(event_input["type"]):
+            return None
+        if event_input.get("indexed"):
+            layout.append((event_input["name"], event_input["type"], True, num_topic))
+            num_topic += 1
+        else:
+            layout.append((event_input["name"], event_input["type"], False, num_word))
+            num_word += 1
+
+    return layout
+
+
+def is_static_type(abi_type: str) -> bool:
+    """
+        Description: Checks if an ABI type is encoded in a single word
+        Args:
+            abi_type (str): ABI type
+
+        Returns: If the type can be decoded by slicing its word
+    """
+    return re.fullmatch(r"address|bool|u?int(8|16|24|32|40|48|56|64|72|80|88|96|104|112|120|128|136|144|152|160|168|"
+                        r"176|184|192|200|208|216|224|232|240|248|256)?|bytes([1-9]|[12][0-9]|3[0-2])",
+                        abi_type) is not None
+
+
+def get_common_columns(logs: List[dict]) -> Columns:
+    """
+        Description: Gets the columns shared by every event
+        Args:
+            logs (List[dict]): Raw logs
+
+        Returns: blockNumber and logIndex as typed arrays, transactionHash as 32 bytes per log
+    """
+    return {
+        "blockNumber": array('Q', [int(log["blockNumber"], 16) for log in logs]),
+        "logIndex": array('L', [int(log["logIndex"], 16) for log in logs]),
+        "transactionHash": bytes.fromhex("".join([log["transactionHash"][2:] for log in logs]))
+    }
+
+
+def decode_static_arguments(logs: List[dict], layout: List[Tuple[str, str, bool, int]]) -> Columns:
+    """
+        Description: Decodes the arguments of logs whose event only has static types
+        Args:
+            logs (List[dict]): Raw logs of the same event
+            layout (List): Layout returned by get_static_layout
+
+        Returns: A column by argument's name
+    """
+    return {name: decode_words([get_word(log, indexed, position) for log in logs], abi_type)
+            for name, abi_type, indexed, position in layout}
+
+
+def get_word(log: dict, indexed: bool, position: int) -> str:
+    """
+        Description: Gets the ABI word of an argument of a raw log
+        Args:
+            log (dict): Raw log
+            indexed (bool): If the argument is in the topics or in the data
+            position (int): Topic's index or word's index in the data
+
+        Returns: The word in hex without 0x
+    """
+    if indexed:
+        return log["topics"][position][2:]
+
+    start = 2 + position * WORD_SIZE
+    return log["data"][start:start + WORD_SIZE]
+
+
+def decode_words(words: List[str], abi_type: str):
+    """
+        Description: Decodes ABI words (hex without 0x) of a static type
+        Args:
+            words (List[str]): Words for being decoded
+            abi_type (str): ABI type of every word
+
+        Returns: The column of the values (see RawLogDecoder)
+    """
+    if abi_type == "address":
+        return bytes.fromhex("".join([word[24:] for word in words]))
+    if abi_type == "bool":
+        return array('B', [int(word, 16) != 0 for word in words])
+    if abi_type.startswith("bytes"):
+        width = int(abi_type[5:]) * 2
+        return bytes.fromhex("".join([word[:width] for word in words]))
+
+    bits = int(abi_type.lstrip("uint") or 256)
+    values = [int(word, 16) for word in words]
+    if abi_type.startswith("int"):
+        values = [value - 2 ** 256 if value >= 2 ** 255 else value for value in values]
+    if bits <= MAX_TYPED_INT_BITS:
+        return array('q' if abi_type.startswith("int") else 'Q', values)
+
+    return values
+
+
+def get_hex_value(column: bytes, width: int, index: int) -> str:
+    """
+        Description: Gets a value of a column of concatenated bytes (addresses, hashes, bytesN)
+        Args:
+            column (bytes): Column returned by RawLogDecoder
+            width (int): Bytes of every value (20 for addresses, 32 for hashes)
+            index (int): Position of the value in the column
+
+        Returns: The value in hex with 0x prefix (lowercase)
+    """
+    return "0x" + column[index * width:(index + 1) * width].hex()
+
+
+def get_hex_values(column, width: int) -> List[str]:
+    """
+        Description: Gets every value of an address, hash or bytesN column, whether it was sliced or decoded by web3
+        Args:
+            column: Column returned by RawLogDecoder (concatenated bytes or a list of values)
+            width (int): Bytes of every value (ADDRESS_SIZE, HASH_SIZE)
+
+        Returns: The values in hex with 0x prefix (lowercase)
+    """
+    if isinstance(column, list):
+        return [value.lower() if isinstance(value, str) else "0x" + bytes(value).hex() for value in column]
+
+    return [get_hex_value(column, width, index) for index in range(len(column) // width)]
@@ -0,0 +1,269 @@
+import hashlib
+import json
+import logging
+import math
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Callable, Optional
+
+# off: nothing is cached. cache: responses of finalized blocks are stored and reused.
+# record: like cache, but every response is stored, so the run can be replayed.
+# replay: every response is served from the cache, without any request to the nodes.
+RPC_CACHE_MODES = ("off", "cache", "record", "replay")
+# Modes whose runs must send the same requests: the latest block is pinned once per run, and the scans use
+# sequential windows of fixed size (see BlockRangePlanner.from_config)
+REPRODUCIBLE_MODES = ("record", "replay")
+DEFAULT_RPC_CACHE_MODE = "off"
+DEFAULT_RPC_CACHE_MAX_MB = 1024
+# Part of the maximum size which is kept when the oldest responses are evicted
+EVICTION_TARGET = 0.9
+LATEST_BLOCK_REFRESH_SECONDS = 12
+
+# Methods whose first response is reused for the whole run in REPRODUCIBLE_MODES
+METHODS_PINNED = ("eth_blockNumber",)
+# Methods whose response only depends on the block of their last parameter
+METHODS_BY_BLOCK = ("eth_call", "eth_getBalance", "eth_getCode", "eth_getStorageAt", "eth_getTransactionCount")
+METHODS_ALWAYS_FINALIZED = ("eth_chainId", "net_version")
+
+
+class RpcCache:
+    """
+        Description: Content-addressed cache of JSON-RPC responses in a SQLite file. Responses are keyed by the hash
+            of the method and its canonical params. Only the responses of finalized blocks are reused (latest
+            balances, the latest block... are always requested), except in replay mode, which serves a recorded run
+            without any node. In record and replay modes, the latest block is pinned when it's first requested and
+            error responses are recorded too, so a replay sends the same requests as the recorded run. When the file
+            exceeds its maximum size, the oldest responses are evicted, except in record mode, which raises a
+            ValueError instead, since a replay needs every recorded response.
+    """
+
+    def __init__(self, db_path: str, mode: str, get_latest_block: Callable[[], int], confirmation_blocks: int,
+                 max_bytes: int = DEFAULT_RPC_CACHE_MAX_MB * 1024 * 1024):
+        """
+            Args:
+                db_path (str): SQLite file where the responses are persisted
+                mode (str): cache, record or replay (see RPC_CACHE_MODES)
+                get_latest_block (Callable): Function which gets the latest block from the node
+                confirmation_blocks (int): Blocks below the latest block which are considered final
+                max_bytes (int): Maximum size of the stored responses
+        """
+        if mode not in RPC_CACHE_MODES:
+            raise ValueError(f"Unknown rpc_cache_mode {mode}, it must be one of {RPC_CACHE_MODES}")
+
+        logging.info(f"RPC responses cached in {db_path} (mode {mode}).")
+        self.mode = mode
+        self.get_latest_block = get_latest_block
+        self.confirmation_blocks = confirmation_blocks
+        self.max_bytes = max_bytes
+        self.latest_block = None
+        self.latest_block_time = 0.0
+        self.pinned_responses = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS rpc_responses "
+                                    "(key TEXT PRIMARY KEY, method TEXT NOT NULL, finalized INTEGER NOT NULL, "
+                                    "response BLOB NOT NULL, size INTEGER NOT NULL, created REAL NOT NULL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS rpc_responses_created ON rpc_responses (created)")
+            self.total_size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM rpc_responses").fetchone()[0]
+
+    def middleware(self, make_request, w3):
+        """
+            Description: Web3 middleware which serves the cached responses. It must be the innermost middleware,
+                so the params are already formatted and the responses aren't formatted yet
+        """
+        def cached_request(method, params):
+            return self.request(method, params, make_request)
+
+        return cached_request
+
+    def request(self, method: str, params, make_request: Callable) -> dict:
+        """
+            Description: Gets the response of a request from the cache, or from the node when it isn't cached
+            Args:
+                method (str): JSON-RPC method
+                params: Parameters of the method
+                make_request (Callable): Function which sends the request to the node
+
+            Returns: The JSON-RPC response
+        """
+        response = self.get(method, params)
+        if response is None:
+            response = make_request(method, params)
+            self.put(method, params, response)
+
+        return response
+
+    def get(self, method: str, params) -> Optional[dict]:
+        """
+            Description: Gets a cached response
+            Args:
+                method (str): JSON-RPC method
+                params: Parameters of the method
+
+            Returns: The JSON-RPC response, or None if it can't be served from the cache. In replay mode, a response
+                which isn't cached raises a ValueError
+        """
+        with self.lock:
+            if method in self.pinned_responses:
+                self.hits += 1
+                return self.pinned_responses[method]
+
+            row = self.connection.execute("SELECT finalized, response FROM rpc_responses WHERE key = ?",
+                                          (get_key(method, params),)).fetchone()
+            served = row is not None and (row[0] or self.mode == "replay")
+            self.hits += served
+            self.misses += not served
+
+        if served:
+            response = json.loads(zlib.decompress(row[1]))
+            if self.mode in REPRODUCIBLE_MODES and method in METHODS_PINNED:
+                with self.lock:
+                    response = self.pinned_responses.setdefault(method, response)
+            return response
+        if self.mode == "replay":
+            raise ValueError(f"The response of {method} {params} wasn't recorded")
+        return None
+
+    def put(self, method: str, params, response: dict):
+        """
+            Description: Stores a response if the mode allows it. Errors are only stored in record mode, and they
+                are only served in replay mode
+            Args:
+                method (str): JSON-RPC method
+                params: Parameters of the method
+                response (dict): JSON-RPC response
+        """
+        if self.mode == "replay" or ("error" in response and self.mode != "record"):
+            return
+
+        if self.mode in REPRODUCIBLE_MODES and method in METHODS_PINNED:
+            with self.lock:
+                self.pinned_responses.setdefault(method, response)
+        finalized = "error" not in response and self.is_finalized(method, params)
+        if not finalized and self.mode != "record":
+            return
+
+        data = zlib.compress(json.dumps(response, separators=(",", ":")).encode())
+        key = get_key(method, params)
+        with self.lock, self.connection:
+            previous = self.connection.execute("SELECT size FROM rpc_responses WHERE key = ?", (key,)).fetchone()
+            total_size = self.total_size + len(data) - (previous[0] if previous else 0)
+            if self.mode == "record" and total_size > self.max_bytes:
+                raise ValueError(f"The recorded responses exceed {self.max_bytes} bytes, rpc_cache_max_mb must be "
+                                 f"increased to record this run")
+            self.connection.execute("INSERT OR REPLACE INTO rpc_responses VALUES (?, ?, ?, ?, ?, ?)",
+                                    (key, method, int(finalized), data, len(data), time.time()))
+            self.total_size = total_size
+            if self.total_size > self.max_bytes:
+                self._evict()
+
+    def is_finalized(self, method: str, params) -> bool:
+        """
+            Description: Checks if the response of a request can't change anymore
+            Args:
+                method (str): JSON-RPC method
+                params: Parameters of the method
+
+            Returns: If the request only depends on finalized blocks
+        """
+        if method in METHODS_ALWAYS_FINALIZED:
+            return True
+        if method == "eth_getBlockByNumber":
+            return self._is_block_finalized(params[0])
+        if method in METHODS_BY_BLOCK:
+            return len(params) > 1 and self._is_block_finalized(params[-1])
+        if method == "eth_getLogs":
+            log_filter = params[0]
+            if "blockHash" in log_filter:
+                return True
+            return self._is_block_finalized(log_filter.get("fromBlock", "latest")) and \
+                self._is_block_finalized(log_filter.get("toBlock", "latest"))
+
+        return False
+
+    def log_stats(self):
+        """
+            Description: Writes in the logs the requests served by the cache
+        """
+        logging.info(f"RPC cache: {self.hits} responses served from the cache, {self.misses} requests sent, "
+                     f"{self.total_size} bytes stored.")
+
+    def _is_block_finalized(self, block) -> bool:
+        if isinstance(block, str) and not block.startswith("0x"):
+            return False
+        block_number = int(block, 16) if isinstance(block, str) else block
+        return block_number <= self._get_finalized_block()
+
+    def _get_finalized_block(self) -> int:
+        with self.lock:
+            latest_block = self.latest_block
+            refresh = latest_block is None or (self.mode not in REPRODUCIBLE_MODES and
+                                               time.monotonic() - self.latest_block_time > LATEST_BLOCK_REFRESH_SECONDS)
+        if not refresh:
+            return latest_block - self.confirmation_blocks
+
+        # Requested without the lock, so the other threads keep using the cache during the round trip
+        latest_block = self.get_latest_block()
+        with self.lock:
+            # The first latest block stays pinned in REPRODUCIBLE_MODES, even if another thread fetched one meanwhile
+            if self.latest_block is None or self.mode not in REPRODUCIBLE_MODES:
+                self.latest_block = latest_block
+                self.latest_block_time = time.monotonic()
+            return self.latest_block - self.confirmation_blocks
+
+    def _evict(self):
+        target = self.max_bytes * EVICTION_TARGET
+        rows = self.connection.execute("SELECT COUNT(*) FROM rpc_responses").fetchone()[0]
+        evicted = 0
+        while self.total_size > target and rows:
+            # Enough of the oldest responses to go below the target if they have the average size
+            limit = max(1, math.ceil((self.total_size - target) * rows / self.total_size))
+            size, count = self.connection.execute(
+                "SELECT COALESCE(SUM(size), 0), COUNT(*) FROM "
+                "(SELECT size FROM rpc_responses ORDER BY created LIMIT ?)", (limit,)).fetchone()
+            self.connection.execute("DELETE FROM rpc_responses WHERE key IN "
+                                    "(SELECT key FROM rpc_responses ORDER BY created LIMIT ?)", (limit,))
+            self.total_size -= size
+            rows -= count
+            evicted += count
+        logging.info(f"RPC cache: {evicted} responses evicted.")
+
+
+def get_key(method: str, params) -> str:
+    """
+        Description: Gets the content address of a request
+        Args:
+            method (str): JSON-RPC method
+            params: Parameters of the method
+
+        Returns: sha256 of the method and its canonical params (sorted keys, lowercase hex strings)
+    """
+    canonical = json.dumps([method, canonicalize(params)], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def canonicalize(value):
+    """
+        Description: Converts the params of a request in a canonical form, so equivalent requests get the same key
+        Args:
+            value: Params (or a part of them)
+
+        Returns: The params with lists instead of tuples, lowercase strings and block numbers in hex
+    """
+    if isinstance(value, dict):
+        return {key: canonicalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [canonicalize(item) for item in value]
+    if isinstance(value, str):
+        return value.lower()
+    if isinstance(value, int) and not isinstance(value, bool):
+        return hex(value)
+    if isinstance(value, bytes):
+        return "0x" + value.hex()
+
+    return value
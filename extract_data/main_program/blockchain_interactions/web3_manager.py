@@ -1,37 +1,85 @@
-import json
 import logging
+import os
 import sys
+import threading
+from typing import Dict, List, Optional, Tuple
 
 from hexbytes import HexBytes
-from web3 import Web3, HTTPProvider
+from web3 import Web3
 from web3.contract import Contract
 from datetime import datetime
 
+from extract_data.main_program.blockchain_interactions.block_blooms import DEFAULT_MAX_BLOOM_FETCHED_BLOCKS, BloomIndex
+from extract_data.main_program.blockchain_interactions.block_resolver import BlockTimeResolver
+from extract_data.main_program.blockchain_interactions.block_scheduler import CpuPool
+from extract_data.main_program.blockchain_interactions.block_timestamps import BlockTimestampCache
+from extract_data.main_program.blockchain_interactions.contract_registry import ContractRegistry
+from extract_data.main_program.blockchain_interactions.endpoint_pool import LoadBalancedProvider
+from extract_data.main_program.blockchain_interactions.event_store import EventStore
+from extract_data.main_program.blockchain_interactions.instrumentation import RpcMetrics
+from extract_data.main_program.blockchain_interactions.rpc_cache import DEFAULT_RPC_CACHE_MAX_MB, \
+    DEFAULT_RPC_CACHE_MODE, REPRODUCIBLE_MODES, RpcCache
+
+DEFAULT_RPC_BATCH_SIZE = 100
+DEFAULT_CONFIRMATION_BLOCKS = 64
+
 
 class Web3Manager:
     def __init__(self, app_config: str):
         logging.info("Initializing web3 manager.")
 
-        logging.info(f"Getting endpoint {app_config['ethereum_node']}")
-        self.w3 = Web3(HTTPProvider(app_config["ethereum_node"]))
-        if not self.w3.isConnected():
-            logging.error("Error connecting to endpoint")
-            raise Exception("Error connecting to endpoint")
+        self.metrics = RpcMetrics()
+        self.provider = LoadBalancedProvider.from_config(app_config, self.metrics)
+        logging.info(f"Getting endpoints {[endpoint.uri for endpoint in self.provider.endpoints]}")
+        if app_config.get("max_requests_per_second"):
+            logging.info(f"Requests limited to {app_config['max_requests_per_second']} per second in every node.")
+        self.w3 = Web3(self.provider)
+        self.rpc_batch_size = app_config.get("rpc_batch_size", DEFAULT_RPC_BATCH_SIZE)
+        self.confirmation_blocks = app_config.get("confirmation_blocks", DEFAULT_CONFIRMATION_BLOCKS)
 
-        logging.info("Endpoint read successfully.")
-        logging.info("Reading abi_files")
-        self.abi_files = {}
-        for erc20_token in app_config["erc20_list"]:
-            with open(erc20_token['abi_path'], 'r') as json_file:
-                self.abi_files[erc20_token["name"]] = json.load(json_file)
-        for ctoken in app_config["compound_tokens"]:
-            with open(ctoken['abi_path'], 'r') as json_file:
-                self.abi_files[ctoken["name"]] = json.load(json_file)
+        self.cache_folder = app_config.get("cache_folder")
+        if self.cache_folder:
+            os.makedirs(self.cache_folder, exist_ok=True)
 
-        with open(app_config["airdrop_info"]["airdrop_address_abi"], 'r') as json_file:
-            self.abi_files["airdrop"] = json.load(json_file)
+        self.rpc_cache = None
+        rpc_cache_mode = app_config.get("rpc_cache_mode", DEFAULT_RPC_CACHE_MODE)
+        if rpc_cache_mode != "off":
+            if not self.cache_folder:
+                raise ValueError(f"rpc_cache_mode {rpc_cache_mode} needs a cache_folder")
+            self.rpc_cache = RpcCache(os.path.join(self.cache_folder, "rpc_cache.sqlite"), rpc_cache_mode,
+                                      lambda: int(self.provider.make_request("eth_blockNumber", [])["result"], 16),
+                                      self.confirmation_blocks,
+                                      app_config.get("rpc_cache_max_mb", DEFAULT_RPC_CACHE_MAX_MB) * 1024 * 1024)
+            self.w3.middleware_onion.inject(self.rpc_cache.middleware, name="rpc_cache", layer=0)
 
-        logging.info("Abi files successfully read.")
+        if rpc_cache_mode == "replay":
+            logging.info("Replaying the recorded responses, the nodes aren't used.")
+        elif not self.w3.isConnected():
+            logging.error("Error connecting to endpoint")
+            raise Exception("Error connecting to endpoint")
+        else:
+            logging.info("Endpoint read successfully.")
+        self.block_timestamps = BlockTimestampCache(
+            self._fetch_block_timestamps, self.get_finalized_block_number,
+            os.path.join(self.cache_folder, "block_timestamps.sqlite") if self.cache_folder else None)
+        self.block_resolver = BlockTimeResolver(self.block_timestamps, self.get_latest_block_number)
+        self.bloom_index = None
+        if app_config.get("bloom_filter", False):
+            self.bloom_index = BloomIndex(
+                self._fetch_block_blooms, self.get_finalized_block_number,
+                os.path.join(self.cache_folder, "block_blooms.sqlite") if self.cache_folder else None,
+                max_fetched_blocks=app_config.get("bloom_max_fetched_blocks", DEFAULT_MAX_BLOOM_FETCHED_BLOCKS))
+        # The event store changes the blocks which are fetched from run to run, so it isn't used when a run is
+        # recorded or replayed (the RPC cache already keeps the logs)
+        self.event_store = EventStore(os.path.join(self.cache_folder, "events.sqlite")) \
+            if self.cache_folder and rpc_cache_mode not in REPRODUCIBLE_MODES else None
+
+        self.contract_registry = ContractRegistry.from_config(self.w3, app_config)
+        self.cpu_pool = CpuPool.from_config(app_config)
+        # Set for stopping the scans of every phase (see block_scheduler.run_work_units)
+        self.cancel_event = threading.Event()
+        self.symbols = {}
+        self.address_contracts = {}
 
     def get_current_balance_eth(self, address: str) -> float:
         """
@@ -55,21 +103,81 @@ class Web3Manager:
             Returns: The current balance of every defined erc20 tokens
         """
         logging.info(f"Getting the {address}'s current balance in {name_token}")
-        return float(self.w3.fromWei(self.w3.eth.contract(
-            Web3.toChecksumAddress(token_address), abi=self.abi_files[name_token]).functions.balanceOf(
+        return float(self.w3.fromWei(self.get_contract_erc20(token_address, name_token).functions.balanceOf(
             Web3.toChecksumAddress(address)).call(), 'ether'))
 
+    def get_balances(self, addresses: List[str], erc20_list: List[dict], block_number: int = None) \
+            -> Dict[str, Dict[str, float]]:
+        """
+            Description: Gets the current balance in ETH and in every erc20 token of several addresses, using
+                batches of eth_getBalance/eth_call requests instead of a request per value
+            Args:
+                addresses (List[str]): Addresses which we can get the info
+                erc20_list (List[dict]): erc20 tokens defined in app-config.json (name, tokenAddress)
+                block_number (int): Block where the balances are read (the latest block if it's None)
+
+            Returns: Balance by address and by token's name ("ETH" for the balance in ETH)
+        """
+        return {address: {name_token: self.get_ether_value_from_wei(value) for name_token, value in balances.items()}
+                for address, balances in self.get_raw_balances(addresses, erc20_list, block_number).items()}
+
+    def get_raw_balances(self, addresses: List[str], erc20_list: List[dict], block_number: int = None) \
+            -> Dict[str, Dict[str, int]]:
+        """
+            Description: Gets the balance in wei in ETH and in every erc20 token of several addresses (see
+                get_balances)
+            Args:
+                addresses (List[str]): Addresses which we can get the info
+                erc20_list (List[dict]): erc20 tokens defined in app-config.json (name, tokenAddress)
+                block_number (int): Block where the balances are read (the latest block if it's None)
+
+            Returns: Balance in wei by address and by token's name ("ETH" for the balance in ETH)
+        """
+        logging.info(f"Getting the current balances of {len(addresses)} addresses in ETH and "
+                     f"{len(erc20_list)} erc20 tokens")
+        block_identifier = "latest" if block_number is None else hex(block_number)
+        rpc_requests = []
+        keys = []
+        for address in addresses:
+            checksum_address = Web3.toChecksumAddress(address)
+            rpc_requests.append(("eth_getBalance", [checksum_address, block_identifier]))
+            keys.append((address, "ETH"))
+            for erc20 in erc20_list:
+                contract = self.get_contract_erc20(erc20['tokenAddress'], erc20['name'])
+                rpc_requests.append(("eth_call", [
+                    {"to": contract.address, "data": contract.encodeABI(fn_name="balanceOf", args=[checksum_address])},
+                    block_identifier]))
+                keys.append((address, erc20['name']))
+
+        res = {address: {} for address in addresses}
+        for (address, name_token), response in zip(keys, self._request_batch(rpc_requests)):
+            if name_token == "ETH":
+                res[address][name_token] = int(get_result(response), 16)
+                continue
+
+            # A token without code (wrong address, self-destructed...) answers with no data, and a reverting
+            # balanceOf with an error, so its balance can't be read
+            result = HexBytes(response.get("result") or "0x")
+            if "error" in response or len(result) < 32:
+                logging.warning(f"The balance of {address} in {name_token} can't be read, 0 is used: "
+                                f"{response.get('error', 'empty result of balanceOf')}")
+                res[address][name_token] = 0
+            else:
+                res[address][name_token] = self.w3.codec.decode_single('uint256', result)
+
+        return res
+
     def get_contract_erc20(self, token_address: str, name_token: str) -> Contract:
         """
-            Description: Gets the smart contract object
+            Description: Gets the smart contract object. It's only created once per address, and its ABI file is
+                only read the first time that a contract needs it.
             Args:
                 token_address (str): Smart Contract's address
                 name_token (str): Token's name
 
             Returns: The smart contract object
         """
-        logging.info(f"Contract object ({name_token}) created for being analyzed.")
-        return self.w3.eth.contract(Web3.toChecksumAddress(token_address), abi=self.abi_files[name_token])
+        return self.contract_registry.get_contract(token_address, name_token)
 
     def get_latest_block_number(self) -> int:
         """
@@ -80,26 +188,29 @@ class Web3Manager:
         """
         return self.w3.eth.block_number
 
-    @staticmethod
-    def get_symbol_contract(contract: Contract) -> str:
+    def get_symbol_contract(self, contract: Contract) -> str:
         """
-            Description: Gets the token's symbol associated with the contract
+            Description: Gets the token's symbol associated with the contract. It's only requested once per contract.
             Args:
                 contract (str): Smart Contract's object
 
             Returns: The token's symbol associated with the contract
         """
-        return contract.functions.symbol().call()
+        if contract.address not in self.symbols:
+            self.symbols[contract.address] = contract.functions.symbol().call()
+        return self.symbols[contract.address]
 
     def is_address_contract(self, address: str) -> bool:
         """
-            Description: Checks if the address is valid or not
+            Description: Checks if the address is a smart contract. It's only requested once per address.
             Args:
                 address (str): Address which we can get the info
 
-            Returns: If the address is valid or not
+            Returns: If the address is a smart contract or not
         """
-        return self.w3.eth.getCode(Web3.toChecksumAddress(address)) != HexBytes('0x')
+        if address not in self.address_contracts:
+            self.address_contracts[address] = self.w3.eth.getCode(Web3.toChecksumAddress(address)) != HexBytes('0x')
+        return self.address_contracts[address]
 
     def get_time_hour_from_block(self, block_number: int) -> float:
         """
@@ -109,8 +220,107 @@ class Web3Manager:
 
             Returns: The hour:minute of a specific block_number
         """
-        dt_block = datetime.fromtimestamp(self.w3.eth.getBlock(block_number).timestamp)
-        return round(dt_block.hour+dt_block.minute/60.0, 2)
+        return get_time_hour(self.block_timestamps.get_timestamp(block_number))
+
+    def get_block_by_timestamp(self, timestamp: int) -> int:
+        """
+            Description: Gets the first block mined at or after a timestamp, fetching only a few block timestamps
+            Args:
+                timestamp (int): Timestamp (seconds)
+
+            Returns: The block number, latest block + 1 if the timestamp is in the future
+        """
+        return self.block_resolver.get_block_by_timestamp(timestamp)
+
+    def get_block_range(self, from_timestamp: int, to_timestamp: int = None) -> Tuple[int, int]:
+        """
+            Description: Gets the blocks mined in a time window
+            Args:
+                from_timestamp (int): Initial timestamp (included)
+                to_timestamp (int): Final timestamp (included). If it's None, the window ends in the latest block
+
+            Returns: (from_block, to_block)
+        """
+        return self.block_resolver.get_block_range(from_timestamp, to_timestamp)
+
+    def load_block_timestamps(self, block_numbers: List[int]) -> Dict[int, int]:
+        """
+            Description: Loads the timestamps of several blocks in the cache, fetching the missing ones in batches.
+                Timestamps of finalized blocks are persisted, so the next runs don't fetch them again.
+            Args:
+                block_numbers (List[int]): Block numbers (duplicates are allowed)
+
+            Returns: Timestamp by block number
+        """
+        return self.block_timestamps.load(block_numbers)
+
+    def get_finalized_block_number(self) -> int:
+        """
+            Description: Gets the last block which is considered final (confirmation_blocks below the latest block)
+            Args: None
+
+            Returns: The last finalized blockNumber
+        """
+        return self.get_latest_block_number() - self.confirmation_blocks
+
+    def get_block_hashes(self, block_numbers: List[int]) -> Dict[int, Tuple[Optional[str], Optional[str]]]:
+        """
+            Description: Gets the hash and the parent's hash of several blocks with batches of requests
+            Args:
+                block_numbers (List[int]): Block numbers
+
+            Returns: (hash, parentHash) by block number, (None, None) for the blocks which the node doesn't have
+        """
+        blocks = self.make_batch_request(
+            [("eth_getBlockByNumber", [hex(block_number), False]) for block_number in block_numbers])
+        return {block_number: (block["hash"], block["parentHash"]) if block else (None, None)
+                for block_number, block in zip(block_numbers, blocks)}
+
+    def make_request(self, method: str, params: list):
+        """
+            Description: Sends a JSON-RPC request and returns its raw result, without the formatting of web3
+            Args:
+                method (str): JSON-RPC method
+                params (list): Parameters of the method
+
+            Returns: The result of the request as returned by the node. It's sent alone, not in a batch
+        """
+        return get_result(self.rpc_cache.request(method, params, self.provider.make_request) if self.rpc_cache
+                          else self.provider.make_request(method, params))
+
+    def make_batch_request(self, rpc_requests: List[Tuple[str, list]]) -> list:
+        """
+            Description: Sends several JSON-RPC requests using batches of rpc_batch_size requests. Every batch goes
+                to the best node of the pool, and only the requests which aren't in the RPC cache are sent
+            Args:
+                rpc_requests (List[Tuple[str, list]]): (method, params) of every request
+
+            Returns: The result of every request, in the same order as rpc_requests
+        """
+        return [get_result(response) for response in self._request_batch(rpc_requests)]
+
+    def _request_batch(self, rpc_requests: List[Tuple[str, list]]) -> List[dict]:
+        responses = [self.rpc_cache.get(method, params) if self.rpc_cache else None for method, params in rpc_requests]
+        missing = [index for index, response in enumerate(responses) if response is None]
+        for index in range(0, len(missing), self.rpc_batch_size):
+            chunk = missing[index:index + self.rpc_batch_size]
+            for num_request, response in zip(chunk, self.provider.make_batch_request(
+                    [rpc_requests[num_request] for num_request in chunk])):
+                responses[num_request] = response
+                if self.rpc_cache is not None:
+                    self.rpc_cache.put(*rpc_requests[num_request], response)
+
+        return responses
+
+    def _fetch_block_timestamps(self, block_numbers: List[int]) -> Dict[int, int]:
+        blocks = self.make_batch_request(
+            [("eth_getBlockByNumber", [hex(block_number), False]) for block_number in block_numbers])
+        return {block_number: int(block["timestamp"], 16) for block_number, block in zip(block_numbers, blocks)}
+
+    def _fetch_block_blooms(self, block_numbers: List[int]) -> Dict[int, bytes]:
+        blocks = self.make_batch_request(
+            [("eth_getBlockByNumber", [hex(block_number), False]) for block_number in block_numbers])
+        return {block_number: bytes(HexBytes(block["logsBloom"])) for block_number, block in zip(block_numbers, blocks)}
 
     def get_ether_value_from_wei(self, wei_value):
         """
@@ -121,3 +331,28 @@ class Web3Manager:
             Returns: Ether value
         """
         return float(self.w3.fromWei(wei_value, 'ether'))
+
+
+def get_time_hour(timestamp: int) -> float:
+    """
+        Description: Gets the hour:minute of a timestamp in the local timezone
+        Args:
+            timestamp (int): Timestamp of a block
+
+        Returns: The hour:minute as hours
+    """
+    dt_block = datetime.fromtimestamp(timestamp)
+    return round(dt_block.hour+dt_block.minute/60.0, 2)
+
+
+def get_result(response: dict):
+    """
+        Description: Gets the result of a JSON-RPC response
+        Args:
+            response (dict): JSON-RPC response
+
+        Returns: The result, a ValueError is raised if the node answered with an error
+    """
+    if "error" in response:
+        raise ValueError(response["error"])
+    return response["result"]
@@ -1,17 +1,37 @@
 import argparse
+import base64
+from array import array
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 import json
 import logging
-from typing import List
+import os
+import time
+from typing import Any, Callable, Dict, Iterator, List, Tuple, Union
 
 from web3.contract import Contract
 
-from extract_data.main_program.blockchain_interactions import events_contract
+from extract_data.main_program.balance_history import BalanceHistory
+from extract_data.main_program.blockchain_interactions import block_scheduler
+from extract_data.main_program.blockchain_interactions.block_range_planner import BlockRangePlanner
+from extract_data.main_program.blockchain_interactions.block_resolver import SECONDS_PER_DAY, parse_time
+from extract_data.main_program.blockchain_interactions.chain_follower import DEFAULT_FOLLOW_POLL_SECONDS, \
+    DEFAULT_MAX_FOLLOW_BLOCKS, ChainFollower, ReorgSafeAggregate
+from extract_data.main_program.blockchain_interactions.event_columns import EventColumns, Field
 from extract_data.main_program.blockchain_interactions.events_contract import Event
-from extract_data.main_program.blockchain_interactions.web3_manager import Web3Manager
-from statistics import median
+from extract_data.main_program.blockchain_interactions.instrumentation import DEFAULT_METRICS_FORMAT, \
+    DEFAULT_PROFILE_INTERVAL_MS, METRICS_FORMATS, SamplingProfiler
+from extract_data.main_program.blockchain_interactions.logs_fetcher import LogsFetcher, decode_shard, \
+    get_amount_argument
+from extract_data.main_program.blockchain_interactions.raw_log_decoder import ADDRESS_SIZE, HASH_SIZE, get_hex_values
+from extract_data.main_program.blockchain_interactions.rpc_cache import DEFAULT_RPC_CACHE_MODE, REPRODUCIBLE_MODES
+from extract_data.main_program.blockchain_interactions.web3_manager import Web3Manager, get_time_hour
+from extract_data.main_program.quantiles import QuantileSummary
+from extract_data.main_program.results_writer import DEFAULT_RESULTS_FORMAT, RESULTS_FORMATS, NdjsonWriter
 import sys
 
+DEFAULT_MAX_ADDRESSES_PER_FILTER = 100
+
 
 def read_json(path: str) -> dict:
     """
@@ -26,54 +46,81 @@ def read_json(path: str) -> dict:
         return json.load(json_file)
 
 
-def extract_info_addresses(web3_manager, app_config: dict) -> list:
+def extract_info_addresses(web3_manager, app_config: dict, on_address: Callable[[dict], None] = None) -> list:
     """
         Description: Extract the needed info for an addresses list
         Args:
             web3_manager (Web3Manager): Manager for getting data from blockchain
             app_config (dict): app-config.json
+            on_address (Callable): If it's defined, it receives the info of every address as soon as it's ready,
+                and the info isn't kept
 
-        Returns: All needed info for an addresses list
+        Returns: All needed info for an addresses list (empty with on_address)
     """
 
     logging.info("Extracting info for all defined addresses.")
-    list_info_by_address = []
     for address in app_config["addresses_get_info"]:
         if not web3_manager.w3.isAddress(address):
             logging.error(f"The address {address} is not valid")
             sys.exit(-1)
 
-        info_address = get_info_by_address(web3_manager, app_config, address)
+    # The balances are read in the last block of the history, so they anchor the balance history
+    from_block, latest_block = get_history_blocks(web3_manager, app_config)
+    raw_balances = web3_manager.get_raw_balances(app_config["addresses_get_info"], app_config["erc20_list"],
+                                                 latest_block)
+    transaction_history_addresses = get_transaction_history_addresses(
+        web3_manager, app_config["addresses_get_info"], app_config, (from_block, latest_block))
+
+    list_info_by_address = []
+    for address in app_config["addresses_get_info"]:
+        balances = {name_token: web3_manager.get_ether_value_from_wei(value)
+                    for name_token, value in raw_balances[address].items()}
+        info_address = get_info_by_address(web3_manager, app_config, address, balances,
+                                           transaction_history_addresses[address])
+        if is_balance_history_enabled(app_config):
+            info_address.update(get_balance_history_info(web3_manager, app_config, raw_balances[address],
+                                                         transaction_history_addresses[address], from_block,
+                                                         latest_block))
         logging.info(f"Address {address}: {info_address}")
-        list_info_by_address.append(info_address)
+        if on_address is not None:
+            on_address(info_address)
+        else:
+            list_info_by_address.append(info_address)
 
     return list_info_by_address
 
 
-def get_info_by_address(web3_manager, app_config: dict, address: str) -> dict:
+def get_info_by_address(web3_manager, app_config: dict, address: str, balances: dict = None,
+                        transaction_history_tokens: dict = None) -> dict:
     """
         Description: Gets the needed info for a specific address
         Args:
             web3_manager (Web3Manager): Manager for getting data from blockchain
             app_config (dict): app-config.json
             address (dict): Address which will be extracted the needed info
+            balances (dict): Balances already fetched by token's name ("ETH" for the balance in ETH). If it's None,
+                the balances are requested one by one
+            transaction_history_tokens (dict): Transaction history already fetched. If it's None, it's fetched
+                only for this address
 
         Returns: The needed info for a specific address (Balance, transaction history)
     """
 
     logging.info(f"Extracting info for {address}.")
 
-    transaction_history_tokens = get_transaction_history_contract(web3_manager, address, app_config)
+    if transaction_history_tokens is None:
+        transaction_history_tokens = get_transaction_history_contract(web3_manager, address, app_config)
 
     res = {
         'Address': address,
         'Type': "Smart contract" if web3_manager.is_address_contract(address) else "Private key address",
-        'CurrentBalanceETH': web3_manager.get_current_balance_eth(address)
+        'CurrentBalanceETH': balances["ETH"] if balances else web3_manager.get_current_balance_eth(address)
     }
 
     for erc20 in app_config["erc20_list"]:
         res.update({
             f"CurrentBalance{erc20['name']}":
+                balances[erc20['name']] if balances else
                 web3_manager.get_current_balance_erc20(erc20['tokenAddress'], address, erc20['name']),
             f"TransfersHistory{erc20['name']}":
                 transaction_history_tokens[f"transaction_history_transfers_{erc20['name']}"],
@@ -95,6 +142,25 @@ def get_transaction_history_contract(web3_manager, address: str, app_config: dic
         Returns: All transaction history (transfers, swaps) in a blocks' interval
     """
 
+    return get_transaction_history_addresses(web3_manager, [address], app_config)[address]
+
+
+def get_transaction_history_addresses(web3_manager, addresses: List[str], app_config: dict,
+                                      blocks: Tuple[int, int] = None) -> dict:
+    """
+        Description: Gets all transaction history (transfers, swaps) of several addresses in a blocks' interval.
+            Every window is scanned once for a chunk of addresses (OR'd in the indexed topics), and the events
+            are split by address in memory. With the balance history, the (block, signed amount) of every
+            transfer is kept too.
+        Args:
+            web3_manager (Web3Manager): Manager for getting data from blockchain
+            addresses (List[str]): Addresses which will be extracted the transaction history
+            app_config (dict): app-config.json
+            blocks (Tuple[int, int]): Blocks' interval of the history (see get_history_blocks if it's None)
+
+        Returns: All transaction history (transfers, swaps and balance changes) in a blocks' interval by address
+    """
+
     logging.info("Creating all the contract objets.")
     contracts_erc20 = {}
     for erc20 in app_config["erc20_list"]:
@@ -102,76 +168,327 @@ def get_transaction_history_contract(web3_manager, address: str, app_config: dic
             erc20["name"]: web3_manager.get_contract_erc20(erc20['tokenAddress'], erc20["name"])
         })
 
-    latest_block: int = web3_manager.get_latest_block_number()
-    batch_size = 9999
-    num_iterations = int(app_config["track_history_in_last_blocks"]/batch_size)
-    logging.info(f"Transaction history starts: {num_iterations} iterations will be executed.")
+    from_block, latest_block = blocks or get_history_blocks(web3_manager, app_config)
+    logging.info(f"Transaction history starts ({from_block}, {latest_block}) for {len(addresses)} addresses.")
 
+    max_addresses_per_filter = app_config.get("max_addresses_per_filter", DEFAULT_MAX_ADDRESSES_PER_FILTER)
     res = {}
-    for num_iter in range(0, num_iterations):
-        for erc20_name, contract in contracts_erc20.items():
-            transaction_history_transfers_token, transaction_history_swap_token = transactions_by_token(
-                contract, latest_block-batch_size, latest_block, address, erc20_name, list(contracts_erc20.values())
-            )
-
-            if f"transaction_history_transfers_{erc20_name}" in res:
-                res[f"transaction_history_transfers_{erc20_name}"] += transaction_history_transfers_token
-            else:
-                res[f"transaction_history_transfers_{erc20_name}"] = transaction_history_transfers_token
+    for index in range(0, len(addresses), max_addresses_per_filter):
+        chunk = [address.lower() for address in addresses[index:index + max_addresses_per_filter]]
+        fetcher_from = LogsFetcher(web3_manager.w3, contracts_erc20, [Event.Transfer, Event.Swap], {'from': chunk},
+                                   "transaction_history", web3_manager.make_request, web3_manager.bloom_index)
+        fetcher_to = LogsFetcher(web3_manager.w3, contracts_erc20, [Event.Transfer], {'to': chunk},
+                                 "transaction_history_to", web3_manager.make_request, web3_manager.bloom_index)
+        balance_changes = {address: {erc20_name: [] for erc20_name in contracts_erc20} for address in chunk} \
+            if is_balance_history_enabled(app_config) else None
+        if web3_manager.event_store is None and app_config.get("fast_log_decoding", False):
+            history = scan_transaction_history(web3_manager, app_config, fetcher_from, fetcher_to, from_block,
+                                               latest_block, chunk, list(contracts_erc20), balance_changes)
+        else:
+            history = stream_transaction_history(web3_manager, app_config, fetcher_from, fetcher_to, from_block,
+                                                 latest_block, chunk, list(contracts_erc20), balance_changes)
+
+        for address in addresses[index:index + max_addresses_per_filter]:
+            res[address] = {}
+            for erc20_name, (transaction_history_transfers_token, transaction_history_swap_token) in \
+                    history[address.lower()].items():
+                res[address][f"transaction_history_transfers_{erc20_name}"] = transaction_history_transfers_token
+                res[address][f"transaction_history_swap_{erc20_name}"] = transaction_history_swap_token
+                if balance_changes is not None:
+                    res[address][f"balance_changes_{erc20_name}"] = balance_changes[address.lower()][erc20_name]
 
-            if f"transaction_history_swap_{erc20_name}" in res:
-                res[f"transaction_history_swap_{erc20_name}"] += transaction_history_swap_token
-            else:
-                res[f"transaction_history_swap_{erc20_name}"] = transaction_history_swap_token
+    return res
 
-        latest_block = latest_block-batch_size
 
-        if num_iter % 10 == 0:
-            logging.info(f"Iteration {num_iter}")
+def is_balance_history_enabled(app_config: dict) -> bool:
+    """
+        Description: Checks if the balance history of the addresses is requested
+        Args:
+            app_config (dict): app-config.json
+
+        Returns: If balance_history is enabled or balance_snapshot_blocks has any block
+    """
+
+    return app_config.get("balance_history", False) or bool(app_config.get("balance_snapshot_blocks"))
+
+
+def get_balance_history_info(web3_manager, app_config: dict, raw_balances: dict, transaction_history_tokens: dict,
+                             from_block: int, to_block: int) -> dict:
+    """
+        Description: Gets the balance history of an address in every token, replaying its transfers from the
+            current balance without any request
+        Args:
+            web3_manager (Web3Manager): Manager for getting data from blockchain
+            app_config (dict): app-config.json
+            raw_balances (dict): Balances in wei at the end of to_block by token's name
+            transaction_history_tokens (dict): Transaction history, with the balance changes of every token
+            from_block (int): Initial block of the transaction history
+            to_block (int): Final block of the transaction history
+
+        Returns: The balance after every block with transfers (if balance_history is enabled) and the balance at
+            the end of the blocks of balance_snapshot_blocks (None out of the history), by token
+    """
+
+    res = {}
+    snapshot_blocks = app_config.get("balance_snapshot_blocks") or []
+    for erc20 in app_config["erc20_list"]:
+        balance_history = BalanceHistory(raw_balances[erc20['name']], from_block, to_block,
+                                         transaction_history_tokens[f"balance_changes_{erc20['name']}"])
+        if app_config.get("balance_history", False):
+            res[f"BalanceHistory{erc20['name']}"] = [
+                [block_number, web3_manager.get_ether_value_from_wei(balance)]
+                for block_number, balance in balance_history.get_series()]
+        if snapshot_blocks:
+            res[f"BalanceSnapshots{erc20['name']}"] = {
+                str(block_number): None if balance is None else web3_manager.get_ether_value_from_wei(balance)
+                for block_number, balance in balance_history.get_snapshots(snapshot_blocks).items()}
 
     return res
 
 
-def transactions_by_token(contract: Contract, from_block: int, to_block: int, address: str, erc20_name: str,
-                          all_contracts: List[Contract])\
-        -> tuple[list[str], list[str]]:
+def stream_transaction_history(web3_manager, app_config: dict, fetcher_from: LogsFetcher, fetcher_to: LogsFetcher,
+                               from_block: int, to_block: int, addresses: List[str], erc20_names: List[str],
+                               balance_changes: dict = None) -> dict:
+    """
+        Description: Gets the transaction history of several addresses processing the decoded events window by
+            window as they arrive. The received and sent transfers of every window are fetched together and the
+            window is classified on its own, which is possible because the transfers of a transaction are always in
+            the same block, so only the history is kept in memory, not the events nor the received hashes
+        Args:
+            web3_manager (Web3Manager): Manager for getting data from blockchain
+            app_config (dict): app-config.json
+            fetcher_from (LogsFetcher): Fetcher of the transfers/swaps sent by the addresses
+            fetcher_to (LogsFetcher): Fetcher of the transfers received by the addresses
+            from_block (int): Initial block for being analyzed
+            to_block (int): Final block for being analyzed
+            addresses (List[str]): Addresses (lowercase) which will be extracted the transaction history
+            erc20_names (List[str]): Tokens' names which are being analyzed
+            balance_changes (dict): If it's defined, the (block number, signed amount) of every transfer is appended
+                to it by token's name by address (lowercase)
+
+        Returns: (transfers, swaps) by token's name by address (lowercase)
+    """
+
+    history = {address: {erc20_name: ([], [], []) for erc20_name in erc20_names} for address in addresses}
+    for transfers_to, events_from in iter_scan_events(web3_manager, app_config, [fetcher_to, fetcher_from],
+                                                      from_block, to_block):
+        transaction_hashes_to = {}
+        for transfer in transfers_to:
+            transaction_hashes_to.setdefault(transfer["args"]["to"].lower(), set()).add(
+                transfer["transactionHash"].hex())
+
+        merge_window_history(history, {
+            address: transactions_by_token(fetcher_from.group_events(events_from_address),
+                                           transaction_hashes_to.get(address, set()), address, erc20_names)
+            for address, events_from_address in split_events_by_argument(events_from, 'from').items()})
+        if balance_changes is not None:
+            append_balance_changes(balance_changes, fetcher_to, transfers_to, 'to', 1)
+            append_balance_changes(balance_changes, fetcher_from, events_from, 'from', -1)
+
+    return {address: {erc20_name: (transfers, swap_transfers + swaps)
+                      for erc20_name, (transfers, swap_transfers, swaps) in history_tokens.items()}
+            for address, history_tokens in history.items()}
+
+
+def scan_transaction_history(web3_manager, app_config: dict, fetcher_from: LogsFetcher, fetcher_to: LogsFetcher,
+                             from_block: int, to_block: int, addresses: List[str], erc20_names: List[str],
+                             balance_changes: dict = None) -> dict:
     """
-        Description: Gets the transaction history for address (transfers/swaps) for a specific token
+        Description: Gets the transaction history of several addresses window by window. The raw logs of every
+            window are decoded and classified by classify_window in the CPU pool, which is possible because the
+            transfers of a transaction are always in the same window. The partial histories are merged in block order.
         Args:
-            contract (Contract): Contract for being analyzed
+            web3_manager (Web3Manager): Manager for getting data from blockchain
+            app_config (dict): app-config.json
+            fetcher_from (LogsFetcher): Fetcher of the transfers/swaps sent by the addresses
+            fetcher_to (LogsFetcher): Fetcher of the transfers received by the addresses
             from_block (int): Initial block for being analyzed
             to_block (int): Final block for being analyzed
+            addresses (List[str]): Addresses (lowercase) which will be extracted the transaction history
+            erc20_names (List[str]): Tokens' names which are being analyzed
+            balance_changes (dict): If it's defined, the (block number, signed amount) of every transfer is appended
+                to it by token's name by address (lowercase)
+
+        Returns: (transfers, swaps) by token's name by address (lowercase)
+    """
+
+    planner = BlockRangePlanner.from_config(app_config)
+
+    def classify_work_unit(window) -> dict:
+        raw_logs_from = planner.get_events(fetcher_from.name, window[0], window[1], fetcher_from.get_raw_logs)
+        raw_logs_to = planner.get_events(fetcher_to.name, window[0], window[1], fetcher_to.get_raw_logs)
+        return web3_manager.cpu_pool.run(classify_window, fetcher_from.get_shard_spec(), raw_logs_from,
+                                         fetcher_to.get_shard_spec(), raw_logs_to, addresses, erc20_names,
+                                         balance_changes is not None)
+
+    windows_history = block_scheduler.run_work_units(
+        get_scan_windows(app_config, from_block, to_block), classify_work_unit, get_max_concurrent_requests(app_config),
+        fetcher_from.name, web3_manager.cancel_event)
+    planner.log_stats(fetcher_from.name)
+
+    history = {address: {erc20_name: ([], [], []) for erc20_name in erc20_names} for address in addresses}
+    for window_history in windows_history:
+        if balance_changes is not None:
+            window_history, window_balance_changes = window_history
+            for address, changes_tokens in window_balance_changes.items():
+                for erc20_name, changes in changes_tokens.items():
+                    balance_changes[address][erc20_name].extend(changes)
+        merge_window_history(history, window_history)
+
+    return {address: {erc20_name: (transfers, swap_transfers + swaps)
+                      for erc20_name, (transfers, swap_transfers, swaps) in history_tokens.items()}
+            for address, history_tokens in history.items()}
+
+
+def merge_window_history(history: dict, window_history: dict):
+    """
+        Description: Appends the partial history of a window to the history of several addresses
+        Args:
+            history (dict): (transfers, transfers which are swaps, swaps) by token's name by address
+            window_history (dict): Partial history of a window, with the same structure
+    """
+
+    for address, history_tokens in window_history.items():
+        for erc20_name, window_lists in history_tokens.items():
+            for merged_list, window_list in zip(history[address][erc20_name], window_lists):
+                merged_list.extend(window_list)
+
+
+def append_balance_changes(balance_changes: dict, fetcher: LogsFetcher, events: list, argument: str, sign: int):
+    """
+        Description: Appends the (block number, signed amount) of decoded transfers to the balance changes of the
+            addresses
+        Args:
+            balance_changes (dict): Balance changes by token's name by address (lowercase)
+            fetcher (LogsFetcher): Fetcher which got the events
+            events (list): Decoded events of the fetcher
+            argument (str): Argument with the address whose balance changes (from, to)
+            sign (int): -1 for the transfers sent by the addresses, 1 for the received ones
+    """
+
+    for (erc20_name, type_event), transfers in fetcher.group_events(events).items():
+        if type_event != Event.Transfer or not transfers:
+            continue
+        amount_argument = fetcher.get_amount_argument((erc20_name, type_event))
+        for transfer in transfers:
+            address = transfer["args"][argument].lower()
+            if address in balance_changes:
+                balance_changes[address][erc20_name].append(
+                    (transfer["blockNumber"], sign * transfer["args"][amount_argument]))
+
+
+def classify_window(spec_from: dict, raw_logs_from: List[dict], spec_to: dict, raw_logs_to: List[dict],
+                    addresses: List[str], erc20_names: List[str], with_balance_changes: bool = False) \
+        -> Union[Dict[str, Dict[str, tuple]], Tuple[Dict[str, Dict[str, tuple]], Dict[str, Dict[str, list]]]]:
+    """
+        Description: Decodes and classifies the raw logs of a window (see split_transactions). It can be executed
+            in another process, so it only receives and returns picklable values
+        Args:
+            spec_from (dict): Shard spec of the fetcher of the transfers/swaps sent by the addresses
+            raw_logs_from (List[dict]): Raw logs of the transfers/swaps sent by the addresses
+            spec_to (dict): Shard spec of the fetcher of the transfers received by the addresses
+            raw_logs_to (List[dict]): Raw logs of the transfers received by the addresses
+            addresses (List[str]): Addresses (lowercase) which will be extracted the transaction history
+            erc20_names (List[str]): Tokens' names which are being analyzed
+            with_balance_changes (bool): If the (block number, signed amount) of every transfer is returned too
+
+        Returns: (transfers, transfers which are swaps, swaps) by token's name by address (lowercase). With
+            with_balance_changes, a tuple with them and the balance changes by token's name by address
+    """
+
+    balance_changes = {address: {erc20_name: [] for erc20_name in erc20_names} for address in addresses}
+    transaction_hashes_to = {}
+    for (erc20_name, type_event), columns in decode_shard(spec_to, raw_logs_to).items():
+        addresses_to = get_hex_values(columns["to"], ADDRESS_SIZE)
+        for address, transaction_hash in zip(addresses_to, get_hex_values(columns["transactionHash"], HASH_SIZE)):
+            transaction_hashes_to.setdefault(address, set()).add(transaction_hash)
+        if with_balance_changes:
+            amounts = columns[get_amount_argument(spec_to, (erc20_name, type_event))]
+            for address, block_number, value in zip(addresses_to, columns["blockNumber"], amounts):
+                balance_changes[address][erc20_name].append((block_number, value))
+
+    res = {address: {erc20_name: ([], [], []) for erc20_name in erc20_names} for address in addresses}
+    for (erc20_name, type_event), columns in decode_shard(spec_from, raw_logs_from).items():
+        addresses_from = get_hex_values(columns["from"], ADDRESS_SIZE)
+        for address, transaction_hash in zip(addresses_from, get_hex_values(columns["transactionHash"], HASH_SIZE)):
+            transfers, swap_transfers, swaps = res[address][erc20_name]
+            if type_event == Event.Swap:
+                swaps.append(transaction_hash)
+            elif transaction_hash in transaction_hashes_to.get(address, ()):
+                swap_transfers.append(transaction_hash)
+            else:
+                transfers.append(transaction_hash)
+        if with_balance_changes and type_event == Event.Transfer:
+            amounts = columns[get_amount_argument(spec_from, (erc20_name, type_event))]
+            for address, block_number, value in zip(addresses_from, columns["blockNumber"], amounts):
+                balance_changes[address][erc20_name].append((block_number, -value))
+
+    return (res, balance_changes) if with_balance_changes else res
+
+
+def split_events_by_argument(events: list, argument: str) -> dict:
+    """
+        Description: Splits decoded events by the value of an address argument, keeping their order
+        Args:
+            events (list): Decoded events
+            argument (str): Name of the argument (from, to...)
+
+        Returns: Events by address (lowercase)
+    """
+
+    res = {}
+    for event in events:
+        res.setdefault(event["args"][argument].lower(), []).append(event)
+
+    return res
+
+
+def transactions_by_token(events_from: dict, transaction_hashes_to: set, address: str, erc20_names: List[str])\
+        -> dict[str, tuple[list[str], list[str], list[str]]]:
+    """
+        Description: Gets the transaction history for address (transfers/swaps) for every token. It can be called
+            window by window, since the transfers of a transaction are always in the same block
+        Args:
+            events_from (dict): Transfers/swaps sent by the address by (token's name, event type)
+            transaction_hashes_to (set): Transactions' hashes where the address received any token
             address (str): Address which will be extracted the transaction history
-            erc20_name (str): Token's name which is being analyzed
-            all_contracts(List): For checking if it was happened a swap between two contracts
-        Returns: Transaction history for address (transfers/swaps)
+            erc20_names (List[str]): Tokens' names which are being analyzed
+        Returns: Transaction history for address (transfers, transfers which are swaps, swaps) by token's name
     """
 
-    logging.info(f"Getting transaction history (transfers/swap) for {address} using {erc20_name}")
-    transaction_history_swaps = []
-    transaction_history_transfers = []
-    transfers_from = events_contract.get_event_from_contract(
-        Event.Transfer, contract, from_block, to_block, erc20_name, {'from': address})
-    swaps = events_contract.get_event_from_contract(
-        Event.Swap, contract, from_block, to_block, erc20_name, {'from': address})
+    logging.debug(f"Getting transaction history (transfers/swap) for {address} using {erc20_names}")
+    res = {}
+    for erc20_name in erc20_names:
+        res[erc20_name] = split_transactions(events_from.get((erc20_name, Event.Transfer), []),
+                                             events_from.get((erc20_name, Event.Swap), []),
+                                             transaction_hashes_to)
 
+    return res
+
+
+def split_transactions(transfers_from: list, swaps: list, transaction_hashes_to: set) \
+        -> tuple[list[str], list[str], list[str]]:
+    """
+        Description: Splits the transactions' hashes of the transfers and swaps sent by an address. A transfer is
+            a swap when the address received another transfer in the same transaction
+        Args:
+            transfers_from (list): Transfer events sent by the address
+            swaps (list): Swap events sent by the address
+            transaction_hashes_to (set): Transactions' hashes where the address received any token
+
+        Returns: (transfers, transfers which are swaps, swaps)
+    """
+
+    transaction_history_transfers = []
+    transaction_history_swap_transfers = []
     for transfer in transfers_from:
-        transaction_hash_to = []
-        for another_contract in all_contracts:
-            transfers_to = events_contract.get_event_from_contract(
-                Event.Transfer, another_contract, transfer["blockNumber"],
-                transfer["blockNumber"], another_contract.functions.symbol().call(), {'to': address})
-            if transfers_to:
-                transaction_hash_to.append(transfers_to[0]["transactionHash"].hex())
-        if transfer["transactionHash"].hex() not in transaction_hash_to:
+        if transfer["transactionHash"].hex() in transaction_hashes_to:
+            transaction_history_swap_transfers.append(transfer["transactionHash"].hex())
+        else:
             transaction_history_transfers.append(transfer["transactionHash"].hex())
-        elif transfer["transactionHash"].hex() in transaction_hash_to:
-            transaction_history_swaps.append(transfer["transactionHash"].hex())
-
-    for swap in swaps:
-        transaction_history_swaps.append(swap["transactionHash"].hex())
 
-    return transaction_history_transfers, transaction_history_swaps
+    return transaction_history_transfers, transaction_history_swap_transfers, \
+        [swap["transactionHash"].hex() for swap in swaps]
 
 
 def get_median_claim_account(web3_manager, app_config: dict) -> list:
@@ -181,30 +498,58 @@ def get_median_claim_account(web3_manager, app_config: dict) -> list:
             web3_manager (Web3Manager): Manager for getting data from blockchain
             app_config (dict): app-config.json
 
-        Returns: List[median claimed quantity, number of claimed airdrop event]
+        Returns: List[median claimed quantity, number of claimed airdrop event, extra quantiles by name].
+            The median is -1 when there isn't any claim
     """
     logging.info("Getting the median claimed in a specific airdrop.")
+    from_block, to_block = get_airdrop_blocks(web3_manager, app_config)
+    return get_claim_result(app_config, get_claim_summary(web3_manager, app_config, from_block, to_block))
+
+
+def get_claim_summary(web3_manager, app_config: dict, from_block: int, to_block: int) -> QuantileSummary:
+    """
+        Description: Summarizes the quantities claimed in the airdrop in a blocks' interval
+        Args:
+            web3_manager (Web3Manager): Manager for getting data from blockchain
+            app_config (dict): app-config.json
+            from_block (int): Initial block for being analyzed
+            to_block (int): Final block for being analyzed
+
+        Returns: Summary of the claimed quantities, which can be merged with the ones of other intervals
+    """
     logging.info("Creating the airdrop's contract object.")
     contract: Contract = web3_manager.get_contract_erc20(
         app_config["airdrop_info"]['airdrop_address_example'], "airdrop")
+    logging.info(f"Transaction history starts ({from_block}, {to_block}).")
 
-    latest_block = app_config["airdrop_info"]["airdrop_to_block"]
-    batch_size = 9999
-    num_iterations = int((latest_block-app_config["airdrop_info"]["airdrop_from_block"]) / batch_size)
-    logging.info(f"Transaction history starts: {num_iterations} iterations will be executed")
+    fetcher = LogsFetcher(web3_manager.w3, {"airdrop": contract}, [Event.AirDropped], name="airdrop",
+                          make_request=web3_manager.make_request, bloom_index=web3_manager.bloom_index)
+    summaries = scan_event_windows(
+        web3_manager, app_config, fetcher, from_block, to_block,
+        {"amount": Field('d', "amount", web3_manager.get_ether_value_from_wei)},
+        lambda claims: QuantileSummary.from_config(app_config, claims["amount"]))
+    return merge_summaries(app_config, summaries)
 
-    claim_quantity = []
 
-    for num_iter in range(0, num_iterations):
-        claim_airdrop = events_contract.get_event_from_contract(
-            Event.AirDropped, contract, latest_block - batch_size, latest_block, "airdrop")
-        for claim in claim_airdrop:
-            claim_quantity.append(web3_manager.get_ether_value_from_wei(claim["args"]["amount"]))
+def get_claim_result(app_config: dict, claim_quantity: QuantileSummary) -> list:
+    """
+        Description: Gets the median claimed quantity from the summary of the claims
+        Args:
+            app_config (dict): app-config.json
+            claim_quantity (QuantileSummary): Summary of the claimed quantities
 
-        latest_block = latest_block - batch_size
+        Returns: List[median claimed quantity, number of claimed airdrop event, extra quantiles by name].
+            The median is -1 when there isn't any claim
+    """
+
+    if claim_quantity.count == 0:
+        logging.info("There isn't any getAirdropped event")
+        return [-1, 0, {}]
 
-    logging.info(f"For {len(claim_quantity)} getAirdropped event the median claim quantity was {median(claim_quantity)}")
-    return [median(claim_quantity), len(claim_quantity)] if claim_quantity else -1
+    logging.info(f"For {claim_quantity.count} getAirdropped event the median claim quantity was "
+                 f"{claim_quantity.median()}")
+    return [claim_quantity.median(), claim_quantity.count,
+            claim_quantity.quantiles(app_config.get("extra_quantiles", []))]
 
 
 def get_events_compound_token(web3_manager, app_config: dict) -> dict:
@@ -217,9 +562,24 @@ def get_events_compound_token(web3_manager, app_config: dict) -> dict:
         Returns: Result of getting data from compounds token
     """
     logging.info("Getting the compound token's median hour for mint/burnt events.")
+    from_block, latest_block = get_history_blocks(web3_manager, app_config)
+    return get_compound_token_result(app_config, get_compound_token_summaries(web3_manager, app_config, from_block,
+                                                                              latest_block))
+
+
+def get_compound_token_summaries(web3_manager, app_config: dict, from_block: int, to_block: int) -> dict:
+    """
+        Description: Summarizes the hours of the mint/burnt events of every ctoken in a blocks' interval
+        Args:
+            web3_manager (Web3Manager): Manager for getting data from blockchain
+            app_config (dict): app-config.json
+            from_block (int): Initial block for being analyzed
+            to_block (int): Final block for being analyzed
+
+        Returns: Summary of the hours by (ctoken's name, event type), which can be merged with the ones of other
+            intervals
+    """
     logging.info("Creating the ctoken's contract objects.")
-    res = {}
-    events = {}
     contracts_compound_tokens = {}
     for ctoken in app_config["compound_tokens"]:
         contracts_compound_tokens.update({
@@ -227,51 +587,255 @@ def get_events_compound_token(web3_manager, app_config: dict) -> dict:
         })
 
     logging.info(f"Contracts: {contracts_compound_tokens}")
-    latest_block = web3_manager.get_latest_block_number()
-    batch_size = 9999
-    num_iterations = int(app_config["track_history_in_last_blocks"] / batch_size)
-    logging.info(f"Transaction history starts: {num_iterations} iterations will be executed")
-
-    for num_iter in range(0, num_iterations):
-        for ctoken, contract in contracts_compound_tokens.items():
-            mints = events_contract.get_event_from_contract(
-                Event.Mint, contract, latest_block - batch_size, latest_block, ctoken)
-            burnt = events_contract.get_event_from_contract(
-                Event.Burnt, contract, latest_block - batch_size, latest_block, ctoken)
-
-            if f"transaction_history_mint_{ctoken}" in events:
-                events[f"transaction_history_mint_{ctoken}"] += mints
-            else:
-                events[f"transaction_history_mint_{ctoken}"] = mints
+    logging.info(f"Transaction history starts ({from_block}, {to_block}).")
 
-            if f"transaction_history_burnt_{ctoken}" in events:
-                events[f"transaction_history_burnt_{ctoken}"] += burnt
-            else:
-                events[f"transaction_history_burnt_{ctoken}"] = burnt
+    fetcher = LogsFetcher(web3_manager.w3, contracts_compound_tokens, [Event.Mint, Event.Burnt],
+                          name="compound_tokens", make_request=web3_manager.make_request,
+                          bloom_index=web3_manager.bloom_index)
+    routes = fetcher.get_routes()
 
-        latest_block = latest_block - batch_size
+    def get_hour_summaries(events: EventColumns) -> list:
+        logging.info(f"Loading the timestamps of {len(events)} mint/burnt events.")
+        timestamps = web3_manager.load_block_timestamps(events["blockNumber"])
+        return web3_manager.cpu_pool.run(summarize_hours, app_config,
+                                         events.split_by_route(len(routes), "blockNumber"),
+                                         array('Q', timestamps), array('Q', timestamps.values()))
 
-        if num_iter % 10 == 0:
-            logging.info(f"Iteration {num_iter}")
+    summaries_windows = scan_event_windows(web3_manager, app_config, fetcher, from_block, to_block,
+                                           {"blockNumber": Field('Q', "blockNumber")}, get_hour_summaries)
+
+    return {route: merge_summaries(app_config, [summaries_window[index] for summaries_window in summaries_windows])
+            for index, route in enumerate(routes)}
 
-    logging.info("Calculating the median hour for mint/burnt events of each ctoken.")
-    for ctoken, contract in contracts_compound_tokens.items():
-        hour_time_mint = []
-        hour_time_burnt = []
-        for mint in events[f"transaction_history_mint_{ctoken}"]:
-            hour_time_mint.append(web3_manager.get_time_hour_from_block(mint["blockNumber"]))
 
-        for burnt in events[f"transaction_history_burnt_{ctoken}"]:
-            hour_time_burnt.append(web3_manager.get_time_hour_from_block(burnt["blockNumber"]))
+def get_compound_token_result(app_config: dict, summaries: dict) -> dict:
+    """
+        Description: Gets the median time of mint/burnt events of every ctoken from the summaries of their hours
+        Args:
+            app_config (dict): app-config.json
+            summaries (dict): Summary of the hours by (ctoken's name, event type)
+
+        Returns: Result of getting data from compounds token
+    """
+
+    logging.info("Calculating the median hour for mint/burnt events of each ctoken.")
+    res = {}
+    for ctoken in [ctoken["name"] for ctoken in app_config["compound_tokens"]]:
+        hour_time_mint = summaries.get((ctoken, Event.Mint), QuantileSummary())
+        hour_time_burnt = summaries.get((ctoken, Event.Burnt), QuantileSummary())
 
         res[ctoken] = {
-            "Mint_time_median": get_time_timezone(median(hour_time_mint) if hour_time_mint else -1),
-            "Burnt_time_median": get_time_timezone(median(hour_time_burnt) if hour_time_burnt else -1)
+            "Mint_time_median": get_time_timezone(hour_time_mint.median() if hour_time_mint.count else -1),
+            "Burnt_time_median": get_time_timezone(hour_time_burnt.median() if hour_time_burnt.count else -1)
         }
+        if app_config.get("extra_quantiles") and hour_time_mint.count:
+            res[ctoken]["Mint_time_quantiles"] = {name: get_time_timezone(hour) for name, hour in
+                                                  hour_time_mint.quantiles(app_config["extra_quantiles"]).items()}
+        if app_config.get("extra_quantiles") and hour_time_burnt.count:
+            res[ctoken]["Burnt_time_quantiles"] = {name: get_time_timezone(hour) for name, hour in
+                                                   hour_time_burnt.quantiles(app_config["extra_quantiles"]).items()}
+
+    return res
+
+
+def summarize_hours(app_config: dict, block_numbers_by_route: List[array], block_numbers: array,
+                    timestamps: array) -> List[QuantileSummary]:
+    """
+        Description: Summarizes the hour of the events of a window by route. It can be executed in another process,
+            so it only receives and returns picklable values
+        Args:
+            app_config (dict): app-config.json
+            block_numbers_by_route (List[array]): Block number of every event by route's index
+            block_numbers (array): Block numbers whose timestamp is known
+            timestamps (array): Timestamp of every block of block_numbers
+
+        Returns: Quantile summary of the hours by route's index
+    """
+
+    hours = {block_number: get_time_hour(timestamp) for block_number, timestamp in zip(block_numbers, timestamps)}
+    return [QuantileSummary.from_config(app_config, [hours[block_number] for block_number in route_block_numbers])
+            for route_block_numbers in block_numbers_by_route]
+
+
+def iter_scan_events(web3_manager, app_config: dict, fetchers: List[LogsFetcher], from_block: int, to_block: int) \
+        -> Iterator[tuple]:
+    """
+        Description: Gets the events of several fetchers in a blocks' interval window by window, as they arrive.
+            The interval is scanned in concurrent windows of adaptive size, at most max_prefetch_windows ahead of
+            the caller, and only the blocks which aren't in the event store are fetched. Every fetcher gets the same
+            windows, so the events of a window can be processed together and dropped.
+        Args:
+            web3_manager (Web3Manager): Manager for getting data from blockchain
+            app_config (dict): app-config.json
+            fetchers (List[LogsFetcher]): Fetchers of the contracts and events for being analyzed
+            from_block (int): Initial block for being analyzed
+            to_block (int): Final block for being analyzed
+
+        Returns: Iterator of the decoded events of every fetcher in every window (a tuple with a list per fetcher),
+            sorted by block number and log index
+    """
+
+    def iter_range(range_fetchers: List[LogsFetcher], range_from: int, range_to: int) -> Iterator[tuple]:
+        planner = BlockRangePlanner.from_config(app_config)
+        yield from block_scheduler.iter_work_units(
+            get_scan_windows(app_config, range_from, range_to),
+            lambda window: tuple(fetcher.get_events_with_planner(window[0], window[1], planner)
+                                 for fetcher in range_fetchers),
+            get_max_concurrent_requests(app_config), range_fetchers[0].name, web3_manager.cancel_event,
+            app_config.get("max_prefetch_windows"))
+        for fetcher in range_fetchers:
+            planner.log_stats(fetcher.name)
+
+    if web3_manager.event_store is None:
+        yield from iter_range(fetchers, from_block, to_block)
+        return
+
+    def iter_fetcher_range(fetcher: LogsFetcher) -> Callable[[int, int], Iterator[list]]:
+        return lambda range_from, range_to: (events for events, in iter_range([fetcher], range_from, range_to))
+
+    # The same finalized block and read windows for every fetcher, so the windows read from the store match
+    finalized_block = web3_manager.get_finalized_block_number()
+    yield from zip(*[web3_manager.event_store.iter_sync(
+        fetcher.get_store_keys(), from_block, to_block, finalized_block, iter_fetcher_range(fetcher),
+        fetcher.get_event_scope, app_config.get("block_window_size", block_scheduler.DEFAULT_BLOCK_WINDOW_SIZE))
+        for fetcher in fetchers])
+
+
+def scan_event_windows(web3_manager, app_config: dict, fetcher: LogsFetcher, from_block: int, to_block: int,
+                       fields: dict, reduce_window: Callable[[EventColumns], Any]) -> list:
+    """
+        Description: Gets only some fields of the events of a fetcher in a blocks' interval and reduces them window
+            by window, so only the partial results are kept in memory. When fast_log_decoding is enabled and there
+            isn't an event store, the raw logs are decoded in columns and every window is reduced by its worker,
+            otherwise the fields are taken from the events yielded by iter_scan_events and reduced window by
+            window as they arrive.
+        Args:
+            web3_manager (Web3Manager): Manager for getting data from blockchain
+            app_config (dict): app-config.json
+            fetcher (LogsFetcher): Fetcher of the contracts and events for being analyzed
+            from_block (int): Initial block for being analyzed
+            to_block (int): Final block for being analyzed
+            fields (dict): Field by column's name (only numeric fields)
+            reduce_window (Callable): Function which reduces the events of a window (EventColumns whose route's
+                column is the index in fetcher.get_routes())
+
+        Returns: The partial result of every window, sorted by block number
+    """
+
+    route_indexes = {route: index for index, route in enumerate(fetcher.get_routes())}
+    if web3_manager.event_store is not None or not app_config.get("fast_log_decoding", False):
+        return [reduce_window(EventColumns.from_events(events_window, fields,
+                                                       lambda event: route_indexes[fetcher.get_route(event)]))
+                for events_window, in iter_scan_events(web3_manager, app_config, [fetcher], from_block, to_block)]
+
+    def fetch_window(window_from: int, window_to: int) -> EventColumns:
+        return EventColumns.from_decoded(fetcher.get_event_columns(window_from, window_to), route_indexes, fields)
+
+    planner = BlockRangePlanner.from_config(app_config)
+    res = block_scheduler.run_work_units(
+        get_scan_windows(app_config, from_block, to_block),
+        lambda window: reduce_window(planner.get_events(fetcher.name, window[0], window[1], fetch_window,
+                                                        EventColumns.empty(fields))),
+        get_max_concurrent_requests(app_config), fetcher.name, web3_manager.cancel_event)
+    planner.log_stats(fetcher.name)
+
+    return res
+
+
+def merge_summaries(app_config: dict, summaries: List[QuantileSummary]) -> QuantileSummary:
+    """
+        Description: Merges the quantile summaries of several windows
+        Args:
+            app_config (dict): app-config.json
+            summaries (List[QuantileSummary]): Summary of every window
+
+        Returns: The summary of every value
+    """
+
+    res = QuantileSummary.from_config(app_config)
+    for summary in summaries:
+        res.merge(summary)
 
     return res
 
 
+def get_scan_windows(app_config: dict, from_block: int, to_block: int) -> list:
+    """
+        Description: Splits a blocks' interval in the windows which will be scanned concurrently
+        Args:
+            app_config (dict): app-config.json
+            from_block (int): Initial block for being analyzed
+            to_block (int): Final block for being analyzed
+
+        Returns: List of (from_block, to_block) windows
+    """
+
+    return block_scheduler.get_work_unit_windows(
+        from_block, to_block, app_config.get("block_window_size", block_scheduler.DEFAULT_BLOCK_WINDOW_SIZE),
+        get_max_concurrent_requests(app_config))
+
+
+def get_max_concurrent_requests(app_config: dict) -> int:
+    """
+        Description: Gets the maximum number of work units executed at the same time. Runs which are recorded or
+            replayed (rpc_cache_mode) execute them one by one, so the windows and their requests are the same
+        Args:
+            app_config (dict): app-config.json
+
+        Returns: The maximum number of work units executed at the same time
+    """
+
+    if app_config.get("rpc_cache_mode", DEFAULT_RPC_CACHE_MODE) in REPRODUCIBLE_MODES:
+        return 1
+    return app_config.get("max_concurrent_requests", block_scheduler.DEFAULT_MAX_CONCURRENT_REQUESTS)
+
+
+def get_history_blocks(web3_manager, app_config: dict) -> Tuple[int, int]:
+    """
+        Description: Gets the blocks' interval of the transaction history and the compound tokens: the blocks of the
+            last track_history_in_last_days days if it's defined, otherwise the last track_history_in_last_blocks
+        Args:
+            web3_manager (Web3Manager): Manager for getting data from blockchain
+            app_config (dict): app-config.json
+
+        Returns: (from_block, latest_block)
+    """
+
+    if app_config.get("track_history_in_last_days") is not None:
+        from_block, latest_block = web3_manager.get_block_range(
+            int(time.time() - app_config["track_history_in_last_days"] * SECONDS_PER_DAY))
+        return min(from_block, latest_block), latest_block
+
+    latest_block = web3_manager.get_latest_block_number()
+    return latest_block - app_config["track_history_in_last_blocks"] + 1, latest_block
+
+
+def get_airdrop_blocks(web3_manager, app_config: dict) -> Tuple[int, int]:
+    """
+        Description: Gets the blocks' interval of the airdrop. airdrop_from_time and airdrop_to_time (timestamps or
+            ISO 8601 dates) replace airdrop_from_block and airdrop_to_block when they are defined
+        Args:
+            web3_manager (Web3Manager): Manager for getting data from blockchain
+            app_config (dict): app-config.json
+
+        Returns: (from_block, to_block)
+    """
+
+    airdrop_info = app_config["airdrop_info"]
+    if airdrop_info.get("airdrop_from_time") is not None and airdrop_info.get("airdrop_to_time") is not None:
+        return web3_manager.get_block_range(parse_time(airdrop_info["airdrop_from_time"]),
+                                            parse_time(airdrop_info["airdrop_to_time"]))
+
+    from_block = airdrop_info.get("airdrop_from_block")
+    to_block = airdrop_info.get("airdrop_to_block")
+    if airdrop_info.get("airdrop_from_time") is not None:
+        from_block = web3_manager.get_block_by_timestamp(parse_time(airdrop_info["airdrop_from_time"]))
+    if airdrop_info.get("airdrop_to_time") is not None:
+        to_block = web3_manager.get_block_by_timestamp(parse_time(airdrop_info["airdrop_to_time"]) + 1) - 1
+
+    return from_block, to_block
+
+
 def get_time_timezone(hour: float) -> str:
     """
         Description: Process the hour to a string format with the timezone.
@@ -289,16 +853,53 @@ def get_time_timezone(hour: float) -> str:
     return f"{int(hour)}:{str(minutes).zfill(2)} ({datetime.now().astimezone().tzname()})"
 
 
+def run_phases(web3_manager, app_config: dict, phases: List[Tuple[str, Callable]]) -> list:
+    """
+        Description: Runs the phases of the program, timing every one. With concurrent_phases, they run at the same
+            time sharing the nodes' budget (rate limit, max_requests_in_flight), so the total time approaches the
+            longest phase. If a phase fails (or the program is interrupted), the scans of the rest are cancelled.
+        Args:
+            web3_manager (Web3Manager): Manager for getting data from blockchain
+            app_config (dict): app-config.json
+            phases (List[Tuple[str, Callable]]): Name and function (with web3_manager and app_config) of every phase
+
+        Returns: The result of every phase, in the same order as phases
+    """
+
+    def run_phase(name: str, phase: Callable):
+        logging.info(f"Phase {name} starts.")
+        with web3_manager.metrics.phase(name):
+            return phase(web3_manager, app_config)
+
+    if not app_config.get("concurrent_phases", False):
+        return [run_phase(name, phase) for name, phase in phases]
+
+    logging.info(f"Running the phases {[name for name, _ in phases]} at the same time.")
+    with ThreadPoolExecutor(max_workers=len(phases), thread_name_prefix="phase") as executor:
+        futures = [executor.submit(run_phase, name, phase) for name, phase in phases]
+        try:
+            for future in as_completed(futures):
+                future.result()
+        except BaseException as error:
+            logging.error(f"Cancelling every phase: {error!r}")
+            web3_manager.cancel_event.set()
+            raise
+
+    return [future.result() for future in futures]
+
+
 def write_results(result_path: str, info_addresses: dict, claim_airdrop: list,
-                  compound_tokens_info: dict, app_config: dict):
+                  compound_tokens_info: dict, app_config: dict, last_block: int = None):
     """
-        Description: Write the final result of the program in a json file
+        Description: Write the final result of the program in a json file. The file is replaced atomically, so
+            readers never see a partial result
         Args:
             result_path (str): Path which result will be written
             info_addresses (dict): The result of getting info of the addresses list
             claim_airdrop (dict): Info about the airdrop
             compound_tokens_info (dict): Median of times of each ctoken
             app_config (dict): app-config.json
+            last_block (int): Last block included in the results, written as LastBlock if it's defined
 
         Returns:
             None
@@ -307,32 +908,245 @@ def write_results(result_path: str, info_addresses: dict, claim_airdrop: list,
 
     res = {"TrackingAddresses": {},
            "CompoundTokensTimeMintBurnt": compound_tokens_info,
-           "AirdropInfo": {"Airdrop_address": app_config["airdrop_info"]["airdrop_address_example"],
-                              "Number_claims": claim_airdrop[1],
-                              "Median_claimed": claim_airdrop[0]}}
+           "AirdropInfo": get_airdrop_result(claim_airdrop, app_config)}
 
     for info_address in info_addresses:
-        res_address = {
-            "Type": info_address["Type"],
-            "CurrentBalanceETH": info_address["CurrentBalanceETH"]
-        }
+        res["TrackingAddresses"].update({info_address["Address"]: get_address_result(info_address, app_config)})
+    if last_block is not None:
+        res["LastBlock"] = last_block
+
+    with open(f"{result_path}.tmp", "w") as outfile:
+        json.dump(res, outfile, indent=4)
+    os.replace(f"{result_path}.tmp", result_path)
+
+
+def stream_results(web3_manager, app_config: dict):
+    """
+        Description: Runs the phases of the program writing their results in results_path as newline-delimited JSON
+            as soon as they are ready: a record per address ("Record": "Address"), one for the airdrop
+            ("AirdropInfo") and one per ctoken ("CompoundToken"). Records aren't kept in memory after being written,
+            and the records of every address and phase are flushed, so a crash keeps them in the temporary file
+        Args:
+            web3_manager (Web3Manager): Manager for getting data from blockchain
+            app_config (dict): app-config.json
+
+        Returns:
+            None
+    """
+    compact_hashes = app_config.get("results_compact_hashes", False)
+    logging.info(f"Streaming the results in {app_config['results_path']}.")
+
+    with NdjsonWriter(app_config["results_path"]) as writer:
+        def write(record: dict, flush: bool = False):
+            # Records are written inside the phases, so their cost is added to write_results record by record
+            with web3_manager.metrics.phase("write_results", log=False):
+                writer.write(record, flush)
+
+        def write_info_addresses(web3_manager, app_config: dict):
+            extract_info_addresses(web3_manager, app_config, lambda info_address: write(
+                {"Record": "Address", "Address": info_address["Address"],
+                 **get_address_result(info_address, app_config, compact_hashes)}, flush=True))
+
+        def write_claim_airdrop(web3_manager, app_config: dict):
+            write({"Record": "AirdropInfo",
+                   **get_airdrop_result(get_median_claim_account(web3_manager, app_config), app_config)}, flush=True)
+
+        def write_compound_token_info(web3_manager, app_config: dict):
+            compound_token_info = get_events_compound_token(web3_manager, app_config)
+            for num_ctoken, (ctoken, ctoken_info) in enumerate(compound_token_info.items()):
+                write({"Record": "CompoundToken", "Name": ctoken, **ctoken_info},
+                      flush=num_ctoken == len(compound_token_info) - 1)
+
+        run_phases(web3_manager, app_config, [
+            ("extract_info_addresses", write_info_addresses),
+            ("get_median_claim_account", write_claim_airdrop),
+            ("get_events_compound_token", write_compound_token_info)
+        ])
+        with web3_manager.metrics.phase("write_results"):
+            writer.flush()
+
+
+def follow_chain(web3_manager, app_config: dict):
+    """
+        Description: Keeps the results up to date with the head of the chain. The phases are run once up to the
+            finalized block, then the chain is polled every follow_poll_seconds: only the logs of the new blocks are
+            fetched, their partial results (transaction history, claims, hours) are added to the aggregates of the
+            phases and the results are written again. A reorg only rolls back the partial results after the fork,
+            whose blocks are fetched again. It runs until the program is interrupted
+        Args:
+            web3_manager (Web3Manager): Manager for getting data from blockchain
+            app_config (dict): app-config.json
+
+        Returns:
+            None
+    """
+    addresses = app_config["addresses_get_info"]
+    last_block = web3_manager.get_finalized_block_number()
+    history_from_block = min(get_history_blocks(web3_manager, app_config)[0], last_block)
+    airdrop_from_block, airdrop_to_block = get_airdrop_blocks(web3_manager, app_config)
+    logging.info(f"Following the chain since the finalized block {last_block}.")
+
+    def scan_blocks(from_block: int, to_block: int) -> list:
+        history_blocks = max(from_block, history_from_block), to_block
+        airdrop_blocks = max(from_block, airdrop_from_block), min(to_block, airdrop_to_block)
+
+        def scan_claims(web3_manager, app_config: dict) -> QuantileSummary:
+            if airdrop_blocks[0] > airdrop_blocks[1]:
+                return QuantileSummary.from_config(app_config)
+            return get_claim_summary(web3_manager, app_config, *airdrop_blocks)
+
+        return run_phases(web3_manager, app_config, [
+            ("extract_info_addresses", lambda web3_manager, app_config: get_transaction_history_addresses(
+                web3_manager, addresses, app_config, history_blocks)),
+            ("get_median_claim_account", scan_claims),
+            ("get_events_compound_token", lambda web3_manager, app_config: get_compound_token_summaries(
+                web3_manager, app_config, *history_blocks))
+        ])
+
+    history, claims, compound_tokens = scan_blocks(0, last_block)
+    aggregates = [
+        ReorgSafeAggregate(lambda: {address: {} for address in addresses}, merge_transaction_history, history),
+        ReorgSafeAggregate(lambda: QuantileSummary.from_config(app_config), QuantileSummary.merge, claims),
+        ReorgSafeAggregate(dict, lambda summaries, partial: merge_route_summaries(app_config, summaries, partial),
+                           compound_tokens)
+    ]
+
+    def write_follow_results(to_block: int):
+        raw_balances = web3_manager.get_raw_balances(addresses, app_config["erc20_list"], to_block)
+        info_addresses = []
+        for address in addresses:
+            balances = {name_token: web3_manager.get_ether_value_from_wei(value)
+                        for name_token, value in raw_balances[address].items()}
+            info_address = get_info_by_address(web3_manager, app_config, address, balances,
+                                               aggregates[0].value[address])
+            if is_balance_history_enabled(app_config):
+                info_address.update(get_balance_history_info(web3_manager, app_config, raw_balances[address],
+                                                             aggregates[0].value[address], history_from_block,
+                                                             to_block))
+            info_addresses.append(info_address)
+
+        with web3_manager.metrics.phase("write_results"):
+            write_results(app_config["results_path"], info_addresses, get_claim_result(app_config, aggregates[1].value),
+                          get_compound_token_result(app_config, aggregates[2].value), app_config, to_block)
+
+    write_follow_results(last_block)
+    follower = ChainFollower(web3_manager.get_block_hashes, web3_manager.get_latest_block_number, last_block,
+                             web3_manager.confirmation_blocks,
+                             app_config.get("follow_max_blocks", DEFAULT_MAX_FOLLOW_BLOCKS))
+    poll_seconds = app_config.get("follow_poll_seconds", DEFAULT_FOLLOW_POLL_SECONDS)
+    try:
+        while True:
+            update = follower.poll()
+            if update.rollback_block is not None:
+                first_block = min(aggregate.rollback(update.rollback_block) for aggregate in aggregates)
+                follower.rewind(first_block - 1)
+                web3_manager.block_timestamps.forget(first_block)
+                continue
+
+            if update.from_block is not None:
+                logging.info(f"Following the new blocks ({update.from_block}, {update.to_block}).")
+                for aggregate, partial in zip(aggregates, scan_blocks(update.from_block, update.to_block)):
+                    aggregate.add(update.from_block, update.to_block, partial)
+                    aggregate.finalize(update.to_block - web3_manager.confirmation_blocks)
+                write_follow_results(update.to_block)
+            if follower.last_block >= update.latest_block:
+                time.sleep(poll_seconds)
+    except KeyboardInterrupt:
+        logging.info(f"Follow mode stopped in the block {follower.last_block}.")
+
+
+def merge_transaction_history(history: dict, partial: dict):
+    """
+        Description: Appends the transaction history of a blocks' interval to the history of the addresses
+        Args:
+            history (dict): Lists of the transaction history (transfers, swaps, balance changes) by key by address
+            partial (dict): Transaction history of the next interval (see get_transaction_history_addresses)
+    """
+
+    for address, history_tokens in partial.items():
+        for key, values in history_tokens.items():
+            history.setdefault(address, {}).setdefault(key, []).extend(values)
+
 
-        res_erc20 = {}
-        for erc20 in app_config["erc20_list"]:
-            res_erc20[erc20["name"]] = {
-                "CurrentBalance": info_address[f"CurrentBalance{erc20['name']}"],
-                "TransactionsHistory": {
-                    "Transfers": info_address[f"TransfersHistory{erc20['name']}"],
-                    "Swaps": info_address[f"SwapHistory{erc20['name']}"]
-                }
+def merge_route_summaries(app_config: dict, summaries: dict, partial: dict):
+    """
+        Description: Merges the summaries of a blocks' interval in the summaries by route
+        Args:
+            app_config (dict): app-config.json
+            summaries (dict): Summary by route (ctoken's name, event type)
+            partial (dict): Summary by route of the next interval
+    """
+
+    for route, summary in partial.items():
+        summaries.setdefault(route, QuantileSummary.from_config(app_config)).merge(summary)
+
+
+def get_address_result(info_address: dict, app_config: dict, compact_hashes: bool = False) -> dict:
+    """
+        Description: Gets the result of an address
+        Args:
+            info_address (dict): Info of the address returned by get_info_by_address
+            app_config (dict): app-config.json
+            compact_hashes (bool): If the transfers and swaps are written as a base64 string of the concatenated
+                transaction hashes (32 bytes each) instead of a list of hex strings
+
+        Returns: Type, balance in ETH and balance, transaction history and balance history by erc20 token
+    """
+
+    res_address = {
+        "Type": info_address["Type"],
+        "CurrentBalanceETH": info_address["CurrentBalanceETH"]
+    }
+
+    res_erc20 = {}
+    for erc20 in app_config["erc20_list"]:
+        transfers = info_address[f"TransfersHistory{erc20['name']}"]
+        swaps = info_address[f"SwapHistory{erc20['name']}"]
+        res_erc20[erc20["name"]] = {
+            "CurrentBalance": info_address[f"CurrentBalance{erc20['name']}"],
+            "TransactionsHistory": {
+                "Transfers": encode_hashes(transfers) if compact_hashes else transfers,
+                "Swaps": encode_hashes(swaps) if compact_hashes else swaps
             }
+        }
+        for key in ("BalanceHistory", "BalanceSnapshots"):
+            if f"{key}{erc20['name']}" in info_address:
+                res_erc20[erc20["name"]][key] = info_address[f"{key}{erc20['name']}"]
 
-        res_address["DetailsERC20"] = res_erc20
+    res_address["DetailsERC20"] = res_erc20
+    return res_address
 
-        res["TrackingAddresses"].update({info_address["Address"]: res_address})
 
-    with open(result_path, "w") as outfile:
-        json.dump(res, outfile, indent=4)
+def get_airdrop_result(claim_airdrop: list, app_config: dict) -> dict:
+    """
+        Description: Gets the result of the airdrop
+        Args:
+            claim_airdrop (list): Info about the airdrop returned by get_median_claim_account
+            app_config (dict): app-config.json
+
+        Returns: Airdrop's address, number of claims, median claimed and extra quantiles
+    """
+
+    res = {"Airdrop_address": app_config["airdrop_info"]["airdrop_address_example"],
+           "Number_claims": claim_airdrop[1],
+           "Median_claimed": claim_airdrop[0]}
+    if len(claim_airdrop) > 2 and claim_airdrop[2]:
+        res["Quantiles_claimed"] = claim_airdrop[2]
+
+    return res
+
+
+def encode_hashes(transaction_hashes: List[str]) -> str:
+    """
+        Description: Encodes transaction hashes in a single column
+        Args:
+            transaction_hashes (List[str]): Transaction hashes in hex
+
+        Returns: Base64 string of the concatenated hashes (32 bytes each)
+    """
+
+    return base64.b64encode(b"".join(bytes.fromhex(transaction_hash[2:])
+                                     for transaction_hash in transaction_hashes)).decode()
 
 
 def main():
@@ -351,13 +1165,52 @@ def main():
                         format='%(asctime)s %(levelname)s %(name)s %(message)s')
     logging.info('Program started')
 
-    web3_manager = Web3Manager(configs)
-
-    info_addresses = extract_info_addresses(web3_manager, configs)
-    claim_airdrop = get_median_claim_account(web3_manager, configs)
-    compound_token_info = get_events_compound_token(web3_manager, configs)
+    if configs.get("metrics_format", DEFAULT_METRICS_FORMAT) not in METRICS_FORMATS:
+        raise ValueError(f"Unknown metrics_format {configs['metrics_format']}, it must be one of {METRICS_FORMATS}")
+    results_format = configs.get("results_format", DEFAULT_RESULTS_FORMAT)
+    if results_format not in RESULTS_FORMATS:
+        raise ValueError(f"Unknown results_format {results_format}, it must be one of {RESULTS_FORMATS}")
+    if configs.get("follow", False) and results_format != "json":
+        raise ValueError("The follow mode rewrites the results after every new block, it needs results_format json")
+    if configs.get("follow", False) and configs.get("rpc_cache_mode", DEFAULT_RPC_CACHE_MODE) in REPRODUCIBLE_MODES:
+        raise ValueError("The follow mode waits for new blocks, so it can't be recorded or replayed")
+    profiler = None
+    if configs.get("profile_path"):
+        profiler = SamplingProfiler(configs.get("profile_interval_ms", DEFAULT_PROFILE_INTERVAL_MS))
+        profiler.start()
 
-    write_results(configs["results_path"], info_addresses, claim_airdrop, compound_token_info, configs)
+    web3_manager = Web3Manager(configs)
+    metrics = web3_manager.metrics
+
+    try:
+        if configs.get("follow", False):
+            follow_chain(web3_manager, configs)
+        elif results_format == "ndjson":
+            stream_results(web3_manager, configs)
+        else:
+            info_addresses, claim_airdrop, compound_token_info = run_phases(web3_manager, configs, [
+                ("extract_info_addresses", extract_info_addresses),
+                ("get_median_claim_account", get_median_claim_account),
+                ("get_events_compound_token", get_events_compound_token)
+            ])
+
+            with metrics.phase("write_results"):
+                write_results(configs["results_path"], info_addresses, claim_airdrop, compound_token_info, configs)
+    finally:
+        # The worker processes of the CPU pool are stopped even if a phase failed
+        web3_manager.cpu_pool.shutdown()
+        if profiler is not None:
+            profiler.stop()
+            profiler.write(configs["profile_path"])
+
+    metrics.log_stats()
+    if configs.get("metrics_path"):
+        metrics.write(configs["metrics_path"], configs.get("metrics_format", DEFAULT_METRICS_FORMAT))
+    if web3_manager.rpc_cache is not None:
+        web3_manager.rpc_cache.log_stats()
+    for endpoint_stats in web3_manager.provider.get_stats():
+        logging.info(f"Node {endpoint_stats['uri']}: {endpoint_stats['requests']} requests, "
+                     f"average latency {endpoint_stats['latency']}s, ejected {endpoint_stats['ejected']}.")
 
     logging.info('Finished')
     print(f"Finished. Results generated in {configs['results_path']}")
@@ -0,0 +1,221 @@
+import math
+import random
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_MAX_EXACT_VALUES = 1000000
+DEFAULT_SKETCH_K = 200
+# Capacity ratio between a level of the sketch and the level above it
+SKETCH_CAPACITY_RATIO = 2 / 3
+SKETCH_MIN_CAPACITY = 2
+SKETCH_SEED = 0
+
+
+class QuantileSummary:
+    """
+        Description: Streaming summary of values for getting their quantiles. Values are kept in a typed buffer and
+            the quantiles are exact while they fit in max_exact_values, then the summary becomes a KLL sketch whose
+            memory doesn't depend on the number of values. Summaries of different windows (or workers) can be merged.
+    """
+
+    __slots__ = ("max_exact_values", "sketch_k", "values", "sorted_values", "sketch")
+
+    def __init__(self, max_exact_values: int = DEFAULT_MAX_EXACT_VALUES, sketch_k: int = DEFAULT_SKETCH_K):
+        """
+            Args:
+                max_exact_values (int): Maximum number of values kept for exact quantiles
+                sketch_k (int): Size of the sketch used beyond max_exact_values. The rank error is about 1.7 / k
+        """
+        self.max_exact_values = max_exact_values
+        self.sketch_k = sketch_k
+        self.values = array('d')
+        self.sorted_values = None
+        self.sketch: Optional[KllSketch] = None
+
+    @classmethod
+    def from_config(cls, app_config: dict, values: Iterable[float] = ()) -> 'QuantileSummary':
+        """
+            Description: Creates a summary using the parameters defined in app-config.json
+            Args:
+                app_config (dict): app-config.json
+                values (Iterable[float]): Initial values
+
+            Returns: The summary
+        """
+        res = cls(app_config.get("max_exact_quantile_values", DEFAULT_MAX_EXACT_VALUES),
+                  app_config.get("quantile_sketch_k", DEFAULT_SKETCH_K))
+        res.add(values)
+        return res
+
+    @property
+    def count(self) -> int:
+        return self.sketch.count if self.sketch is not None else len(self.values)
+
+    @property
+    def is_exact(self) -> bool:
+        return self.sketch is None
+
+    def add(self, values: Iterable[float]):
+        """
+            Description: Adds several values (a window) to the summary
+            Args:
+                values (Iterable[float]): Values for being added
+        """
+        if self.sketch is not None:
+            self.sketch.add(values)
+            return
+
+        self.values.extend(values)
+        self.sorted_values = None
+        if len(self.values) > self.max_exact_values:
+            self._to_sketch()
+
+    def merge(self, other: 'QuantileSummary') -> 'QuantileSummary':
+        """
+            Description: Adds the values of another summary
+            Args:
+                other (QuantileSummary): Summary of other values
+
+            Returns: This summary
+        """
+        if other.sketch is None:
+            self.add(other.values)
+            return self
+
+        if self.sketch is None:
+            self._to_sketch()
+        self.sketch.merge(other.sketch)
+        return self
+
+    def quantile(self, q: float) -> float:
+        """
+            Description: Gets a quantile of the values. The median (q=0.5) is the same as statistics.median while
+                the summary is exact
+            Args:
+                q (float): Quantile between 0 and 1
+
+            Returns: The value of the quantile, interpolating linearly between the closest ranks
+        """
+        if not 0 <= q <= 1:
+            raise ValueError(f"The quantile {q} must be between 0 and 1")
+        if self.count == 0:
+            raise ValueError("No values for getting a quantile")
+        if self.sketch is not None:
+            return self.sketch.quantile(q)
+
+        if self.sorted_values is None:
+            self.sorted_values = array('d', sorted(self.values))
+        position = (len(self.sorted_values) - 1) * q
+        lower = math.floor(position)
+        upper = min(lower + 1, len(self.sorted_values) - 1)
+        fraction = position - lower
+        return (1 - fraction) * self.sorted_values[lower] + fraction * self.sorted_values[upper]
+
+    def median(self) -> float:
+        return self.quantile(0.5)
+
+    def quantiles(self, qs: Iterable[float]) -> Dict[str, float]:
+        """
+            Description: Gets several quantiles of the values
+            Args:
+                qs (Iterable[float]): Quantiles between 0 and 1
+
+            Returns: Value by quantile's name (p25, p90, p99.9...)
+        """
+        return {get_quantile_name(q): self.quantile(q) for q in qs}
+
+    def _to_sketch(self):
+        self.sketch = KllSketch(self.sketch_k)
+        self.sketch.add(self.values)
+        self.values = array('d')
+        self.sorted_values = None
+
+
+class KllSketch:
+    """
+        Description: KLL sketch (Karnin, Lang and Liberty). Values are stored in levels of typed arrays, where every
+            value of the level h represents 2^h values. When the sketch is full, a level is sorted and half of its
+            values (the odd or the even ones, randomly) are promoted to the next level.
+    """
+
+    __slots__ = ("k", "count", "levels", "random")
+
+    def __init__(self, k: int = DEFAULT_SKETCH_K):
+        self.k = k
+        self.count = 0
+        self.levels: List[array] = [array('d')]
+        self.random = random.Random(SKETCH_SEED)
+
+    def add(self, values: Iterable[float]):
+        """
+            Description: Adds several values to the sketch
+            Args:
+                values (Iterable[float]): Values for being added
+        """
+        for value in values:
+            self.levels[0].append(value)
+            self.count += 1
+            if len(self.levels[0]) >= self._get_capacity(0):
+                self._compress()
+
+    def merge(self, other: 'KllSketch'):
+        """
+            Description: Adds the values summarized by another sketch
+            Args:
+                other (KllSketch): Sketch of other values
+        """
+        while len(self.levels) < len(other.levels):
+            self.levels.append(array('d'))
+        for level, values in zip(self.levels, other.levels):
+            level.extend(values)
+        self.count += other.count
+        self._compress()
+
+    def quantile(self, q: float) -> float:
+        """
+            Description: Gets an approximation of a quantile
+            Args:
+                q (float): Quantile between 0 and 1
+
+            Returns: The value whose estimated rank is the closest to q
+        """
+        weighted_values = self._get_weighted_values()
+        rank = q * (self.count - 1)
+        cumulative_weight = 0
+        for value, weight in weighted_values:
+            cumulative_weight += weight
+            if cumulative_weight > rank:
+                return value
+
+        return weighted_values[-1][0]
+
+    def _get_weighted_values(self) -> List[Tuple[float, int]]:
+        return sorted((value, 2 ** num_level) for num_level, level in enumerate(self.levels) for value in level)
+
+    def _get_capacity(self, num_level: int) -> int:
+        depth = len(self.levels) - num_level - 1
+        return max(SKETCH_MIN_CAPACITY, math.ceil(self.k * SKETCH_CAPACITY_RATIO ** depth))
+
+    def _compress(self):
+        for num_level in range(len(self.levels)):
+            if len(self.levels[num_level]) < self._get_capacity(num_level):
+                continue
+            if num_level + 1 == len(self.levels):
+                self.levels.append(array('d'))
+
+            values = sorted(self.levels[num_level])
+            kept = values[-1:] if len(values) % 2 else []
+            values = values[:len(values) - len(kept)]
+            self.levels[num_level + 1].extend(values[self.random.randint(0, 1)::2])
+            self.levels[num_level] = array('d', kept)
+
+
+def get_quantile_name(q: float) -> str:
+    """
+        Description: Gets the name of a quantile
+        Args:
+            q (float): Quantile between 0 and 1
+
+        Returns: The name (p50 for the median)
+    """
+    return f"p{q * 100:g}"
@@ -0,0 +1,88 @@
+import gzip
+import json
+import logging
+import os
+import threading
+
+RESULTS_FORMATS = ("json", "ndjson")
+DEFAULT_RESULTS_FORMAT = "json"
+DEFAULT_RESULTS_BUFFER_SIZE = 1024 * 1024
+
+
+class NdjsonWriter:
+    """
+        Description: Writes records as newline-delimited JSON through a buffer, so every record can be written as
+            soon as it's ready and dropped. Records go to a temporary file which atomically replaces the final path
+            when the writer is closed, so the path never holds a partial run; if the run fails, the records already
+            written are kept in the temporary file. The output is compressed with gzip if the path ends with .gz.
+            Several threads can write at the same time.
+    """
+
+    def __init__(self, path: str, buffer_size: int = DEFAULT_RESULTS_BUFFER_SIZE):
+        """
+            Args:
+                path (str): Path of the results
+                buffer_size (int): Bytes buffered before being written in the file
+        """
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.lock = threading.Lock()
+        self.num_records = 0
+        self.file = open(self.tmp_path, "wb", buffering=buffer_size)
+        self.output = gzip.GzipFile(fileobj=self.file, mode="wb") if path.endswith(".gz") else self.file
+
+    def write(self, record: dict, flush: bool = False):
+        """
+            Description: Writes a record in a line
+            Args:
+                record (dict): Record (JSON serializable)
+                flush (bool): If the buffer is written in the file after the record, so it survives a crash
+        """
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode()
+        with self.lock:
+            self.output.write(line)
+            self.num_records += 1
+            if flush:
+                self._flush()
+
+    def flush(self):
+        """
+            Description: Writes the buffered records in the file, so they survive a crash
+        """
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        """
+            Description: Writes the pending records and replaces the final path with the temporary file
+        """
+        self._close_files()
+        os.replace(self.tmp_path, self.path)
+        logging.info(f"{self.num_records} records written in {self.path}.")
+
+    def abort(self):
+        """
+            Description: Closes the writer without replacing the final path. The records already written are kept
+                in the temporary file
+        """
+        self._close_files()
+        logging.error(f"The results weren't finished, {self.num_records} records were kept in {self.tmp_path}.")
+
+    def __enter__(self) -> 'NdjsonWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _flush(self):
+        self.output.flush()
+        self.file.flush()
+
+    def _close_files(self):
+        with self.lock:
+            if self.output is not self.file:
+                self.output.close()
+            self.file.close()
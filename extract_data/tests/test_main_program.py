@@ -1,10 +1,44 @@
+import base64
+import gzip
 import json
+import random
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
 
 import pytest
+from eth_abi import encode_abi
+from eth_utils import event_abi_to_log_topic
+from hexbytes import HexBytes
+from web3 import Web3
+from web3.datastructures import AttributeDict
 
-from extract_data.main_program.blockchain_interactions import events_contract
+from extract_data.benchmarks.run_benchmarks import HEAD_BLOCK, SCENARIOS, get_app_config, run_benchmarks
+from extract_data.benchmarks.synthetic_node import SyntheticChain, serve
+from extract_data.main_program.balance_history import BalanceHistory
+from extract_data.main_program.blockchain_interactions import block_range_planner, block_scheduler, events_contract
+from extract_data.main_program.blockchain_interactions.block_blooms import BloomIndex, get_bloom
+from extract_data.main_program.blockchain_interactions.block_resolver import BlockTimeResolver, parse_time
+from extract_data.main_program.blockchain_interactions.block_scheduler import CpuPool
+from extract_data.main_program.blockchain_interactions.block_range_planner import BlockRangePlanner
+from extract_data.main_program.blockchain_interactions.chain_follower import ChainFollower, ReorgSafeAggregate
+from extract_data.main_program.blockchain_interactions.block_timestamps import BlockTimestampCache
+from extract_data.main_program.blockchain_interactions.contract_registry import ContractRegistry, get_event_index
+from extract_data.main_program.blockchain_interactions.event_columns import EventColumns, Field
+from extract_data.main_program.blockchain_interactions.endpoint_pool import LoadBalancedProvider
+from extract_data.main_program.blockchain_interactions.event_store import EventStore
 from extract_data.main_program.blockchain_interactions.events_contract import Event
+from extract_data.main_program.blockchain_interactions.instrumentation import RpcMetrics
+from extract_data.main_program.blockchain_interactions.logs_fetcher import LogsFetcher, merge_topics
+from extract_data.main_program.blockchain_interactions.raw_log_decoder import RawLogDecoder, get_hex_value
+from extract_data.main_program.blockchain_interactions.rpc_cache import RpcCache
 from extract_data.main_program.blockchain_interactions.web3_manager import Web3Manager
+from extract_data.main_program.mainApp import append_balance_changes, classify_window, get_address_result, \
+    get_airdrop_blocks, run_phases, transactions_by_token
+from extract_data.main_program.quantiles import QuantileSummary
+from extract_data.main_program.results_writer import NdjsonWriter
 
 
 def read_app_config():
@@ -43,3 +77,584 @@ def test_contract_symbol():
     web3_manager = Web3Manager(read_app_config())
     contract = web3_manager.get_contract_erc20("0xdAC17F958D2ee523a2206206994597C13D831ec7", "USDT")
     assert web3_manager.get_symbol_contract(contract) == "USDT"
+
+
+def test_block_windows_cover_interval_in_order():
+    windows = block_scheduler.get_block_windows(100, 125, 10)
+    assert windows == [(100, 109), (110, 119), (120, 125)]
+
+
+def test_work_units_keep_order():
+    results = block_scheduler.run_work_units(list(range(50)), lambda work_unit: work_unit * 2, max_workers=8)
+    assert results == [work_unit * 2 for work_unit in range(50)]
+
+
+def test_iter_work_units_yields_in_order_and_only_prefetches_a_few():
+    started = []
+    results = block_scheduler.iter_work_units(list(range(50)), lambda work_unit: started.append(work_unit) or
+                                              work_unit * 2, max_workers=8, max_prefetch=3)
+    assert [next(results) for _ in range(5)] == [0, 2, 4, 6, 8]
+    assert len(started) <= 8
+    results.close()
+    assert len(started) < 50
+
+
+def test_planner_splits_overflowed_windows_and_grows_sparse_ones():
+    def fetch_window(from_block, to_block):
+        if from_block < 1000 and to_block - from_block >= 100:
+            raise ValueError({'code': -32005, 'message': 'query returned more than 10000 results'})
+        return list(range(from_block, to_block + 1)) if from_block < 1000 else []
+
+    planner = BlockRangePlanner(initial_window_size=400, max_window_size=100000)
+    events = planner.get_events("TOKEN.Transfer", 0, 50000, fetch_window)
+
+    assert events == list(range(0, 1000))
+    assert planner.get_window_size("TOKEN.Transfer") > 400
+    assert planner.get_total_rpc_calls() < 40
+
+
+def test_planner_raises_persistent_rate_limits_without_splitting(monkeypatch):
+    monkeypatch.setattr(block_range_planner, "BACKOFF_SECONDS", 0)
+    requested_windows = []
+
+    def fetch_window(from_block, to_block):
+        requested_windows.append((from_block, to_block))
+        raise ValueError({'code': -32005, 'message': 'rate limit exceeded'})
+
+    planner = BlockRangePlanner(initial_window_size=400, max_retries=2)
+    with pytest.raises(ValueError, match="rate limit exceeded"):
+        planner.get_events("TOKEN.Transfer", 0, 1000, fetch_window)
+
+    assert requested_windows == [(0, 399)] * 3
+    assert planner.get_window_size("TOKEN.Transfer") == 400
+    for message in ["invalid block range params", "header not found for block range start"]:
+        assert not block_range_planner.is_overflow_error(ValueError(message))
+
+
+def test_merge_topics_of_several_events():
+    topics = merge_topics([["0xaa", "0x01"], ["0xbb", ["0x01", "0x02"]], ["0xcc"]])
+    assert topics == [["0xaa", "0xbb", "0xcc"]]
+
+    topics = merge_topics([["0xaa", "0x01", None], ["0xbb", "0x02", None]])
+    assert topics == [["0xaa", "0xbb"], ["0x01", "0x02"]]
+
+
+def test_classify_transfers_and_swaps_by_transaction_hash():
+    events_from = {("MATIC", Event.Transfer): [{"transactionHash": HexBytes("0x01")},
+                                               {"transactionHash": HexBytes("0x02")}],
+                   ("MATIC", Event.Swap): [{"transactionHash": HexBytes("0x03")}]}
+
+    history = transactions_by_token(events_from, {HexBytes("0x02").hex()}, "0x" + "11" * 20, ["MATIC", "USDT"])
+
+    assert history["MATIC"] == ([HexBytes("0x01").hex()], [HexBytes("0x02").hex()], [HexBytes("0x03").hex()])
+    assert history["USDT"] == ([], [], [])
+
+
+def test_block_timestamps_fetch_missing_blocks_once(tmp_path):
+    fetched_blocks = []
+
+    def fetch_timestamps(block_numbers):
+        fetched_blocks.extend(block_numbers)
+        return {block_number: 1600000000 + 12 * block_number for block_number in block_numbers}
+
+    db_path = str(tmp_path / "block_timestamps.sqlite")
+    cache = BlockTimestampCache(fetch_timestamps, lambda: 100, db_path)
+    assert cache.load([5, 5, 150, 7]) == {5: 1600000060, 7: 1600000084, 150: 1600001800}
+    assert cache.get_timestamp(7) == 1600000084
+    assert fetched_blocks == [5, 7, 150]
+
+    cache = BlockTimestampCache(fetch_timestamps, lambda: 100, db_path)
+    cache.load([5, 7, 150])
+    assert fetched_blocks == [5, 7, 150, 150]
+
+
+def test_bloom_index_only_queries_blocks_which_may_match(tmp_path):
+    token = HexBytes("0x7d1afa7b718fb893db30a3abc0cfc608aacfebb0")
+    other_token = HexBytes("0xdAC17F958D2ee523a2206206994597C13D831ec7")
+    transfer = HexBytes(Web3.keccak(text="Transfer(address,address,uint256)"))
+    sender = HexBytes("0x" + "00" * 12 + "5d260e01805af8b848f0b627e43951ea18336267")
+    blooms = {block_number: bytes(256) for block_number in range(100, 200)}
+    blooms[110] = get_bloom([token, transfer, sender])
+    blooms[112] = get_bloom([token, transfer])
+    blooms[150] = get_bloom([other_token, transfer, sender])
+    blooms[190] = get_bloom([token, transfer, sender])
+    fetched_blocks = []
+
+    def fetch_blooms(block_numbers):
+        fetched_blocks.extend(block_numbers)
+        return {block_number: blooms[block_number] for block_number in block_numbers}
+
+    db_path = str(tmp_path / "block_blooms.sqlite")
+    bloom_index = BloomIndex(fetch_blooms, lambda: 180, db_path, max_gap=5, chunk_size=30)
+    assert bloom_index.get_candidate_ranges(100, 199, [Web3.toChecksumAddress(token)], [transfer.hex()]) == \
+        [(110, 112), (190, 190)]
+    assert bloom_index.get_candidate_ranges(100, 199, [], [[transfer.hex()], None, [sender.hex()]]) == \
+        [(110, 110), (150, 150), (190, 190)]
+    assert fetched_blocks == list(range(100, 200)) + list(range(181, 200))
+
+    bloom_index = BloomIndex(fetch_blooms, lambda: 180, db_path, max_fetched_blocks=10)
+    assert bloom_index.get_candidate_ranges(100, 185, [other_token.hex()], []) == [(150, 150)]
+    assert len(fetched_blocks) == 124
+
+    bloom_index = BloomIndex(fetch_blooms, lambda: 180, max_fetched_blocks=10)
+    assert bloom_index.get_candidate_ranges(100, 199, [Web3.toChecksumAddress(token)], [transfer.hex()]) == \
+        [(100, 199)]
+    assert len(fetched_blocks) == 124
+
+
+def test_block_resolver_finds_blocks_by_timestamp_with_few_fetches(tmp_path):
+    def get_block_timestamp(block_number):
+        return 0 if block_number == 0 else 1600000000 + 13 * block_number + block_number % 7 * 3
+
+    fetched_blocks = []
+
+    def fetch_timestamps(block_numbers):
+        fetched_blocks.extend(block_numbers)
+        return {block_number: get_block_timestamp(block_number) for block_number in block_numbers}
+
+    db_path = str(tmp_path / "block_timestamps.sqlite")
+    resolver = BlockTimeResolver(BlockTimestampCache(fetch_timestamps, lambda: 99000, db_path), lambda: 100000)
+    for timestamp in [get_block_timestamp(54321), get_block_timestamp(54321) - 1, get_block_timestamp(99990) + 5]:
+        block_number = resolver.get_block_by_timestamp(timestamp)
+        assert get_block_timestamp(block_number - 1) < timestamp <= get_block_timestamp(block_number)
+    assert len(fetched_blocks) < 15
+    assert resolver.get_block_by_timestamp(get_block_timestamp(100000) + 1) == 100001
+    assert resolver.get_block_by_timestamp(-5) == 0
+    assert resolver.get_block_range(get_block_timestamp(54321), get_block_timestamp(54330) - 1) == (54321, 54329)
+    assert get_airdrop_blocks(SimpleNamespace(get_block_range=resolver.get_block_range), {"airdrop_info": {
+        "airdrop_from_time": get_block_timestamp(54321), "airdrop_to_time": get_block_timestamp(54330) - 1}}) == \
+        (54321, 54329)
+
+    num_fetched = len(fetched_blocks)
+    resolver = BlockTimeResolver(BlockTimestampCache(fetch_timestamps, lambda: 99000, db_path), lambda: 100000)
+    assert resolver.get_block_by_timestamp(get_block_timestamp(54321)) == 54321
+    assert len(fetched_blocks) == num_fetched
+    assert parse_time("2022-04-25T00:00:00Z") == parse_time("2022-04-25T02:00:00+02:00") == 1650844800
+
+
+def test_chain_follower_rolls_back_only_the_blocks_after_a_reorg():
+    chain = {"head": 110, "branch": {}}
+    requested = []
+
+    def fetch_block_hashes(block_numbers):
+        requested.extend(block_numbers)
+        return {block_number: (chain["branch"].get(block_number, f"0x{block_number}"),
+                               chain["branch"].get(block_number - 1, f"0x{block_number - 1}"))
+                for block_number in block_numbers}
+
+    follower = ChainFollower(fetch_block_hashes, lambda: chain["head"], 100, confirmation_blocks=5, max_blocks=5)
+    claims = ReorgSafeAggregate(list, list.extend, [1])
+    for from_block, to_block in [(101, 105), (106, 110)]:
+        assert follower.poll()[1:3] == (from_block, to_block)
+        claims.add(from_block, to_block, list(range(from_block, to_block + 1)))
+        claims.finalize(to_block - 5)
+    assert claims.pending == [(106, 110, [106, 107, 108, 109, 110])] and len(claims.checkpoint) == 6
+
+    chain["branch"] = {block_number: f"0x{block_number}b" for block_number in range(108, 113)}
+    chain["head"] = 112
+    requested.clear()
+    update = follower.poll()
+    assert update.rollback_block == 108 and max(requested) == 112
+    follower.rewind(claims.rollback(update.rollback_block) - 1)
+    assert claims.value == [1] + list(range(101, 106))
+    assert follower.poll()[1:3] == (106, 110)
+
+
+def test_event_store_only_fetches_blocks_not_stored(tmp_path):
+    fetched_ranges = []
+
+    def fetch_range(from_block, to_block):
+        fetched_ranges.append((from_block, to_block))
+        return [AttributeDict({
+            "args": AttributeDict({"amount": block_number}), "event": "AirDropped", "logIndex": 0,
+            "transactionIndex": 0, "transactionHash": HexBytes(block_number.to_bytes(32, "big")),
+            "address": "0xAd815dB0B31B76B33138482343605E71fa69CB59", "blockHash": HexBytes("0x01"),
+            "blockNumber": block_number}) for block_number in range(from_block, to_block + 1, 10)]
+
+    store = EventStore(str(tmp_path / "events.sqlite"))
+    keys = [("", "0xad815db0b31b76b33138482343605e71fa69cb59", "AirDropped")]
+
+    first_run = store.sync(keys, 0, 99, 89, fetch_range, lambda event: "")
+    second_run = store.sync(keys, 0, 119, 109, fetch_range, lambda event: "")
+
+    assert fetched_ranges == [(0, 99), (90, 119)]
+    assert [event["blockNumber"] for event in first_run] == list(range(0, 100, 10))
+    assert [event["blockNumber"] for event in second_run] == list(range(0, 120, 10))
+    assert second_run[0]["transactionHash"] == HexBytes((0).to_bytes(32, "big"))
+
+
+def test_raw_log_decoder_slices_static_events_and_falls_back_to_web3():
+    address = "0x7d1afa7b718fb893db30a3abc0cfc608aacfebb0"
+    sender, receiver = "0x" + "11" * 20, "0x" + "22" * 20
+    transfer_abi = {"type": "event", "name": "Transfer", "anonymous": False, "inputs": [
+        {"name": "from", "type": "address", "indexed": True}, {"name": "to", "type": "address", "indexed": True},
+        {"name": "value", "type": "uint256", "indexed": False}]}
+    memo_abi = {"type": "event", "name": "Memo", "anonymous": False, "inputs": [
+        {"name": "text", "type": "string", "indexed": False}]}
+    contract = Web3().eth.contract(Web3.toChecksumAddress(address), abi=[transfer_abi, memo_abi])
+    transfer_topic = event_abi_to_log_topic(transfer_abi).hex()
+    memo_topic = event_abi_to_log_topic(memo_abi).hex()
+
+    def raw_log(block_number, topics, data):
+        return {"address": address, "topics": topics, "data": data, "blockNumber": hex(block_number),
+                "logIndex": "0x0", "transactionHash": "0x" + f"{block_number:064x}", "transactionIndex": "0x0",
+                "blockHash": "0x" + "00" * 32, "removed": False}
+
+    raw_logs = [
+        raw_log(10, [transfer_topic, "0x" + sender[2:].rjust(64, "0"), "0x" + receiver[2:].rjust(64, "0")],
+                "0x" + f"{10 ** 30:064x}"),
+        raw_log(11, [transfer_topic, "0x" + receiver[2:].rjust(64, "0"), "0x" + sender[2:].rjust(64, "0")],
+                "0x" + f"{5:064x}"),
+        raw_log(12, [memo_topic], "0x" + encode_abi(["string"], ["hello"]).hex())
+    ]
+    decoder = RawLogDecoder({(address, transfer_topic): transfer_abi, (address, memo_topic): memo_abi},
+                            {(address, transfer_topic): contract.events.Transfer(),
+                             (address, memo_topic): contract.events.Memo()}, {"from": sender})
+
+    columns = decoder.decode(raw_logs)
+    transfers = columns[(address, transfer_topic)]
+    assert list(transfers["blockNumber"]) == [10]
+    assert get_hex_value(transfers["to"], 20, 0) == receiver
+    assert transfers["value"] == [10 ** 30]
+    assert get_hex_value(transfers["transactionHash"], 32, 0) == "0x" + f"{10:064x}"
+    assert columns[(address, memo_topic)]["text"] == ["hello"]
+
+
+def test_event_columns_append_windows_and_slice_without_copying():
+    fields = {"blockNumber": Field('Q', "blockNumber"), "amount": Field('d', "amount", lambda wei: wei / 10 ** 18)}
+    routes = {("cDAI", Event.Mint): 0, ("cDAI", Event.Burnt): 1}
+
+    columns = EventColumns.empty(fields)
+    columns += EventColumns.from_events(
+        [AttributeDict({"blockNumber": 10, "args": AttributeDict({"amount": 2 * 10 ** 18})})], fields,
+        lambda event: 1)
+    columns += EventColumns.from_decoded(
+        {("cDAI", Event.Mint): {"blockNumber": [11, 12], "amount": [10 ** 18, 3 * 10 ** 18]}}, routes, fields)
+
+    assert len(columns) == 3
+    assert list(columns["amount"]) == [2.0, 1.0, 3.0]
+    assert [list(blocks) for blocks in columns.split_by_route(2, "blockNumber")] == [[11, 12], [10]]
+
+    window = columns.slice(1, 3)
+    assert list(window["blockNumber"]) == [11, 12]
+    assert window["blockNumber"].obj is columns["blockNumber"]
+
+
+def test_balance_history_replays_transfers_from_the_current_balance():
+    # Received 5 in block 105, sent 3 and received 1 in block 110, sent 2 in block 120: 11 at the end of block 130
+    history = BalanceHistory(11, 100, 130, [(110, -3), (105, 5), (120, -2), (110, 1)])
+
+    assert history.opening_balance == 10
+    assert history.get_series() == [(99, 10), (105, 15), (110, 13), (120, 11)]
+    assert history.get_snapshots([98, 99, 104, 110, 119, 130, 131]) == \
+        {98: None, 99: 10, 104: 10, 110: 13, 119: 13, 130: 11, 131: None}
+
+
+def test_quantile_summary_is_exact_until_the_limit_and_merges_sketches():
+    randomizer = random.Random(1)
+    values = [randomizer.uniform(0, 24) for _ in range(1001)]
+    exact = QuantileSummary()
+    for index in range(0, len(values), 100):
+        window = QuantileSummary()
+        window.add(values[index:index + 100])
+        exact.merge(window)
+    assert exact.is_exact
+    assert exact.median() == statistics.median(values)
+
+    values = [randomizer.random() for _ in range(50000)]
+    merged = QuantileSummary(max_exact_values=1000, sketch_k=200)
+    for index in range(0, len(values), 5000):
+        window = QuantileSummary(max_exact_values=1000, sketch_k=200)
+        window.add(values[index:index + 5000])
+        merged.merge(window)
+    assert not merged.is_exact and merged.count == len(values)
+    for q, value in merged.quantiles([0.1, 0.5, 0.9]).items():
+        assert abs(value - float(q[1:]) / 100) < 0.02
+
+    with pytest.raises(ValueError):
+        QuantileSummary().median()
+
+
+def test_provider_avoids_failing_nodes_and_keeps_the_run():
+    class NodeHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            body = json.dumps({"jsonrpc": "2.0", "id": request["id"], "result": "0x1"}).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    node = ThreadingHTTPServer(("127.0.0.1", 0), NodeHandler)
+    threading.Thread(target=node.serve_forever, daemon=True).start()
+    try:
+        metrics = RpcMetrics()
+        provider = LoadBalancedProvider(["http://127.0.0.1:1", f"http://127.0.0.1:{node.server_address[1]}"],
+                                        metrics=metrics)
+        with metrics.phase("requests"):
+            results = [provider.make_request("eth_blockNumber", [])["result"] for _ in range(10)]
+        stats = provider.get_stats()
+    finally:
+        node.shutdown()
+
+    assert results == ["0x1"] * 10
+    assert stats[0]["requests"] == 1
+    assert stats[1]["requests"] == 10
+    method_stats = metrics.to_json()["methods"]["eth_blockNumber"]
+    assert method_stats["http_requests"] == 11 and method_stats["errors"] == 1
+    assert sum(method_stats["latency_histogram"].values()) == 11 and method_stats["bytes_received"] > 0
+    assert 'extract_data_rpc_latency_seconds_bucket{method="eth_blockNumber",le="+Inf"} 11' in metrics.to_prometheus()
+    assert "requests" in metrics.to_json()["phases"]
+
+
+def test_provider_sends_batches_rejected_by_a_node_to_another_one():
+    def get_handler(answer):
+        class NodeHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.dumps(answer(json.loads(self.rfile.read(int(self.headers["Content-Length"]))))).encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return NodeHandler
+
+    nodes = [
+        ThreadingHTTPServer(("127.0.0.1", 0), get_handler(
+            lambda request: {"jsonrpc": "2.0", "id": None, "error": {"code": -32005, "message": "rate limited"}})),
+        ThreadingHTTPServer(("127.0.0.1", 0), get_handler(
+            lambda request: [{"jsonrpc": "2.0", "id": request[0]["id"], "result": "0x1"}])),
+        ThreadingHTTPServer(("127.0.0.1", 0), get_handler(
+            lambda request: [{"jsonrpc": "2.0", "id": item["id"], "result": hex(item["id"])} for item in request])),
+    ]
+    for node in nodes:
+        threading.Thread(target=node.serve_forever, daemon=True).start()
+    try:
+        metrics = RpcMetrics()
+        provider = LoadBalancedProvider([f"http://127.0.0.1:{node.server_address[1]}" for node in nodes],
+                                        metrics=metrics)
+        results = [response["result"] for response in provider.make_batch_request([("eth_blockNumber", [])] * 3)]
+        stats = provider.get_stats()
+
+        rejecting_provider = LoadBalancedProvider([f"http://127.0.0.1:{nodes[0].server_address[1]}"])
+        with pytest.raises(ValueError, match="rate limited"):
+            rejecting_provider.make_batch_request([("eth_blockNumber", [])])
+    finally:
+        for node in nodes:
+            node.shutdown()
+
+    assert results == ["0x0", "0x1", "0x2"]
+    assert [node_stats["requests"] for node_stats in stats] == [1, 1, 1]
+    assert metrics.to_json()["methods"]["eth_blockNumber"]["errors"] == 2
+
+
+def test_rpc_cache_reuses_finalized_responses_and_replays_recorded_runs(tmp_path):
+    requests_sent = []
+
+    def make_request(method, params):
+        requests_sent.append(method)
+        return {"jsonrpc": "2.0", "id": 0, "result": f"{method}{len(requests_sent)}"}
+
+    db_path = str(tmp_path / "rpc_cache.sqlite")
+    cache = RpcCache(db_path, "record", lambda: 1000, 64)
+    old_block = cache.request("eth_getBlockByNumber", ("0x10", False), make_request)
+    cache.request("eth_getBalance", ("0xAB", "latest"), make_request)
+    assert cache.request("eth_getBlockByNumber", ["0x10", False], make_request) == old_block
+    cache.request("eth_getBalance", ("0xab", "latest"), make_request)
+    assert requests_sent == ["eth_getBlockByNumber", "eth_getBalance", "eth_getBalance"]
+
+    replay = RpcCache(db_path, "replay", lambda: 1000, 64)
+    assert replay.request("eth_getBalance", ("0xab", "latest"), make_request)["result"] == "eth_getBalance3"
+    with pytest.raises(ValueError):
+        replay.request("eth_blockNumber", (), make_request)
+
+    cache = RpcCache(str(tmp_path / "small.sqlite"), "cache", lambda: 1000, 64, max_bytes=2000)
+    for block_number in range(100):
+        cache.request("eth_getBlockByNumber", (hex(block_number), False), make_request)
+    assert 0 < cache.total_size <= 2000
+    stored = cache.connection.execute("SELECT COUNT(*), SUM(size) FROM rpc_responses").fetchone()
+    assert stored[0] > 1 and stored[1] == cache.total_size
+
+    recording = RpcCache(str(tmp_path / "small_record.sqlite"), "record", lambda: 1000, 64, max_bytes=2000)
+    with pytest.raises(ValueError, match="rpc_cache_max_mb"):
+        for block_number in range(100):
+            recording.request("eth_getBlockByNumber", (hex(block_number), False), make_request)
+    assert recording.get("eth_getBlockByNumber", ("0x0", False)) is not None
+
+
+def test_recorded_runs_are_replayed_without_the_node(tmp_path):
+    app_config = get_app_config("", num_tokens=1, num_addresses=2, num_blocks=2000, config_overrides={
+        "cache_folder": str(tmp_path), "rpc_cache_mode": "record", "block_window_size": 200,
+        "max_concurrent_requests": 8})
+    chain = SyntheticChain(HEAD_BLOCK, [erc20["tokenAddress"] for erc20 in app_config["erc20_list"]],
+                           [ctoken["tokenAddress"] for ctoken in app_config["compound_tokens"]],
+                           app_config["airdrop_info"]["airdrop_address_example"], app_config["addresses_get_info"],
+                           log_density=0.3, max_logs_per_request=10)
+    node = serve(chain)
+    threading.Thread(target=node.serve_forever, daemon=True).start()
+    try:
+        app_config["ethereum_node"] = f"http://127.0.0.1:{node.server_address[1]}"
+        web3_manager = Web3Manager(app_config)
+        latest_block = web3_manager.get_latest_block_number()
+        chain.head_block += 10
+        assert web3_manager.get_latest_block_number() == latest_block
+        recorded = [scenario(web3_manager, app_config) for scenario in SCENARIOS.values()]
+    finally:
+        node.shutdown()
+        node.server_close()
+
+    app_config["rpc_cache_mode"] = "replay"
+    web3_manager = Web3Manager(app_config)
+    assert [scenario(web3_manager, app_config) for scenario in SCENARIOS.values()] == recorded
+    assert web3_manager.get_latest_block_number() == latest_block
+    assert web3_manager.rpc_cache.misses == 0
+
+
+def test_benchmarks_run_offline_against_the_synthetic_node():
+    results = run_benchmarks(["airdrop", "balances"], log_density=0.2, num_tokens=1, num_addresses=2,
+                             num_blocks=1000, trace_memory=False)
+
+    airdrop, balances = results["scenarios"]["airdrop"], results["scenarios"]["balances"]
+    assert results["parameters"]["num_blocks"] == 1000
+    assert airdrop["rpc_calls"]["eth_getLogs"] >= 1 and airdrop["logs"] > 0 and airdrop["logs_per_second"] > 0
+    assert balances["rpc_calls"]["eth_getBalance"] == 2 and balances["rpc_calls"]["eth_call"] == 2
+    assert balances["total_rpc_calls"] == sum(calls for method, calls in balances["rpc_calls"].items()
+                                              if method != "http_requests")
+
+
+def test_balances_of_a_token_without_code_are_zero_instead_of_failing():
+    app_config = get_app_config("", num_tokens=2, num_addresses=2, num_blocks=100)
+    chain = SyntheticChain(HEAD_BLOCK, [app_config["erc20_list"][0]["tokenAddress"]], [],
+                           app_config["airdrop_info"]["airdrop_address_example"], app_config["addresses_get_info"])
+    node = serve(chain)
+    threading.Thread(target=node.serve_forever, daemon=True).start()
+    try:
+        app_config["ethereum_node"] = f"http://127.0.0.1:{node.server_address[1]}"
+        balances = Web3Manager(app_config).get_raw_balances(app_config["addresses_get_info"], app_config["erc20_list"])
+    finally:
+        node.shutdown()
+
+    for address in app_config["addresses_get_info"]:
+        assert balances[address]["ETH"] > 0 and balances[address]["TOKEN0"] > 0
+        assert balances[address]["TOKEN1"] == 0
+
+
+def test_contract_registry_reads_abis_lazily_and_indexes_events():
+    abi_path = "extract_data/tests/resources/abi_files/matic.abi.json"
+    registry = ContractRegistry(Web3(), {"MATIC": abi_path, "POL": abi_path, "MISSING": "missing.abi.json"})
+    contract = registry.get_contract("0x7d1afa7b718fb893db30a3abc0cfc608aacfebb0", "MATIC")
+
+    assert registry.get_contract("0x7D1AfA7B718fb893dB30A3aBc0Cfc608AaCfeBB0", "MATIC") is contract
+    assert registry.get_contract("0x" + "11" * 20, "POL").abi is contract.abi
+    assert list(registry.abis) == [abi_path]
+    transfer = get_event_index(contract)["Transfer"]
+    assert transfer.topic == HexBytes(event_abi_to_log_topic(transfer.abi))
+    assert transfer.decoder.event_name == "Transfer"
+    assert events_contract.get_event_from_contract(Event.Mint, contract, 1, 2, "MATIC") == []
+
+
+def test_classify_window_in_a_process_pool_like_in_the_calling_thread():
+    address, other = "0x" + "11" * 20, "0x" + "22" * 20
+    registry = ContractRegistry(Web3(), {"MATIC": "extract_data/tests/resources/abi_files/matic.abi.json"})
+    contracts = {"MATIC": registry.get_contract("0x7d1afa7b718fb893db30a3abc0cfc608aacfebb0", "MATIC")}
+    fetcher_from = LogsFetcher(Web3(), contracts, [Event.Transfer, Event.Swap], {"from": [address]})
+    fetcher_to = LogsFetcher(Web3(), contracts, [Event.Transfer], {"to": [address]})
+    topic = get_event_index(contracts["MATIC"])["Transfer"].topic.hex()
+
+    def raw_transfer(sender, receiver, transaction):
+        return {"address": "0x7d1afa7b718fb893db30a3abc0cfc608aacfebb0", "blockNumber": hex(transaction),
+                "topics": [topic, "0x" + sender[2:].rjust(64, "0"), "0x" + receiver[2:].rjust(64, "0")],
+                "data": "0x" + f"{1:064x}", "logIndex": "0x0", "transactionHash": "0x" + f"{transaction:064x}",
+                "transactionIndex": "0x0", "blockHash": "0x" + "00" * 32, "removed": False}
+
+    args = (fetcher_from.get_shard_spec(), [raw_transfer(address, other, 1), raw_transfer(address, other, 2)],
+            fetcher_to.get_shard_spec(), [raw_transfer(other, address, 2)], [address], ["MATIC"])
+    cpu_pool = CpuPool(1)
+    try:
+        sharded = cpu_pool.run(classify_window, *args)
+    finally:
+        cpu_pool.shutdown()
+
+    assert sharded == CpuPool(0).run(classify_window, *args)
+    assert sharded[address]["MATIC"] == (["0x" + f"{1:064x}"], ["0x" + f"{2:064x}"], [])
+
+
+def test_balance_changes_read_the_amount_from_the_argument_of_the_abi():
+    address, other, token = "0x" + "11" * 20, "0x" + "22" * 20, "0x" + "33" * 20
+    transfer_abi = {"anonymous": False, "name": "Transfer", "type": "event", "inputs": [
+        {"indexed": True, "name": "from", "type": "address"}, {"indexed": True, "name": "to", "type": "address"},
+        {"indexed": False, "name": "amount", "type": "uint256"}]}
+    contracts = {"TOKEN": Web3().eth.contract(Web3.toChecksumAddress(token), abi=[transfer_abi])}
+    fetcher_from = LogsFetcher(Web3(), contracts, [Event.Transfer], {"from": [address]})
+    fetcher_to = LogsFetcher(Web3(), contracts, [Event.Transfer], {"to": [address]})
+
+    def raw_transfer(sender, receiver, block_number, amount):
+        return {"address": token, "blockNumber": hex(block_number),
+                "topics": ["0x" + event_abi_to_log_topic(transfer_abi).hex(), "0x" + sender[2:].rjust(64, "0"),
+                           "0x" + receiver[2:].rjust(64, "0")],
+                "data": "0x" + f"{amount:064x}", "logIndex": "0x0", "transactionHash": "0x" + f"{block_number:064x}",
+                "transactionIndex": "0x0", "blockHash": "0x" + "00" * 32, "removed": False}
+
+    _, balance_changes = classify_window(
+        fetcher_from.get_shard_spec(), [raw_transfer(address, other, 2, 3)], fetcher_to.get_shard_spec(),
+        [raw_transfer(other, address, 1, 5)], [address], ["TOKEN"], True)
+    assert balance_changes[address]["TOKEN"] == [(1, 5), (2, -3)]
+
+    balance_changes = {address: {"TOKEN": []}}
+    append_balance_changes(balance_changes, fetcher_to, [AttributeDict({
+        "args": {"from": other, "to": Web3.toChecksumAddress(address), "amount": 5}, "event": "Transfer",
+        "address": Web3.toChecksumAddress(token), "blockNumber": 1})], 'to', 1)
+    assert balance_changes[address]["TOKEN"] == [(1, 5)]
+
+
+def test_concurrent_phases_cancel_the_rest_when_one_fails():
+    web3_manager = SimpleNamespace(metrics=RpcMetrics(), cancel_event=threading.Event())
+    executed = []
+
+    def long_phase(manager, app_config):
+        return block_scheduler.run_work_units(list(range(1000)), lambda work_unit: executed.append(time.sleep(0.01)),
+                                              2, "long", manager.cancel_event)
+
+    def failing_phase(manager, app_config):
+        time.sleep(0.05)
+        raise ValueError("node down")
+
+    assert run_phases(web3_manager, {"concurrent_phases": True}, [("a", lambda *args: 1), ("b", lambda *args: 2)]) \
+        == [1, 2]
+    with pytest.raises(ValueError):
+        run_phases(web3_manager, {"concurrent_phases": True}, [("long", long_phase), ("failing", failing_phase)])
+    assert web3_manager.cancel_event.is_set() and len(executed) < 100
+    assert set(web3_manager.metrics.to_json()["phases"]) == {"a", "b", "long", "failing"}
+
+
+def test_ndjson_writer_replaces_the_results_only_when_finished(tmp_path):
+    path = str(tmp_path / "results.ndjson.gz")
+    transaction_hashes = ["0x" + "ab" * 32, "0x" + "cd" * 32]
+    info_address = {"Address": "0x01", "Type": "Private key address", "CurrentBalanceETH": 1.5,
+                    "CurrentBalanceMATIC": 2.0, "TransfersHistoryMATIC": transaction_hashes, "SwapHistoryMATIC": []}
+    app_config = {"erc20_list": [{"name": "MATIC"}]}
+
+    with pytest.raises(RuntimeError):
+        with NdjsonWriter(path) as writer:
+            writer.write({"Record": "AirdropInfo", "Number_claims": 3}, flush=True)
+            raise RuntimeError("phase failed")
+    assert not (tmp_path / "results.ndjson.gz").exists()
+    with gzip.open(path + ".tmp", "rt") as infile:
+        assert [json.loads(line) for line in infile] == [{"Record": "AirdropInfo", "Number_claims": 3}]
+
+    with NdjsonWriter(path) as writer:
+        writer.write({"Record": "Address", **get_address_result(info_address, app_config, compact_hashes=True)})
+        writer.write({"Record": "AirdropInfo", "Number_claims": 3})
+    with gzip.open(path, "rt") as infile:
+        records = [json.loads(line) for line in infile]
+    history = records[0]["DetailsERC20"]["MATIC"]["TransactionsHistory"]
+    assert base64.b64decode(history["Transfers"]).hex() == "ab" * 32 + "cd" * 32
+    assert history["Swaps"] == "" and records[1]["Number_claims"] == 3
+    assert get_address_result(info_address, app_config)["DetailsERC20"]["MATIC"]["TransactionsHistory"] == \
+        {"Transfers": transaction_hashes, "Swaps": []}